@@ -0,0 +1,100 @@
+"""
+Speedup of the partitioned multi-process mode (src/partition.py) against the number of worker processes.
+
+    python -m benchmarks.partitioned --grid 6x6 --demand 60 --partitions 1 2 4 8 --output partitioned.json
+
+Every configuration is compared with a single-process run of the same scenario and seed; with --check the
+final vehicle states of both runs are compared as well.
+"""
+import argparse
+import json
+import os
+import platform
+import time
+
+from benchmarks.scaling import git_commit, parse_grid
+from src.partition import PartitionedSimulation, vehicle_states
+from src.runner import load_scenario
+from src.simulator import ENGINES
+
+
+def run_single(scenario, engine, seed, scenario_kwargs, warmup_steps, steps):
+    sim = load_scenario(scenario, engine, **scenario_kwargs)
+    sim.set_seed(seed)
+    sim.run(warmup_steps)
+    start = time.perf_counter()
+    sim.run(steps)
+    return time.perf_counter() - start, vehicle_states(sim)
+
+
+def run_partitioned(scenario, engine, seed, scenario_kwargs, partitions, warmup_steps, steps):
+    with PartitionedSimulation(scenario, partitions, engine=engine, seed=seed,
+                               scenario_kwargs=scenario_kwargs) as sim:
+        sim.run(warmup_steps)
+        start = time.perf_counter()
+        sim.run(steps)
+        elapsed = time.perf_counter() - start
+        return elapsed, sim.vehicle_states(), sim.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Partitioned simulation speedup against worker count")
+    parser.add_argument('--scenario', default='examples.grid')
+    parser.add_argument('--grid', type=parse_grid, default=(6, 6), help="COLSxROWS of examples.grid")
+    parser.add_argument('--demand', type=int, default=60)
+    parser.add_argument('--engine', choices=ENGINES, default='object')
+    parser.add_argument('--partitions', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--warmup', type=float, default=30, help="simulated seconds before measuring")
+    parser.add_argument('--duration', type=float, default=30, help="simulated seconds measured")
+    parser.add_argument('--check', action='store_true', help="compare the vehicle states with the single run")
+    parser.add_argument('--output', default='bench_partitioned.json')
+    args = parser.parse_args(argv)
+
+    scenario_kwargs = {}
+    if args.scenario == 'examples.grid':
+        scenario_kwargs = {'cols': args.grid[0], 'rows': args.grid[1], 'demand': args.demand}
+    dt = load_scenario(args.scenario, args.engine, **scenario_kwargs).dt
+    warmup_steps = int(round(args.warmup / dt))
+    steps = int(round(args.duration / dt))
+
+    single_time, single_states = run_single(args.scenario, args.engine, args.seed, scenario_kwargs,
+                                            warmup_steps, steps)
+    print("single process   %8.1f steps/s  vehicles %d" % (steps / single_time, len(single_states)))
+    results = []
+    for partitions in args.partitions:
+        elapsed, states, summary = run_partitioned(args.scenario, args.engine, args.seed, scenario_kwargs,
+                                                   partitions, warmup_steps, steps)
+        result = {
+            'partitions': partitions,
+            'steps_per_second': steps / elapsed,
+            'speedup': single_time / elapsed,
+            'cut_connectors': summary['cut_connectors'],
+            'segments_per_partition': summary['segments_per_partition'],
+        }
+        if args.check:
+            result['identical'] = states == single_states
+        print("%2d partitions    %8.1f steps/s  speedup %5.2fx  cut connectors %-4d%s" % (
+            partitions, result['steps_per_second'], result['speedup'], result['cut_connectors'],
+            '  identical %s' % result['identical'] if args.check else ''))
+        results.append(result)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': dict(vars(args), grid=list(args.grid)),
+        'single_steps_per_second': steps / single_time,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("results written to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
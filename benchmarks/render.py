@@ -0,0 +1,155 @@
+"""
+Vehicle drawing cost of the Visualizer: pooled glyphs (src/gui/vehicle_glyphs.py) against the former immediate
+mode, which created a draw node, a line and up to four texts per vehicle every frame and deleted them the next.
+
+    python -m benchmarks.render --vehicles 2000 --frames 300 --output render.json
+    python -m benchmarks.render --vehicles 2000 --no-labels --viewport
+
+The grid is warmed up until the requested number of vehicles is on the network, then every frame advances the
+simulation by --steps-per-frame steps (not timed) and draws every vehicle (timed). Without --viewport only the
+dearpygui item updates are measured; with it every frame is also rendered in a window.
+"""
+import argparse
+import json
+import logging
+import math
+import platform
+import time
+
+import dearpygui.dearpygui as dpg
+import numpy as np
+
+from benchmarks.scaling import git_commit, parse_grid
+from src.gui.vehicle_glyphs import LABEL_OFFSETS, LABEL_SIZE, THICKNESS, VehicleGlyphs
+from src.runner import active_vehicles, load_scenario
+from src.simulator import ENGINES
+
+MODES = ('immediate', 'pooled')
+COLOR = (0, 0, 200, 127)
+ZOOM = 5
+
+
+def placements(sim, labels):
+    """(vehicle, position, heading, texts, anchor) of every vehicle, computed as in Visualizer.draw_vehicles"""
+    placed = []
+    for segment in sim.segments.values():
+        on_segment = [(lane, vehicle) for lane in segment.lanes for vehicle in lane.vehicles]
+        if not on_segment:
+            continue
+        positions, headings = segment.positions([vehicle.x for _, vehicle in on_segment],
+                                                segment.lane_offsets([lane.lane_index for lane, _ in on_segment]))
+        for (lane, vehicle), position, heading in zip(on_segment, positions.tolist(), headings.tolist()):
+            texts = anchor = None
+            if labels:
+                texts = (f"V:{vehicle.v:.2f}", f"at:{str(lane.lane_id) + ' ' + str(vehicle.x)}",
+                         f"A:{vehicle.a:.2f}", f"ID:{vehicle.id}")
+                anchor = (position[0] + vehicle.length * math.cos(heading),
+                          position[1] + vehicle.length * math.sin(heading) + 2)
+            placed.append((vehicle, position, heading, texts, anchor))
+    for connector in sim.connectors.values():
+        if not connector.vehicles:
+            continue
+        positions, headings = connector.positions([vehicle.x for vehicle in connector.vehicles],
+                                                  connector.lane_offsets([vehicle.at_lane
+                                                                          for vehicle in connector.vehicles]))
+        for vehicle, position, heading in zip(connector.vehicles, positions.tolist(), headings.tolist()):
+            placed.append((vehicle, position, heading, None, None))
+    return placed
+
+
+def draw_immediate(placed):
+    dpg.delete_item("BenchCanvas", children_only=True)
+    for vehicle, position, heading, texts, anchor in placed:
+        node = dpg.add_draw_node(parent="BenchCanvas")
+        dpg.draw_line((0, 0), (vehicle.length, 0), thickness=THICKNESS * ZOOM, color=COLOR, parent=node)
+        dpg.apply_transform(node, dpg.create_translation_matrix(position) *
+                            dpg.create_rotation_matrix(heading, [0, 0, 1]))
+        if texts is not None:
+            for text, (dx, dy) in zip(texts, LABEL_OFFSETS):
+                dpg.draw_text(pos=(anchor[0] + dx, anchor[1] + dy), text=text, size=LABEL_SIZE * ZOOM,
+                              color=(255, 255, 255), parent="BenchCanvas")
+
+
+def draw_pooled(glyphs, placed):
+    glyphs.begin_frame(ZOOM)
+    for vehicle, position, heading, texts, anchor in placed:
+        glyphs.place(vehicle.id, vehicle.length, position, heading, COLOR, texts, anchor)
+    glyphs.end_frame()
+
+
+def bench_mode(mode, args):
+    logging.getLogger().setLevel(logging.WARNING)
+    sim = load_scenario('examples.grid', args.engine, cols=args.grid[0], rows=args.grid[1], demand=args.demand)
+    sim.set_seed(args.seed)
+    while len(active_vehicles(sim)) < args.vehicles and sim.t < args.max_warmup:
+        sim.run(int(round(1 / sim.dt)))
+
+    dpg.create_context()
+    if args.viewport:
+        dpg.create_viewport(title='ToySim render benchmark', width=1200, height=800)
+        dpg.setup_dearpygui()
+        dpg.show_viewport()
+    with dpg.window(tag="BenchWindow", width=1200, height=800):
+        dpg.add_draw_node(tag="BenchCanvas")
+    glyphs = VehicleGlyphs("BenchCanvas")
+
+    latencies = np.empty(args.frames)
+    vehicle_counts = np.empty(args.frames, dtype=np.int64)
+    for i in range(args.frames):
+        sim.run(args.steps_per_frame)
+        placed = placements(sim, args.labels)
+        start = time.perf_counter()
+        if mode == 'pooled':
+            draw_pooled(glyphs, placed)
+        else:
+            draw_immediate(placed)
+        if args.viewport:
+            dpg.render_dearpygui_frame()
+        latencies[i] = time.perf_counter() - start
+        vehicle_counts[i] = len(placed)
+    dpg.destroy_context()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {'mode': mode, 'vehicles_mean': float(vehicle_counts.mean()), 'frames': args.frames,
+            'frame_ms': {'mean': latencies.mean() * 1000, 'p50': p50, 'p99': p99, 'max': latencies.max() * 1000},
+            'items_created': glyphs.created if mode == 'pooled' else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vehicle drawing benchmark of the Visualizer")
+    parser.add_argument('--vehicles', type=int, default=2000, help="vehicles on the network before measuring")
+    parser.add_argument('--grid', type=parse_grid, default=(6, 6), help="examples.grid size as COLSxROWS")
+    parser.add_argument('--demand', type=int, default=60)
+    parser.add_argument('--engine', choices=ENGINES, default='vectorized')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-warmup', type=float, default=1800, help="simulated seconds at most to reach "
+                                                                      "--vehicles")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--steps-per-frame', type=int, default=1)
+    parser.add_argument('--no-labels', dest='labels', action='store_false', help="draw the vehicles only")
+    parser.add_argument('--viewport', action='store_true', help="also render every frame in a window")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.modes:
+        result = bench_mode(mode, args)
+        print("%-10s vehicles~%-6.0f frame mean %7.2f ms  p50 %7.2f ms  p99 %7.2f ms" % (
+            mode, result['vehicles_mean'], result['frame_ms']['mean'], result['frame_ms']['p50'],
+            result['frame_ms']['p99']))
+        results.append(result)
+    by_mode = {result['mode']: result['frame_ms']['mean'] for result in results}
+    if len(by_mode) == 2:
+        print("pooled speedup over immediate: %.2fx" % (by_mode['immediate'] / by_mode['pooled']))
+    if args.output:
+        report = {'meta': {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'python': platform.python_version(), 'labels': args.labels, 'viewport': args.viewport},
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("results written to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Scaling benchmark of Simulation.update_with_lane on grids of the examples/test6 intersection.
+
+    python -m benchmarks.scaling --grids 1x1 2x2 4x4 --demands 10 30 60 --output before.json
+    python -m benchmarks.scaling --compare before.json after.json
+
+Every configuration runs in a fresh process so that peak RSS is measured per configuration.
+No display is needed.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+from src.simulator import ENGINES
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+VARIANTS = ('signalised', 'unsignalised')
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if platform.system() == 'Darwin' else peak / 1024
+
+
+def bench_config(config):
+    """
+    Warm the grid up, then time every step of the measurement window
+    :param config: dict(cols, rows, demand, variant, engine, warmup, duration)
+    """
+    from examples.grid import build_simulation
+    from src.runner import active_vehicles
+
+    logging.getLogger().setLevel(logging.WARNING)
+    sim = build_simulation(engine=config['engine'], cols=config['cols'], rows=config['rows'],
+                           demand=config['demand'], signalised=config['variant'] == 'signalised')
+    warmup_steps = int(round(config['warmup'] / sim.dt))
+    steps = int(round(config['duration'] / sim.dt))
+
+    latencies = np.empty(steps)
+    vehicle_counts = np.empty(steps, dtype=np.int64)
+    for _ in range(warmup_steps):
+        sim.update_with_lane()
+    for i in range(steps):
+        start = time.perf_counter()
+        sim.update_with_lane()
+        latencies[i] = time.perf_counter() - start
+        vehicle_counts[i] = len(active_vehicles(sim))
+    total = latencies.sum()
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    return dict(config,
+                segments=len(sim.segments),
+                connectors=len(sim.connectors),
+                vehicles_mean=float(vehicle_counts.mean()),
+                vehicles_max=int(vehicle_counts.max()),
+                steps=steps,
+                steps_per_second=steps / total,
+                speedup=config['duration'] / total,
+                latency_ms={'mean': total / steps * 1000, 'p50': p50, 'p90': p90, 'p99': p99,
+                            'max': latencies.max() * 1000},
+                peak_rss_mb=peak_rss_mb())
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(grids, demands, variants, engine, warmup, duration):
+    configs = [dict(cols=cols, rows=rows, demand=demand, variant=variant, engine=engine,
+                    warmup=warmup, duration=duration)
+               for cols, rows in grids for demand in demands for variant in variants]
+    results = []
+    # one fresh process per configuration, peak RSS is per process
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+        for result in pool.imap(bench_config, configs):
+            print("%dx%d demand=%-4s %-12s vehicles~%-6.0f %8.1f steps/s  p50 %6.2f ms  p99 %6.2f ms  rss %s MB" % (
+                result['cols'], result['rows'], result['demand'], result['variant'], result['vehicles_mean'],
+                result['steps_per_second'], result['latency_ms']['p50'], result['latency_ms']['p99'],
+                None if result['peak_rss_mb'] is None else round(result['peak_rss_mb'])))
+            results.append(result)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def config_key(result):
+    return result['cols'], result['rows'], result['demand'], result['variant'], result['engine']
+
+
+def compare(before_path, after_path):
+    """Print the steps/s and p99 ratio of every configuration present in both files"""
+    with open(before_path) as f:
+        before = {config_key(r): r for r in json.load(f)['results']}
+    with open(after_path) as f:
+        after = {config_key(r): r for r in json.load(f)['results']}
+    print("%-34s %12s %12s %8s %8s" % ('config', 'before st/s', 'after st/s', 'ratio', 'p99'))
+    for key in sorted(before.keys() & after.keys()):
+        b, a = before[key], after[key]
+        print("%-34s %12.1f %12.1f %7.2fx %7.2fx" % (
+            "%dx%d d=%s %s %s" % key, b['steps_per_second'], a['steps_per_second'],
+            a['steps_per_second'] / b['steps_per_second'], b['latency_ms']['p99'] / a['latency_ms']['p99']))
+
+
+def parse_grid(text):
+    cols, rows = text.lower().split('x')
+    return int(cols), int(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmark on tiled test6 intersections")
+    parser.add_argument('--grids', nargs='+', type=parse_grid, default=[(1, 1), (2, 2), (4, 4)],
+                        help="grid sizes as COLSxROWS")
+    parser.add_argument('--demands', nargs='+', type=int, default=[10, 30, 60],
+                        help="vehicles per minute and per boundary generator")
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--engine', choices=ENGINES, default='object')
+    parser.add_argument('--warmup', type=float, default=60, help="simulated seconds before measuring")
+    parser.add_argument('--duration', type=float, default=30, help="simulated seconds measured")
+    parser.add_argument('--output', default='bench_scaling.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run_suite(args.grids, args.demands, args.variants, args.engine, args.warmup, args.duration)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("results written to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
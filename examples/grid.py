@@ -0,0 +1,133 @@
+from src import simulator as ts
+from src.vehicle.vehicle_generator import VehicleGenerator
+from src.signal.SignalGroup import TrafficSignal
+
+# geometry of the four-arm intersection of test6.py
+LANE_SPACE = 3
+INTERSECTION_SIZE = 36
+LENGTH = 100
+# gap between the end of an outgoing arm and the start of the neighbour's incoming arm
+LINK_LENGTH = 10
+PITCH = 2 * (LENGTH + INTERSECTION_SIZE / 2) + LINK_LENGTH
+
+
+def segment_id(col, row, arm):
+    return '%d-%d-%d' % (col, row, arm)
+
+
+def add_intersection(sim, col, row, signalised=True):
+    """
+    Add the test6 intersection centred on grid cell (col, row). Arms 0-3 go in, 4-7 go out
+    (SOUTH, EAST, NORTH, WEST), all with three lanes.
+    """
+    cx, cy = col * PITCH, row * PITCH
+    s = lambda arm: segment_id(col, row, arm)
+    p = lambda x, y: (cx + x, cy + y)
+    h = INTERSECTION_SIZE / 2
+    far = LENGTH + h
+
+    # Intersection in
+    sim.create_segment(s(0), (p(LANE_SPACE * 1.5, far), p(LANE_SPACE * 1.5, h)), 3)
+    sim.create_segment(s(1), (p(far, -LANE_SPACE * 1.5), p(h, -LANE_SPACE * 1.5)), 3)
+    sim.create_segment(s(2), (p(-LANE_SPACE * 1.5, -far), p(-LANE_SPACE * 1.5, -h)), 3)
+    sim.create_segment(s(3), (p(-far, LANE_SPACE * 1.5), p(-h, LANE_SPACE * 1.5)), 3)
+    # Intersection out
+    sim.create_segment(s(4), (p(-LANE_SPACE * 1.5, h), p(-LANE_SPACE * 1.5, far)), 3)
+    sim.create_segment(s(5), (p(h, LANE_SPACE * 1.5), p(far, LANE_SPACE * 1.5)), 3)
+    sim.create_segment(s(6), (p(LANE_SPACE * 1.5, -h), p(LANE_SPACE * 1.5, -far)), 3)
+    sim.create_segment(s(7), (p(-h, -LANE_SPACE * 1.5), p(-far, -LANE_SPACE * 1.5)), 3)
+
+    def connect(points, arm_from, arm_to, connect_info, generative_bezier_curve=False):
+        sim.create_connector(s(arm_from) + '_' + s(arm_to), points, s(arm_from), s(arm_to), connect_info,
+                             generative_bezier_curve=generative_bezier_curve)
+
+    # Straight connection
+    straight = [[0, 0], [1, 1], [2, 2]]
+    connect((p(LANE_SPACE * 1.5, h), p(LANE_SPACE * 1.5, -h)), 0, 6, straight)
+    connect((p(-LANE_SPACE * 1.5, -h), p(-LANE_SPACE * 1.5, h)), 2, 4, straight)
+    connect((p(-h, LANE_SPACE * 1.5), p(h, LANE_SPACE * 1.5)), 3, 5, straight)
+    connect((p(h, -LANE_SPACE * 1.5), p(-h, -LANE_SPACE * 1.5)), 1, 7, straight)
+    # Right turn connection
+    connect((p(LANE_SPACE * 2.5, h), p(LANE_SPACE * 2.5, LANE_SPACE * 2.5),
+             p(h, LANE_SPACE * 2.5)), 0, 5, [[2, 2]], True)
+    connect((p(h, -LANE_SPACE * 2.5), p(LANE_SPACE * 2.5, -LANE_SPACE * 2.5),
+             p(LANE_SPACE * 2.5, -h)), 1, 6, [[2, 2]], True)
+    connect((p(-LANE_SPACE * 2.5, -h), p(-LANE_SPACE * 2.5, -LANE_SPACE * 2.5),
+             p(-h, -LANE_SPACE * 2.5)), 2, 7, [[2, 2]], True)
+    connect((p(-h, LANE_SPACE * 2.5), p(-LANE_SPACE * 2.5, LANE_SPACE * 2.5),
+             p(-LANE_SPACE * 2.5, h)), 3, 4, [[2, 2]], True)
+
+    if signalised:
+        sim.add_signal(TrafficSignal('%d-%d' % (col, row), [[sim.segments[s(0)], sim.segments[s(2)]],
+                                                             [sim.segments[s(1)], sim.segments[s(3)]]]))
+
+
+def link(sim, from_segment, to_segment):
+    """Straight three-lane connector from the end of an outgoing arm to the start of the neighbour's incoming arm"""
+    start = sim.segments[from_segment].points[-1]
+    end = sim.segments[to_segment].points[0]
+    sim.create_connector(from_segment + '_' + to_segment, (start, end), from_segment, to_segment,
+                         [[0, 0], [1, 1], [2, 2]])
+
+
+def through_route(cells, arm_in, arm_out):
+    path = []
+    for col, row in cells:
+        path += [segment_id(col, row, arm_in), segment_id(col, row, arm_out)]
+    return path
+
+
+def build_simulation(engine='object', cols=2, rows=2, demand=30, signalised=True):
+    """
+    Tile the test6 intersection into a cols x rows grid. Every boundary arm gets a generator whose vehicles
+    drive straight through the whole row / column, a quarter of them turning right at the first intersection.
+    :param engine: see Simulation
+    :param demand: vehicles per minute and per generator
+    :param signalised: False leaves every intersection without traffic signal
+    """
+    sim = ts.Simulation(engine=engine)
+    for col in range(cols):
+        for row in range(rows):
+            add_intersection(sim, col, row, signalised)
+
+    for col in range(cols):
+        for row in range(rows):
+            if col + 1 < cols:
+                link(sim, segment_id(col, row, 5), segment_id(col + 1, row, 3))
+                link(sim, segment_id(col + 1, row, 7), segment_id(col, row, 1))
+            if row + 1 < rows:
+                link(sim, segment_id(col, row, 4), segment_id(col, row + 1, 2))
+                link(sim, segment_id(col, row + 1, 6), segment_id(col, row, 0))
+
+    routes = []
+    for row in range(rows):
+        # eastbound enters on arm 3 of the first column, westbound on arm 1 of the last one
+        routes.append((through_route([(col, row) for col in range(cols)], 3, 5), 4, (0, row)))
+        routes.append((through_route([(col, row) for col in reversed(range(cols))], 1, 7), 6, (cols - 1, row)))
+    for col in range(cols):
+        # northbound enters on arm 2 of the first row, southbound on arm 0 of the last one
+        routes.append((through_route([(col, row) for row in range(rows)], 2, 4), 7, (col, 0)))
+        routes.append((through_route([(col, row) for row in reversed(range(rows))], 0, 6), 5, (col, rows - 1)))
+
+    for path, right_arm, (col, row) in routes:
+        right_turn = [path[0], segment_id(col, row, right_arm)]
+        sim.add_vehicle_generator(VehicleGenerator(
+            'vg' + path[0],
+            {'vehicles': [
+                (3, {'path': path, 'v': 12}),
+                (1, {'path': right_turn, 'v': 12}),
+            ],
+                'vehicle_rate': demand,
+            }))
+    return sim
+
+
+if __name__ == '__main__':
+    from src.gui.visualizer import Visualizer
+
+    ts.configure_logging(log_file='app.log')
+    sim = build_simulation()
+
+    win = Visualizer(sim)
+    win.run()
+    win.show()
@@ -0,0 +1,292 @@
+"""
+Checkpoints of the dynamic state of a Simulation, restored into a simulation of the same network, and forks of a
+warmed-up simulation into worker processes.
+
+    sim.run(warmup_steps)
+    data = sim.checkpoint('warm.ckpt')                  # bytes, also written to the file
+    ...
+    sim.restore(data)                                    # or sim.restore('warm.ckpt'), exactly the state above
+
+    def scenario(sim, factor):                           # runs in a worker, on a copy of the warmed-up state
+        for gen in sim.vehicle_generator:
+            gen.vehicle_rate *= factor
+        sim.run(steps)
+        return sim.exited_vehicles
+    results = sim.fork(scenario, [0.8, 1.0, 1.2])        # one result per branch, in branch order
+
+A checkpoint holds the time and counters, every vehicle on a lane or connector queue (in lane / queue order, which
+gives the lead / follow links back), the upcoming vehicle of every generator, the generator timers and counters,
+the signal phases, the connector availability and the state of the random streams (Simulation.rng and the global
+random module). Vehicle state that changes while driving is stored as one NumPy column per field, the remaining
+vehicle attributes (parameters, path, ids) are pickled, so vehicles sharing a path share it in the checkpoint
+too. The geometry is not part of a checkpoint: it is restored into a simulation built from the same scenario,
+checked against the segment / connector / lane layout recorded in the checkpoint.
+
+Not part of the state: observers (event log, trajectory recorder, detectors, travel times, profiler), vehicles
+that already left the network (Simulation.vehicles only keeps the vehicles on it after a restore) and the
+vectorized engine's slot arrays, which are rebuilt from the restored vehicles.
+
+fork() uses the 'fork' start method: the workers inherit the simulation with its geometry, each branch restores
+the checkpoint taken before forking and runs from there, so neither the warm-up nor the network is recomputed.
+"""
+import io
+import multiprocessing
+import pickle
+import random
+import struct
+
+import numpy as np
+
+from src.geometry.lanes import VehicleChain
+from src.vehicle.vehicle import Vehicle
+from src.vehicle.vehicle_arrays import VehicleArrays
+
+MAGIC = b'TSCK'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sI')
+
+# vehicle attributes stored as columns, everything else in a vehicle's __dict__ is pickled
+STATE = np.dtype([
+    ('x', '<f8'),
+    ('v', '<f8'),
+    ('a', '<f8'),
+    # NaN for None
+    ('present_a', '<f8'),
+    ('t', '<f8'),
+    ('lc_unlock_t', '<f8'),
+    ('v_max', '<f8'),
+    # NaN for None, see Vehicle
+    ('trip_start', '<f8'),
+    ('entered_t', '<f8'),
+    ('current_road_index', '<i4'),
+    ('at_lane', '<i4'),
+    ('stopped', '?'),
+    ('slowing_down', '?'),
+    # segment / connector number in the network layout, -1 for the upcoming vehicle of a generator
+    ('road', '<i4'),
+    # lane index on a segment, connection number (see _connections) on a connector, generator number
+    ('place', '<i4'),
+])
+# float columns that stand for None as NaN
+OPTIONAL = ('present_a', 'trip_start', 'entered_t')
+# links and caches, rebuilt on restore
+DERIVED = ('lead', 'follow', 'lane_block', 'slot', 'arrays', 'route', 'route_connectors')
+# generator attributes that are not plain state
+GENERATOR_DERIVED = ('rng', 'upcoming_vehicle', 'vehicles')
+
+
+def _layout(sim):
+    """Segments with their lane count and connectors with their connections, in simulation order"""
+    return ([(sid, len(segment.lanes)) for sid, segment in sim.segments.items()],
+            [(cid, _connections(connector)) for cid, connector in sim.connectors.items()])
+
+
+def _connections(connector):
+    return [(from_lane, to_lane) for from_lane, to_lane_dic in connector.connections.items() for to_lane in to_lane_dic]
+
+
+def _pack_random(state):
+    """Mersenne Twister state with its 625 words as an array, about half the pickled size of the tuple"""
+    version, words, gauss_next = state
+    return version, np.array(words, dtype=np.uint32), gauss_next
+
+
+def _unpack_random(state):
+    version, words, gauss_next = state
+    return version, tuple(words.tolist()), gauss_next
+
+
+def checkpoint(sim):
+    """
+    :return: the dynamic state of sim as bytes
+    """
+    rows = []
+    vehicles = []
+    for road, segment in enumerate(sim.segments.values()):
+        for lane in segment.lanes:
+            for veh in lane.vehicles:
+                vehicles.append(veh)
+                rows.append((road, lane.lane_index))
+    for road, connector in enumerate(sim.connectors.values(), start=len(sim.segments)):
+        connection = {}
+        for number, (from_lane, to_lane) in enumerate(_connections(connector)):
+            for veh in connector.connections[from_lane][to_lane]:
+                connection[veh] = number
+        # connector.vehicles is in entry order over all connections, the order of every queue included
+        for veh in connector.vehicles:
+            vehicles.append(veh)
+            rows.append((road, connection[veh]))
+    for number, gen in enumerate(sim.vehicle_generator):
+        vehicles.append(gen.upcoming_vehicle)
+        rows.append((-1, number))
+
+    state = np.zeros(len(vehicles), dtype=STATE)
+    columns = {name: [] for name in STATE.names}
+    attributes = []
+    dynamic = set(STATE.names) | set(DERIVED)
+    for veh in vehicles:
+        for name in STATE.names[:-2]:
+            columns[name].append(getattr(veh, name))
+        attributes.append({name: value for name, value in veh.__dict__.items() if name not in dynamic})
+    for name in STATE.names[:-2]:
+        values = columns[name]
+        if name in OPTIONAL:
+            values = [np.nan if value is None else value for value in values]
+        state[name] = values
+    if rows:
+        state['road'], state['place'] = np.array(rows, dtype=np.int64).T
+
+    data = {
+        'layout': _layout(sim),
+        't': sim.t,
+        'frame_count': sim.frame_count,
+        'exited_vehicles': sim.exited_vehicles,
+        'seed': sim.seed,
+        'streams': {name: _pack_random(stream.getstate()) for name, stream in sim._streams.items()},
+        'random': _pack_random(random.getstate()),
+        'vehicles': state,
+        'attributes': attributes,
+        'generators': [{name: value for name, value in gen.__dict__.items() if name not in GENERATOR_DERIVED}
+                       for gen in sim.vehicle_generator],
+        'signals': {sid: (signal.current_cycle_index, signal.last_t) for sid, signal in sim.traffic_signals.items()},
+        'available': [connector.is_available for connector in sim.connectors.values()],
+    }
+    out = io.BytesIO()
+    out.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+    pickle.dump(data, out, protocol=pickle.HIGHEST_PROTOCOL)
+    return out.getvalue()
+
+
+def load(data):
+    """
+    :param data: bytes of checkpoint(), or the path of a checkpoint file
+    :return: the checkpoint contents
+    """
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        with open(data, 'rb') as f:
+            data = f.read()
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a ToySim checkpoint")
+    if version != FORMAT_VERSION:
+        raise ValueError("unsupported checkpoint format %s" % version)
+    return pickle.loads(memoryview(data)[HEADER.size:])
+
+
+def restore(sim, data):
+    """
+    Replace the dynamic state of sim by that of a checkpoint taken from sim or a simulation of the same network
+    :param data: bytes of checkpoint(), or the path of a checkpoint file
+    """
+    data = load(data)
+    if data['layout'] != _layout(sim):
+        raise ValueError("the checkpoint was taken from a different network")
+    segments = list(sim.segments.values())
+    connectors = list(sim.connectors.values())
+    topology = sim.get_topology()
+
+    for segment in segments:
+        for lane in segment.lanes:
+            old = lane.vehicles
+            lane.vehicles = VehicleChain()
+            # observers compare versions to notice changes (see detectors.LoopDetector)
+            lane.vehicles.version = old.version + 1
+    for connector, available in zip(connectors, data['available']):
+        for to_lane_dic in connector.connections.values():
+            for d_que in to_lane_dic.values():
+                d_que.clear()
+        connector.vehicles = []
+        connector.is_available = available
+    connections = [_connections(connector) for connector in connectors]
+
+    state = data['vehicles']
+    columns = {name: state[name].tolist() for name in STATE.names}
+    for name in OPTIONAL:
+        columns[name] = [None if value != value else value for value in columns[name]]
+    sim.vehicles = {}
+    upcoming = {}
+    if sim.vehicle_arrays is not None:
+        sim.vehicle_arrays = VehicleArrays()
+    for i, attributes in enumerate(data['attributes']):
+        veh = Vehicle.__new__(Vehicle)
+        veh.__dict__.update(attributes)
+        for name in STATE.names[:-2]:
+            setattr(veh, name, columns[name][i])
+        veh.lead = veh.follow = veh.lane_block = veh.slot = None
+        veh.route, veh.route_connectors = topology.route(veh.path)
+        road, place = columns['road'][i], columns['place'][i]
+        if road < 0:
+            upcoming[place] = veh
+            continue
+        sim.vehicles[veh.id] = veh
+        if sim.vehicle_arrays is not None:
+            sim.vehicle_arrays.register(veh)
+        if road < len(segments):
+            segments[road].lanes[place].vehicles.append(veh)
+        else:
+            connector = connectors[road - len(segments)]
+            from_lane, to_lane = connections[road - len(segments)][place]
+            connector.add_vehicle(veh, from_lane, to_lane)
+
+    sim.t = data['t']
+    sim.frame_count = data['frame_count']
+    sim.exited_vehicles = data['exited_vehicles']
+    sim.seed = data['seed']
+    sim._streams = {}
+    for name, stream_state in data['streams'].items():
+        stream = sim._streams[name] = random.Random()
+        stream.setstate(_unpack_random(stream_state))
+    random.setstate(_unpack_random(data['random']))
+    for number, (gen, attributes) in enumerate(zip(sim.vehicle_generator, data['generators'])):
+        gen.__dict__.update(attributes)
+        gen.upcoming_vehicle = upcoming[number]
+        gen.rng = sim._streams.get('generator/%s' % gen.vg_id) if sim.seed is not None else None
+    for sid, (cycle_index, last_t) in data['signals'].items():
+        signal = sim.traffic_signals[sid]
+        signal.current_cycle_index = cycle_index
+        signal.last_t = last_t
+
+
+# (simulation, checkpoint, function, branches) inherited by the forked workers
+_forked = None
+
+
+def _run_branch(number):
+    sim, data, fn, branches = _forked
+    restore(sim, data)
+    return fn(sim, branches[number])
+
+
+def fork(sim, fn, branches, processes=None):
+    """
+    Run fn(sim, branch) for every branch in worker processes, each on the current state of sim
+    :param fn: function of a branch, its result must be picklable; fn itself and the branches are inherited,
+               so they need not be
+    :param processes: number of workers, None for every core, 0 to run the branches in this process one after the
+                      other (restoring the state before each one and after the last)
+    :return: results of fn in branch order
+    """
+    global _forked
+    branches = list(branches)
+    data = checkpoint(sim)
+    if processes == 0:
+        try:
+            results = []
+            for branch in branches:
+                restore(sim, data)
+                results.append(fn(sim, branch))
+            return results
+        finally:
+            restore(sim, data)
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise RuntimeError("fork() needs the 'fork' start method, use processes=0 on this platform")
+    # the observers belong to this process, the workers start without them
+    observers = sim.profiler, sim.event_log, sim.trajectory_recorder, sim.detectors, sim.travel_times
+    sim.profiler = sim.event_log = sim.trajectory_recorder = sim.detectors = sim.travel_times = None
+    _forked = (sim, data, fn, branches)
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            return pool.map(_run_branch, range(len(branches)), chunksize=1)
+    finally:
+        _forked = None
+        sim.profiler, sim.event_log, sim.trajectory_recorder, sim.detectors, sim.travel_times = observers
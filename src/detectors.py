@@ -0,0 +1,242 @@
+"""
+Virtual loop detectors on lanes and turning-movement counters on connectors, aggregated every interval.
+
+    detectors = sim.enable_detectors(interval=60, path='detectors.csv')
+    detectors.add_loop('0-0-3', x=40)                     # every lane of segment 0-0-3, 40 m from its start
+    detectors.add_turn_counter('c-0-0-3-5')               # every connection of the connector
+    sim.run(...)
+    read_detector_series('detectors.csv')                  # also while the run is in progress
+
+A loop detector remembers the vehicle directly upstream of it. After the vehicles moved, only that vehicle (and,
+if it crossed, its followers) is compared with the detector position, so a step costs O(1) per detector plus
+O(1) per crossing; only when vehicles were inserted into or removed from the lane (VehicleChain.version) the
+vehicles around the detector are searched again, O(log n). A turning counter is bumped when the simulator moves a
+vehicle onto the connector. Count, time-mean and space-mean (harmonic) speed and occupancy are accumulated per
+crossing; every interval one row per detector is appended to the series and, with a path, to a CSV file that is
+flushed right away.
+"""
+import csv
+import os
+
+FIELDS = ('t_start', 't_end', 'detector', 'kind', 'count', 'flow', 'mean_speed', 'harmonic_speed', 'occupancy')
+LOOP, TURN = 'loop', 'turn'
+# speeds below this (m/s) count as this for the occupancy and the harmonic mean, a vehicle stopped on the loop
+# would occupy it forever
+MIN_SPEED = 0.5
+
+
+class LoopDetector:
+    def __init__(self, name, lane, x, length=2.0):
+        """
+        :param lane: Lane the detector lies on
+        :param x: arc position (m) from the start of the lane, > 0
+        :param length: length of the loop (m), for the occupancy
+        """
+        self.name = name
+        self.lane = lane
+        self.x = x
+        self.length = length
+        # vehicle directly upstream of x after the last step, valid while the lane's chain version is unchanged
+        self.upstream = None
+        self.version = None
+        # vehicles counted in the last step, so a re-search does not count them twice
+        self.last_counted = ()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.speed_sum = 0.0
+        self.inverse_speed_sum = 0.0
+        # seconds the loop was covered, estimated from the speed of every vehicle crossing it
+        self.occupied = 0.0
+
+    def _count(self, veh):
+        speed = max(veh.v, MIN_SPEED)
+        self.count += 1
+        self.speed_sum += veh.v
+        self.inverse_speed_sum += 1 / speed
+        self.occupied += (veh.length + self.length) / speed
+
+    def update(self, dt):
+        """
+        Count the vehicles that crossed x in the last step
+        :param dt: simulation step (s)
+        """
+        chain = self.lane.vehicles
+        counted = []
+        if self.version == chain.version:
+            # same vehicles in the same order, they only moved forward: walk up from the upstream vehicle
+            veh = self.upstream
+            while veh is not None and veh.x >= self.x:
+                self._count(veh)
+                counted.append(veh)
+                veh = veh.follow
+            self.upstream = veh
+        else:
+            # vehicles entered or left the lane (lane changes, transfers): the vehicles now ahead of x that were
+            # behind it before the step crossed, their distance travelled is that of update_position_and_velocity
+            leader, self.upstream = chain.search(self.x)
+            self.version = chain.version
+            veh = leader
+            while veh is not None and veh.x - max(veh.v * dt + veh.a * dt * dt / 2, abs(veh.a) * dt * dt / 2) < self.x:
+                if veh not in self.last_counted:
+                    self._count(veh)
+                    counted.append(veh)
+                veh = veh.lead
+        self.last_counted = counted
+
+    def aggregate(self, duration):
+        return {'count': self.count,
+                'flow': self.count * 3600 / duration,
+                'mean_speed': self.speed_sum / self.count if self.count else None,
+                'harmonic_speed': self.count / self.inverse_speed_sum if self.count else None,
+                'occupancy': min(self.occupied / duration, 1.0)}
+
+
+class TurnCounter:
+    def __init__(self, name, connector):
+        self.name = name
+        self.connector = connector
+        # (from lane, to lane) -> [count, speed sum]
+        self.movements = {}
+
+    def reset(self):
+        self.movements = {}
+
+    def count(self, from_lane, to_lane, veh):
+        movement = self.movements.get((from_lane, to_lane))
+        if movement is None:
+            movement = self.movements[(from_lane, to_lane)] = [0, 0.0]
+        movement[0] += 1
+        movement[1] += veh.v
+
+
+class Detectors:
+    def __init__(self, simulation, interval=60.0, path=None):
+        """
+        :param interval: simulated seconds per aggregate
+        :param path: CSV file the aggregates are appended to, None to keep them in memory only
+        """
+        self.simulation = simulation
+        self.interval = interval
+        self.path = path
+        self.loops = []
+        # connector id -> TurnCounter
+        self.turn_counters = {}
+        # rows of FIELDS, one per detector (per movement for turning counters) and interval
+        self.series = []
+        self.start = simulation.t
+        self._file = None
+        self._writer = None
+        if path is not None:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'w', newline='')
+            self._writer = csv.DictWriter(self._file, FIELDS)
+            self._writer.writeheader()
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_loop(self, segment_id, x, lane_index=None, length=2.0, name=None):
+        """
+        :param lane_index: lane of the segment, None for a detector on every lane
+        :param name: detector name, lane ids are appended for a detector on every lane; defaults to lane id@x
+        :return: list of the LoopDetectors added
+        """
+        segment = self.simulation.segments[segment_id]
+        if not 0 < x < segment.length:
+            raise ValueError("detector position %s outside segment %s (length %.1f)" % (x, segment_id, segment.length))
+        lanes = segment.lanes if lane_index is None else [segment.lanes[lane_index]]
+        added = []
+        for lane in lanes:
+            if name is None:
+                detector_name = '%s@%g' % (lane.lane_id, x)
+            else:
+                detector_name = name if lane_index is not None else '%s/%s' % (name, lane.lane_id)
+            added.append(LoopDetector(detector_name, lane, x, length))
+        self.loops.extend(added)
+        return added
+
+    def add_loop_near(self, x, y, length=2.0, name=None, max_distance=5.0):
+        """
+        Place a loop on every lane of the segment closest to the world position (x, y), see SpatialIndex.nearest
+        """
+        found = self.simulation.get_spatial_index().nearest(x, y, max_distance)
+        if found is None or found[0].id not in self.simulation.segments:
+            raise ValueError("no segment within %s m of (%s, %s)" % (max_distance, x, y))
+        segment, arc_x, _ = found
+        return self.add_loop(segment.id, min(max(arc_x, 1e-3), segment.length - 1e-3), length=length, name=name)
+
+    def add_turn_counter(self, connector_id, name=None):
+        counter = self.turn_counters[connector_id] = TurnCounter(name or connector_id,
+                                                                 self.simulation.connectors[connector_id])
+        return counter
+
+    def entered_connector(self, connector, from_lane, to_lane, veh):
+        """Called by the simulator for every vehicle moved onto a connector"""
+        counter = self.turn_counters.get(connector.id)
+        if counter is not None:
+            counter.count(from_lane, to_lane, veh)
+
+    def update(self, t, dt):
+        """
+        Check the loops after the vehicles moved, and emit the aggregates when an interval is complete
+        :param t: simulation time at the end of the step
+        """
+        for loop in self.loops:
+            loop.update(dt)
+        if t - self.start >= self.interval - 1e-9:
+            self.emit(t)
+
+    def emit(self, t):
+        """Append the aggregates since the last emit to the series and reset the counts"""
+        duration = t - self.start
+        if duration <= 0:
+            return
+        rows = []
+        for loop in self.loops:
+            rows.append(dict(t_start=self.start, t_end=t, detector=loop.name, kind=LOOP, **loop.aggregate(duration)))
+            loop.reset()
+        for counter in self.turn_counters.values():
+            for (from_lane, to_lane), (count, speed_sum) in sorted(counter.movements.items()):
+                rows.append(dict(t_start=self.start, t_end=t, detector='%s:%s->%s' % (counter.name, from_lane, to_lane),
+                                 kind=TURN, count=count, flow=count * 3600 / duration, mean_speed=speed_sum / count,
+                                 harmonic_speed=None, occupancy=None))
+            counter.reset()
+        self.start = t
+        self.series.extend(rows)
+        if self._writer is not None:
+            self._writer.writerows(rows)
+            self._file.flush()
+
+    def close(self):
+        """Emit the last, partial interval and close the file"""
+        self.emit(self.simulation.t)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+def read_detector_series(path):
+    """
+    Rows written so far, numbers converted, empty fields as None; a last line still being written is skipped
+    """
+    with open(path, newline='') as f:
+        text = f.read()
+    if not text.endswith('\n'):
+        text = text[:text.rfind('\n') + 1]
+    rows = []
+    for row in csv.DictReader(text.splitlines()):
+        for field in FIELDS:
+            if field in ('detector', 'kind'):
+                continue
+            value = row[field]
+            row[field] = None if value == '' else int(value) if field == 'count' else float(value)
+        rows.append(row)
+    return rows
@@ -0,0 +1,187 @@
+"""
+Binary event log of a simulation run.
+
+    sim.enable_event_log('run.events')
+    ...
+    sim.disable_event_log()
+
+    python -m src.event_log run.events            # print as text
+    records, names = read_event_log('run.events')  # as a numpy structured array
+
+File layout: MAGIC, then a sequence of chunks. A chunk starts with one kind byte and a uint32:
+  - b'N': byte length of a JSON list of names, appended to the name table (ids count up from 0)
+  - b'R': number of records, followed by the raw RECORD array
+"""
+import json
+import struct
+import sys
+import threading
+from enum import IntEnum
+
+import numpy as np
+
+MAGIC = b'TSEVLOG1'
+
+RECORD = np.dtype([
+    ('t', '<f8'),
+    ('type', 'u1'),
+    # ids into the name table, -1 for none
+    ('vehicle', '<i4'),
+    ('src', '<i4'),
+    ('dst', '<i4'),
+    ('x', '<f4'),
+])
+
+
+class EventType(IntEnum):
+    # a generator put the vehicle on a lane, dst is the lane
+    VEHICLE_ENTERED = 1
+    LANE_CHANGE = 2
+    # src is the lane, dst the connector
+    SEGMENT_TO_CONNECTOR = 3
+    # src is the connector, dst the lane
+    CONNECTOR_TO_SEGMENT = 4
+    # end of the path, src is the lane
+    VEHICLE_EXITED = 5
+
+
+class EventLog:
+    """
+    Appends fixed-size records to a preallocated ring buffer; a background thread drains the buffer to the
+    file. Vehicle, lane and connector ids are interned into a name table that is written along the records.
+    If the writer falls a full buffer behind, the recording thread drains it itself, so no event is lost.
+    """
+    def __init__(self, path, capacity=1 << 16, flush_interval=0.5):
+        self.path = path
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=RECORD)
+        # records written / records drained, the ring position is the count modulo capacity
+        self.head = 0
+        self.tail = 0
+
+        self.names = {}
+        self._new_names = []
+
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._flush_interval = flush_interval
+        self._writer = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _name(self, name):
+        if name is None:
+            return -1
+        name = str(name)
+        index = self.names.get(name)
+        if index is None:
+            index = self.names[name] = len(self.names)
+            self._new_names.append(name)
+        return index
+
+    def record(self, t, event_type, vehicle, src=None, dst=None, x=0.0):
+        """
+        :param event_type: EventType
+        :param vehicle: vehicle id
+        :param src: id of the lane / connector left, None if not applicable
+        :param dst: id of the lane / connector entered, None if not applicable
+        """
+        if self.head - self.tail >= self.capacity:
+            self.flush()
+        self.buffer[self.head % self.capacity] = (t, event_type, self._name(vehicle), self._name(src),
+                                                  self._name(dst), x)
+        self.head += 1
+        if self.head - self.tail == self.capacity // 2:
+            self._wake.set()
+
+    def flush(self):
+        """Write every buffered record to the file"""
+        with self._lock:
+            # names are interned before their record is stored, so read head first
+            head = self.head
+            count = len(self._new_names)
+            if count:
+                names = json.dumps(self._new_names[:count]).encode('utf-8')
+                del self._new_names[:count]
+                self._file.write(b'N' + struct.pack('<I', len(names)) + names)
+            if head > self.tail:
+                start, end = self.tail % self.capacity, head % self.capacity
+                if start < end:
+                    chunk = self.buffer[start:end]
+                else:
+                    chunk = np.concatenate((self.buffer[start:], self.buffer[:end]))
+                self._file.write(b'R' + struct.pack('<I', len(chunk)) + chunk.tobytes())
+                self.tail = head
+            self._file.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._writer.join()
+        self.flush()
+        self._file.close()
+
+
+def read_event_log(path):
+    """
+    :return: (records, names), records is a RECORD structured array, names the list indexed by the id fields
+    """
+    names = []
+    chunks = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not an event log" % path)
+        while True:
+            kind = f.read(1)
+            if not kind:
+                break
+            size, = struct.unpack('<I', f.read(4))
+            if kind == b'N':
+                names.extend(json.loads(f.read(size).decode('utf-8')))
+            elif kind == b'R':
+                chunks.append(np.frombuffer(f.read(size * RECORD.itemsize), dtype=RECORD))
+            else:
+                raise ValueError("corrupted event log %s, unknown chunk %r" % (path, kind))
+    records = np.concatenate(chunks) if chunks else np.zeros(0, dtype=RECORD)
+    return records, names
+
+
+def format_events(records, names):
+    """Yield one line of text per record"""
+    def name(index):
+        return names[index] if index >= 0 else '-'
+
+    for record in records:
+        yield "t=%.3f %-20s veh %-8s %s -> %s x=%.2f" % (
+            record['t'], EventType(record['type']).name, name(record['vehicle']),
+            name(record['src']), name(record['dst']), record['x'])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python -m src.event_log EVENT_LOG")
+        return
+    records, names = read_event_log(argv[0])
+    for line in format_events(records, names):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -64,7 +64,6 @@ class Connector(Segment, ABC):
                 self.connections[connection_id].update({str(info[1]): deque()})
 
     def add_vehicle(self, veh, from_lane, to_lane):
-        print('add veh to connector: %s, from lane: %s, to lane: %s' % (self.id, from_lane, to_lane))
         target_connection = self.connections[from_lane][to_lane]
         target_connection.append(veh)
         if len(target_connection) > 1:
@@ -74,17 +73,18 @@ class Connector(Segment, ABC):
 
     def remove_vehicle(self, veh, from_lane, to_lane):
         target_connection = self.connections[from_lane][to_lane]
-        target_connection.remove(veh)
-        if veh.lead:
-            print('Error: vehicle is not at the front of the connection queue')
-            veh.lead.follow = veh.follow
+        i = target_connection.index(veh)
+        if i:
+            logging.debug("vehicle %s is not at the front of the connection queue of %s", veh.id, self.id)
+            # follow links stay in queue order (the vectorized engine walks them), even where veh.lead was cleared
+            target_connection[i - 1].follow = veh.follow
+        del target_connection[i]
         if veh.follow:
             veh.follow.lead = None
         # 清除当前车辆与前后车辆的关联
         veh.lead = None
         veh.follow = None
         self.vehicles.remove(veh)
-        logging.info("REMOVE VEH: %s, AT CONNECTOR: %s, POS: %s" % (veh.id, self.id, veh.x))
 
     def get_closest_lane(self, lane_id: int):
         """
@@ -4,6 +4,8 @@ CURVE_RESOLUTION = 50
 
 
 class CubicCurve(Segment):
+    curve_resolution = CURVE_RESOLUTION
+
     def __init__(self, id: str, points, num_lanes):
         # Store characteristic points
         self.id = id
@@ -20,12 +22,9 @@ class CubicCurve(Segment):
         #     y = t**3*self.end[1] + 3*t**2*(1-t)*self.control_2[1] + 3*(1-t)**2*t*self.control_1[1] + (1-t)**3*self.start[1]
         #     path.append((x, y))
 
+        # Arc-length parametrization, see Segment.derive_geometry
         super().__init__(id, points, num_lanes)
 
-        # Arc-length parametrization
-        normalized_path = self.find_normalized_path(CURVE_RESOLUTION)
-        self.points = normalized_path
-
     def compute_x(self, t):
         return t**3*self.end[0] + 3*t**2*(1-t)*self.control_2[0] + 3*(1-t)**2*t*self.control_1[0] + (1-t)**3*self.start[0]
 
@@ -1,8 +1,180 @@
-
 # coding: utf-8
 
 from collections import deque
-import logging
+from itertools import chain
+
+
+class _Block:
+    __slots__ = ('chain', 'pos', 'items')
+
+    def __init__(self, chain, pos, items):
+        self.chain = chain
+        # index of the block in chain.blocks
+        self.pos = pos
+        self.items = items
+
+
+class VehicleChain:
+    """
+    Vehicles of a lane, head (largest x) first.
+
+    Vehicles are kept in blocks of at most 2 * LOAD; every vehicle stores its block in `veh.lane_block`, so
+    it can be found without walking the lane. lead / follow pointers are set by the chain only:
+      - lead / follow lookup: O(1), they are the chain's links
+      - insert next to a known vehicle, remove: O(LOAD), plus O(n / LOAD) when a block splits or empties
+      - search by position (leader / follower around x): O(log n), x is non-increasing along the chain
+      - index of a vehicle, integer indexing: O(n / LOAD)
+    """
+    LOAD = 32
+
+    def __init__(self):
+        self.blocks = []
+        self.size = 0
+        # changes on every insert / remove, lets observers (e.g. loop detectors) keep a vehicle reference between steps
+        self.version = 0
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __iter__(self):
+        return chain.from_iterable([block.items for block in self.blocks])
+
+    def __contains__(self, veh):
+        block = getattr(veh, 'lane_block', None)
+        return block is not None and block.chain is self
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(chain.from_iterable([block.items for block in self.blocks]))[i]
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("vehicle index out of range")
+        if i == 0:
+            return self.blocks[0].items[0]
+        if i == self.size - 1:
+            return self.blocks[-1].items[-1]
+        for block in self.blocks:
+            if i < len(block.items):
+                return block.items[i]
+            i -= len(block.items)
+
+    @property
+    def head(self):
+        return self.blocks[0].items[0] if self.size else None
+
+    @property
+    def tail(self):
+        return self.blocks[-1].items[-1] if self.size else None
+
+    def index(self, veh):
+        """Position of a vehicle in the lane, 0 for the head"""
+        block = veh.lane_block
+        return sum(len(b.items) for b in self.blocks[:block.pos]) + block.items.index(veh)
+
+    def insert_after(self, lead, veh):
+        """
+        Insert veh right behind lead, or at the head of the lane when lead is None
+        """
+        if lead is None:
+            follow = self.head
+            if not self.blocks:
+                self.blocks.append(_Block(self, 0, []))
+            block = self.blocks[0]
+            block.items.insert(0, veh)
+        else:
+            follow = lead.follow
+            block = lead.lane_block
+            block.items.insert(block.items.index(lead) + 1, veh)
+        veh.lane_block = block
+        self.size += 1
+        self.version += 1
+
+        veh.lead = lead
+        veh.follow = follow
+        if lead is not None:
+            lead.follow = veh
+        if follow is not None:
+            follow.lead = veh
+
+        if len(block.items) > 2 * self.LOAD:
+            self._split(block)
+
+    def append(self, veh):
+        self.insert_after(self.tail, veh)
+
+    def remove(self, veh):
+        block = veh.lane_block
+        block.items.remove(veh)
+        self.size -= 1
+        self.version += 1
+        if not block.items:
+            del self.blocks[block.pos]
+            self._renumber(block.pos)
+
+        if veh.lead is not None:
+            veh.lead.follow = veh.follow
+        if veh.follow is not None:
+            veh.follow.lead = veh.lead
+        veh.lead = None
+        veh.follow = None
+        veh.lane_block = None
+
+    def search(self, x):
+        """
+        Find the vehicles directly ahead of and behind position x
+        :return: (leader, follower), either may be None. A vehicle at exactly x counts as the leader,
+                 except for the head, which is then the follower.
+        """
+        blocks = self.blocks
+        if not blocks:
+            return None, None
+        items = blocks[0].items
+        head = items[0]
+        if head.x <= x:
+            return None, head
+        tail = blocks[-1].items[-1]
+        if tail.x >= x:
+            return tail, None
+
+        if len(blocks) > 1:
+            # first block whose last vehicle is behind x
+            lo, hi = 0, len(blocks) - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if blocks[mid].items[-1].x >= x:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            items = blocks[lo].items
+        # first vehicle of that block behind x
+        i, j = 0, len(items) - 1
+        while i < j:
+            mid = (i + j) // 2
+            if items[mid].x >= x:
+                i = mid + 1
+            else:
+                j = mid
+        follower = items[i]
+        return follower.lead, follower
+
+    def _split(self, block):
+        half = len(block.items) // 2
+        new = _Block(self, block.pos + 1, block.items[half:])
+        del block.items[half:]
+        for veh in new.items:
+            veh.lane_block = new
+        self.blocks.insert(new.pos, new)
+        self._renumber(new.pos + 1)
+
+    def _renumber(self, start):
+        for pos in range(start, len(self.blocks)):
+            self.blocks[pos].pos = pos
+
+
 class Lane:
     def __init__(self, lane_index: int, lane_id: str, speed_limit: int, lane_width, lane_length):
         self.lane_index = lane_index
@@ -11,41 +183,21 @@ class Lane:
         self.lane_width = lane_width
         self.lane_length = lane_length
 
-        self.vehicles = []
+        self.vehicles = VehicleChain()
 
         self.index = None
 
         # self.allow_veh_type = None
 
-    def create_vehicle_chain(self):
-        for i in range(len(self.vehicles) - 2):
-            self.vehicles[i].follow = self.vehicles[i + 1]
-            self.vehicles[i + 1].lead = self.vehicles[i]
-        return self.vehicles
-
     def add_vehicle(self, vehicle):
-        if len(self.vehicles) > 0:
-            vehicle.lead = self.vehicles[-1]
-            self.vehicles[-1].follow = vehicle
         self.vehicles.append(vehicle)
 
-    def remove_vehicle(self, vehicle):
-        self.vehicles.remove(vehicle)
-
-        if vehicle.lead:
-            vehicle.lead.follow = vehicle.follow
-        if vehicle.follow:
-            vehicle.follow.lead = vehicle.lead
+    def insert_vehicle(self, vehicle, lead):
+        """
+        Insert a vehicle right behind lead (at the head of the lane when lead is None)
+        """
+        self.vehicles.insert_after(lead, vehicle)
 
+    def remove_vehicle(self, vehicle):
         # 清除当前车辆与前后车辆的关联
-        vehicle.lead = None
-        vehicle.follow = None
-        logging.info("REMOVE VEH: %s, AT LANE: %s, POS: %s" % (vehicle.id, self.lane_id, vehicle.x))
-        logging.info("LANE VEH AFTER REMOVE: %s" % vehicle in self.vehicles)
-
-
-
-
-
-
-
+        self.vehicles.remove(vehicle)
@@ -5,6 +5,8 @@ CURVE_RESOLUTION = 50
 
 
 class QuadraticCurve(Segment):
+    curve_resolution = CURVE_RESOLUTION
+
     def __init__(self, id: str, points, num_lanes):
         # Store characteristic points
         self.id = id
@@ -20,12 +22,9 @@ class QuadraticCurve(Segment):
         #     y = t**2*self.end[1] + 2*t*(1-t)*self.control[1] + (1-t)**2*self.start[1]
         #     path.append((x, y))
 
+        # Arc-length parametrization, see Segment.derive_geometry
         super().__init__(id, points, num_lanes)
 
-        # Arc-length parametrization
-        normalized_path = self.find_normalized_path(CURVE_RESOLUTION)
-        self.points = normalized_path
-
     def compute_x(self, t):
         return t**2*self.end[0] + 2*t*(1-t)*self.control[0] + (1-t)**2*self.start[0]
 
@@ -1,30 +1,35 @@
-from scipy.spatial import distance
-from scipy.interpolate import interp1d
 from collections import deque
 from numpy import arctan2, unwrap, linspace
 from abc import ABC, abstractmethod
 from math import sqrt
-from scipy.integrate import quad
+import numpy as np
+from src import network_cache
 from src.signal.SignalGroup import TrafficSignal
 from src.geometry.lanes import Lane
 
+# fixed-order Gauss-Legendre rule on [0, 1], used by the arc-length tables of the curves
+_nodes, _weights = np.polynomial.legendre.leggauss(5)
+GAUSS_NODES = (_nodes + 1) / 2
+GAUSS_WEIGHTS = _weights / 2
+ARC_LENGTH_INTERVALS = 64
+
 
 # define a class for a road segment for micro simulation
 class Segment:
+    # number of points of the path of a curve (see find_normalized_path), None for a polyline
+    curve_resolution = None
+
     def __init__(self, id: str, points, num_lanes, create_lanes=True):
-        self.get_heading = None
         self.speed_limit = None
         self.lanes = []
         self.id = id
 
         self.points = points
-        # Point
-        self.get_point = interp1d(linspace(0, 1, len(self.points)), self.points, axis=0)
-
         self.vehicles = deque()
-        self.length = self.get_length()
 
-        self.set_heading_functions()
+        # length, get_point / get_heading and the tables behind positions()
+        self.position_table = None
+        self.compile_geometry()
 
         self.has_traffic_signal = None
         self.traffic_signal_group = None
@@ -43,23 +48,72 @@ class Segment:
     def get_vehicles(self):
         return self.vehicles
 
-    def set_heading_functions(self):
-        # Heading
-        headings = unwrap([arctan2(
-            self.points[i + 1][1] - self.points[i][1],
-            self.points[i + 1][0] - self.points[i][0]
-        ) for i in range(len(self.points) - 1)])
-        if len(headings) == 1:
-            self.get_heading = lambda x: headings[0]
-        else:
-            self.get_heading = interp1d(linspace(0, 1, len(self.points) - 1), headings, axis=0)
+    def compile_geometry(self):
+        """Derive the geometry, or take it from the active network cache"""
+        cache = network_cache.active()
+        if cache is None:
+            self.set_geometry(self.derive_geometry())
+            return
+        digest = network_cache.definition_digest(self)
+        geometry = cache.get(digest)
+        if geometry is None:
+            geometry = self.derive_geometry()
+            cache.put(digest, geometry)
+        self.set_geometry(geometry)
+
+    def derive_geometry(self):
+        """
+        Everything computed from the definition, as float arrays (this is what the network cache stores):
+        length and the position table of a polyline; the arc-length table, position table and path of a curve
+        """
+        if self.curve_resolution:
+            self.build_arc_length_table()
+            return {
+                'arc_t': self.arc_t,
+                'arc_s': self.arc_s,
+                'points': np.column_stack((self.compute_x(self.arc_t), self.compute_y(self.arc_t))),
+                'headings': unwrap(arctan2(self.compute_dy(self.arc_t), self.compute_dx(self.arc_t))),
+                'path': np.array(self.find_normalized_path(self.curve_resolution)),
+            }
+        points = np.asarray(self.points, dtype=float)
+        delta = np.diff(points, axis=0)
+        return {
+            'length': np.array([self.get_length()]),
+            'point_knots': linspace(0, 1, len(points)),
+            'points': points,
+            'heading_knots': linspace(0, 1, len(delta)),
+            'headings': unwrap(arctan2(delta[:, 1], delta[:, 0])),
+        }
+
+    def set_geometry(self, geometry):
+        if 'arc_s' in geometry:
+            self.arc_t, self.arc_s = geometry['arc_t'], geometry['arc_s']
+            self.use_arc_length_geometry()
+            self.points = [tuple(point) for point in geometry['path'].tolist()]
+            knots = self.arc_s / self.arc_s[-1]
+            self.position_table = (knots, geometry['points'], knots, geometry['headings'])
+            return
+        self.length = float(geometry['length'][0])
+        self.position_table = (geometry['point_knots'], geometry['points'],
+                               geometry['heading_knots'], geometry['headings'])
+
+    def get_point(self, progress):
+        """Point at progress (0..1) along the polyline, points are evenly spaced in progress"""
+        point_knots, points, _, _ = self.position_table
+        return np.stack((np.interp(progress, point_knots, points[:, 0]),
+                         np.interp(progress, point_knots, points[:, 1])), axis=-1)
+
+    def get_heading(self, progress):
+        """Heading (rad) at progress (0..1), interpolated between the headings of the polyline's pieces"""
+        _, _, heading_knots, headings = self.position_table
+        return np.interp(progress, heading_knots, headings)
 
     # methods to calculate length using geometry [(x1,y1),(x2,y2),...(xn,yn)]
     def get_length(self):
         length = 0
-        for i in range(len(self.points)-1):
-            length += distance.euclidean((self.points[i][0], self.points[i][1]),
-                                         (self.points[i+1][0], self.points[i+1][1]))
+        delta = np.diff(np.asarray(self.points, dtype=float), axis=0)
+        for piece in np.sqrt((delta ** 2).sum(axis=1)).tolist():
+            length += piece
         return length
 
     @abstractmethod
@@ -81,7 +135,95 @@ class Segment:
     def abs_f(self, t):
         return sqrt(self.compute_dx(t) ** 2 + self.compute_dy(t) ** 2)
 
-    def find_t(self, a, L, epsilon):
+    def speed(self, t):
+        """Vectorized abs_f"""
+        return np.hypot(self.compute_dx(t), self.compute_dy(t))
+
+    def build_arc_length_table(self, intervals=ARC_LENGTH_INTERVALS):
+        """
+        Cumulative arc length s(t) on a uniform grid of t, all sub-intervals integrated at once with the fixed-order
+        Gauss-Legendre rule. Backs find_t, t_at_length and the *_at_length queries of curves.
+        """
+        self.arc_t = np.linspace(0, 1, intervals + 1)
+        h = np.diff(self.arc_t)
+        nodes = self.arc_t[:-1, None] + h[:, None] * GAUSS_NODES
+        pieces = (self.speed(nodes) * GAUSS_WEIGHTS).sum(axis=1) * h
+        self.arc_s = np.concatenate(([0.0], np.cumsum(pieces)))
+
+    @property
+    def arc_length(self):
+        return self.arc_s[-1]
+
+    def _partial_length(self, i, t):
+        # arc length from the table knot i to t (within the knot's interval)
+        h = t - self.arc_t[i]
+        nodes = self.arc_t[i][..., None] + h[..., None] * GAUSS_NODES
+        return self.arc_s[i] + (self.speed(nodes) * GAUSS_WEIGHTS).sum(axis=-1) * h
+
+    def length_at_t(self, t):
+        """Arc length from t=0 to t (vectorized)"""
+        t = np.clip(np.asarray(t, dtype=float), 0, 1)
+        i = np.minimum((t * (len(self.arc_t) - 1)).astype(int), len(self.arc_t) - 2)
+        return self._partial_length(i, t)
+
+    def t_at_length(self, s):
+        """
+        Parameter t where the arc length from t=0 reaches s (vectorized), s is clipped to [0, arc_length].
+        Linear interpolation in the table followed by one Newton step.
+        """
+        s = np.clip(np.asarray(s, dtype=float), 0, self.arc_s[-1])
+        i = np.clip(np.searchsorted(self.arc_s, s, side='right') - 1, 0, len(self.arc_t) - 2)
+        t0, s0 = self.arc_t[i], self.arc_s[i]
+        ds = self.arc_s[i + 1] - s0
+        t = t0 + (self.arc_t[i + 1] - t0) * np.divide(s - s0, ds, out=np.zeros_like(s), where=ds > 0)
+        speed = self.speed(t)
+        t = t - np.divide(self._partial_length(i, t) - s, speed, out=np.zeros_like(s), where=speed > 0)
+        return np.clip(t, 0, 1)
+
+    def point_at_length(self, s):
+        """World coordinates at arc length s (vectorized), shape s.shape + (2,)"""
+        t = self.t_at_length(s)
+        return np.stack((self.compute_x(t), self.compute_y(t)), axis=-1)
+
+    def heading_at_length(self, s):
+        """Heading (rad) at arc length s (vectorized)"""
+        t = self.t_at_length(s)
+        return arctan2(self.compute_dy(t), self.compute_dx(t))
+
+    def use_arc_length_geometry(self):
+        """
+        Base length, lanes, get_point and get_heading of a curve on its arc-length table instead of the polyline
+        through its control points
+        """
+        self.length = self.arc_length
+        for lane in self.lanes:
+            lane.lane_length = self.length
+        self.get_point = lambda progress: self.point_at_length(progress * self.length)
+        self.get_heading = lambda progress: self.heading_at_length(progress * self.length)
+
+    def positions(self, x, offsets=0.0):
+        """
+        World coordinates and headings of many positions at once (vectorized get_point, get_heading and the lane
+        offset of the renderer)
+        :param x: arc positions along the segment (m), e.g. vehicle.x, clipped to [0, length]
+        :param offsets: lateral offsets (m) from the centre line, positive to the right of the direction of travel,
+                        scalar or one per position (see lane_offsets)
+        :return: (points, headings), arrays of shape (n, 2) and (n,), headings in rad
+        """
+        point_knots, points, heading_knots, headings = self.position_table
+        progress = np.asarray(x, dtype=float).reshape(-1) / self.length
+        heading = np.interp(progress, heading_knots, headings)
+        offsets = np.asarray(offsets, dtype=float)
+        xy = np.empty((len(progress), 2))
+        xy[:, 0] = np.interp(progress, point_knots, points[:, 0]) - offsets * np.sin(heading)
+        xy[:, 1] = np.interp(progress, point_knots, points[:, 1]) + offsets * np.cos(heading)
+        return xy, heading
+
+    def lane_offsets(self, lane_indices):
+        """Lateral offsets (m) of the centre lines of the given lanes, lane 0 is the leftmost"""
+        return (np.asarray(lane_indices, dtype=float) + 0.5 - self.num_lanes / 2) * self.lane_width
+
+    def find_t(self, a, L, epsilon=None):
         """  Finds the t value such that the length of the curve from a to t is L.
 
         Parameters
@@ -91,45 +233,25 @@ class Segment:
         L : float
             target length
         epsilon : float
-            precision of the approximation
+            unused, the arc-length table is far more precise than the former bisection tolerance
         """
-
-        def f(t):
-            integral_value, _ = quad(self.abs_f, a, t)
-            return integral_value
-
+        if not hasattr(self, 'arc_s'):
+            self.build_arc_length_table()
+        target = self.length_at_t(a) + L
         # if we cannot reach the target length, return 1
-        if f(1) < L:
+        if target > self.arc_length:
             return 1
-
-        lower_bound = a
-        upper_bound = 1
-        mid_point = (lower_bound + upper_bound) / 2.0
-        integ = f(mid_point)
-        while abs(integ - L) > epsilon:
-            if integ < L:
-                lower_bound = mid_point
-            else:
-                upper_bound = mid_point
-            mid_point = (lower_bound + upper_bound) / 2.0
-            integ = f(mid_point)
-        return mid_point
+        return float(self.t_at_length(target))
 
     def find_normalized_path(self, CURVE_RESOLUTION=15):
-        normalized_path = [(self.compute_x(0), self.compute_y(0))]
-        l = self.get_length()
-        target_l = l / (CURVE_RESOLUTION - 1)
-        epsilon = 0.01
-        a = 0
-        for i in range(CURVE_RESOLUTION - 1):
-            t = self.find_t(a, target_l, epsilon)
-            new_point = (self.compute_x(t), self.compute_y(t))
-            normalized_path.append(new_point)
-            if t == 1:
-                break
-            else:
-                a = t
-        return normalized_path
+        """
+        CURVE_RESOLUTION points equally spaced along the curve
+        """
+        if not hasattr(self, 'arc_s'):
+            self.build_arc_length_table()
+        t = self.t_at_length(np.linspace(0, self.arc_length, CURVE_RESOLUTION))
+        t[0], t[-1] = 0, 1
+        return list(zip(self.compute_x(t).tolist(), self.compute_y(t).tolist()))
 
     def set_traffic_signal(self, signal, group):
         self.traffic_signal = signal
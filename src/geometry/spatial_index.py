@@ -0,0 +1,144 @@
+from math import ceil, inf, sqrt
+
+import numpy as np
+
+
+def road_width(obj):
+    """Drawn width of a segment or connector (see Visualizer.draw_segments / draw_connectors)"""
+    if hasattr(obj, 'connections'):
+        return len(obj.connections) * obj.lane_width
+    return obj.num_lanes * obj.lane_width
+
+
+class SpatialIndex:
+    """
+    Uniform grid over segments and connectors for picking, nearest-road and viewport queries.
+
+    Every object is split into the pieces of its position table (see Segment.positions, the same polyline the
+    vehicles are placed on), each piece padded by half the road width. A cell lists the pieces whose padded
+    bounding box overlaps it, stored CSR-like: the pieces of cell c are cell_pieces[cell_start[c]:cell_start[c + 1]],
+    cells numbered row by row, so a row of cells is one contiguous slice.
+    """
+    def __init__(self, objects, cell_size=None):
+        """
+        :param objects: segments and connectors
+        :param cell_size: side of a grid cell (m), None for about one piece per cell
+        """
+        self.objects = list(objects)
+        p0, p1, k0, k1, owner, half_width = [], [], [], [], [], []
+        for i, obj in enumerate(self.objects):
+            knots, points = obj.position_table[0], np.asarray(obj.position_table[1])
+            p0.append(points[:-1])
+            p1.append(points[1:])
+            k0.append(knots[:-1])
+            k1.append(knots[1:])
+            owner.append(np.full(len(points) - 1, i))
+            half_width.append(np.full(len(points) - 1, road_width(obj) / 2))
+        if not self.objects:
+            p0 = p1 = [np.zeros((0, 2))]
+            k0 = k1 = owner = half_width = [np.zeros(0)]
+        self.p0, self.p1 = np.concatenate(p0), np.concatenate(p1)
+        # progress (0..1) along the owner at both ends of a piece
+        self.k0, self.k1 = np.concatenate(k0), np.concatenate(k1)
+        self.owner = np.concatenate(owner).astype(int)
+        self.half_width = np.concatenate(half_width)
+        self.lo = np.minimum(self.p0, self.p1) - self.half_width[:, None]
+        self.hi = np.maximum(self.p0, self.p1) + self.half_width[:, None]
+
+        pieces = len(self.p0)
+        self.origin = self.lo.min(axis=0) if pieces else np.zeros(2)
+        extent = (self.hi.max(axis=0) - self.origin) if pieces else np.ones(2)
+        if cell_size is None:
+            cell_size = sqrt(max(extent[0] * extent[1], 1.0) / max(pieces, 1))
+        self.cell_size = max(cell_size, 1e-6)
+        self.nx = max(int(ceil(extent[0] / self.cell_size)), 1)
+        self.ny = max(int(ceil(extent[1] / self.cell_size)), 1)
+
+        ix0, iy0 = self._cell(self.lo).T
+        ix1, iy1 = self._cell(self.hi).T
+        w, h = ix1 - ix0 + 1, iy1 - iy0 + 1
+        counts = w * h
+        piece = np.repeat(np.arange(pieces), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell = (iy0[piece] + k // w[piece]) * self.nx + ix0[piece] + k % w[piece]
+        order = np.argsort(cell, kind='stable')
+        self.cell_pieces = piece[order]
+        self.cell_start = np.searchsorted(cell[order], np.arange(self.nx * self.ny + 1))
+
+    def _cell(self, xy):
+        """Cell (ix, iy) of points, clipped to the grid"""
+        i = np.floor((np.asarray(xy, dtype=float) - self.origin) / self.cell_size).astype(int)
+        return np.clip(i, 0, (self.nx - 1, self.ny - 1))
+
+    def _candidates(self, lo, hi):
+        """Pieces listed in the cells overlapping the rectangle lo..hi, each once"""
+        (ix0, iy0), (ix1, iy1) = self._cell(lo), self._cell(hi)
+        rows = [self.cell_pieces[self.cell_start[iy * self.nx + ix0]:self.cell_start[iy * self.nx + ix1 + 1]]
+                for iy in range(iy0, iy1 + 1)]
+        return np.unique(np.concatenate(rows))
+
+    def _distances(self, pieces, x, y):
+        """Distance from (x, y) to the centre line of each piece, and the fraction along the piece of the foot"""
+        p0, d = self.p0[pieces], self.p1[pieces] - self.p0[pieces]
+        q = np.array((x, y)) - p0
+        length2 = (d * d).sum(axis=1)
+        f = np.clip(np.divide((q * d).sum(axis=1), length2, out=np.zeros(len(pieces)), where=length2 > 0), 0, 1)
+        return np.hypot(*(q - f[:, None] * d).T), f
+
+    def pick(self, x, y):
+        """
+        Objects whose road surface contains (x, y)
+        :return: list of segments / connectors, closest centre line first
+        """
+        pieces = self._candidates((x, y), (x, y))
+        if not len(pieces):
+            return []
+        distance, _ = self._distances(pieces, x, y)
+        inside = distance <= self.half_width[pieces]
+        picked = []
+        for i in np.argsort(distance[inside], kind='stable'):
+            obj = self.objects[self.owner[pieces[inside][i]]]
+            if obj not in picked:
+                picked.append(obj)
+        return picked
+
+    def nearest(self, x, y, max_distance=inf):
+        """
+        Closest centre line to (x, y), searching squares of doubling size around the point
+        :return: (object, arc position along it in m, distance in m), None if nothing lies within max_distance
+        """
+        if not len(self.p0):
+            return None
+        grid_lo, grid_hi = self.origin, self.origin + self.cell_size * np.array((self.nx, self.ny))
+        r = self.cell_size
+        while True:
+            r = min(r, max_distance)
+            pieces = self._candidates((x - r, y - r), (x + r, y + r))
+            # once the square covers the grid every piece is a candidate
+            covers_grid = x - r <= grid_lo[0] and y - r <= grid_lo[1] and x + r >= grid_hi[0] and y + r >= grid_hi[1]
+            if len(pieces):
+                distance, f = self._distances(pieces, x, y)
+                i = int(np.argmin(distance))
+                # a piece closer than r overlaps the square, so no piece outside it can be closer
+                if distance[i] <= r or covers_grid:
+                    if distance[i] > max_distance:
+                        return None
+                    piece = pieces[i]
+                    obj = self.objects[self.owner[piece]]
+                    progress = self.k0[piece] + f[i] * (self.k1[piece] - self.k0[piece])
+                    return obj, float(progress * obj.length), float(distance[i])
+            if r >= max_distance or covers_grid:
+                return None
+            r *= 2
+
+    def query_rect(self, x_min, y_min, x_max, y_max):
+        """
+        Objects with a piece whose padded bounding box overlaps the rectangle (viewport culling, conservative)
+        :return: list of segments / connectors in the order they were indexed
+        """
+        pieces = self._candidates((x_min, y_min), (x_max, y_max))
+        if not len(pieces):
+            return []
+        overlap = ((self.lo[pieces, 0] <= x_max) & (self.hi[pieces, 0] >= x_min) &
+                   (self.lo[pieces, 1] <= y_max) & (self.hi[pieces, 1] >= y_min))
+        return [self.objects[i] for i in np.unique(self.owner[pieces[overlap]])]
@@ -0,0 +1,124 @@
+"""
+Zoom-dependent level of detail of the vehicles, kept within a frame-time budget.
+
+    LABELS   vehicle glyphs with their speed / position / acceleration / id texts
+    GLYPHS   vehicle glyphs only
+    DENSITY  no vehicles, every lane shaded by its density (LaneDensity)
+
+The level follows the zoom (pixels per metre) through configurable thresholds. When the measured frame time stays
+above the budget the thresholds are raised, so detail is dropped (texts first) at the zoom the frame rate needs,
+and lowered again once frames are well within the budget.
+"""
+import dearpygui.dearpygui as dpg
+import numpy as np
+
+DENSITY, GLYPHS, LABELS = 0, 1, 2
+LEVEL_NAMES = ('density', 'glyphs', 'labels')
+
+# vehicles/km per lane at which a lane is drawn fully red, about bumper to bumper
+JAM_DENSITY = 130
+# number of colours of the density shading, a lane is only updated when its colour changes
+DENSITY_STEPS = 8
+
+
+class LevelOfDetail:
+    def __init__(self, label_zoom=3.0, glyph_zoom=1.0, max_labels=300, cull_margin=15.0, frame_budget=1 / 30,
+                 smoothing=0.1, max_penalty=8.0):
+        """
+        :param label_zoom: lowest zoom (px/m) with vehicle texts
+        :param glyph_zoom: lowest zoom (px/m) with vehicle glyphs, lanes are shaded by density below
+        :param max_labels: vehicle texts are dropped when more vehicles than this are in the viewport
+        :param cull_margin: vehicles are drawn up to this far (m) outside the viewport, for their length and texts
+        :param frame_budget: target frame time (s), None to follow the zoom thresholds only
+        :param smoothing: weight of the last frame in the frame-time average
+        :param max_penalty: largest factor the thresholds are raised by to keep within the budget
+        """
+        self.label_zoom = label_zoom
+        self.glyph_zoom = glyph_zoom
+        self.max_labels = max_labels
+        self.cull_margin = cull_margin
+        self.frame_budget = frame_budget
+        self.smoothing = smoothing
+        self.max_penalty = max_penalty
+        # exponential average of the measured frame time (s)
+        self.frame_time = None
+        # factor the zoom thresholds are raised by while over budget
+        self.penalty = 1.0
+
+    def level(self, zoom):
+        if zoom >= self.label_zoom * self.penalty:
+            return LABELS
+        if zoom >= self.glyph_zoom * self.penalty:
+            return GLYPHS
+        return DENSITY
+
+    def frame_done(self, seconds):
+        """Account the duration of the last frame and adapt the penalty"""
+        if self.frame_time is None:
+            self.frame_time = seconds
+        else:
+            self.frame_time += self.smoothing * (seconds - self.frame_time)
+        if self.frame_budget is None:
+            return
+        if self.frame_time > self.frame_budget:
+            self.penalty = min(self.penalty * 1.05, self.max_penalty)
+        elif self.frame_time < self.frame_budget / 2:
+            self.penalty = max(self.penalty / 1.05, 1.0)
+
+
+class LaneDensity:
+    """
+    One polyline per lane along its centre, coloured by the lane's vehicle density. Like VehicleGlyphs the lines
+    are kept between frames: a lane only gets its colour updated when it changes, lanes not shaded in a frame
+    (empty or off-screen) are hidden.
+    """
+    def __init__(self, parent):
+        self.parent = parent
+        # (segment id, lane index) -> [polyline, colour step, frame last shaded, lane width]
+        self.lines = {}
+        self.zoom = None
+        self.frame = 0
+
+    def begin_frame(self, zoom):
+        self.frame += 1
+        if zoom != self.zoom:
+            self.zoom = zoom
+            for line in self.lines.values():
+                dpg.configure_item(line[0], thickness=line[3] * zoom)
+
+    def shade(self, segment, counts):
+        """
+        :param counts: vehicles on every lane of segment
+        """
+        density = np.asarray(counts) / (segment.length / 1000)
+        steps = np.minimum((density / JAM_DENSITY * DENSITY_STEPS).astype(int), DENSITY_STEPS - 1)
+        for lane_index, (count, step) in enumerate(zip(counts, steps.tolist())):
+            if not count:
+                continue
+            key = (segment.id, lane_index)
+            line = self.lines.get(key)
+            if line is None:
+                knots = np.asarray(segment.position_table[0])
+                points, _ = segment.positions(knots * segment.length, segment.lane_offsets([lane_index]))
+                polyline = dpg.draw_polyline(points.tolist(), color=self.color(step),
+                                             thickness=segment.lane_width * self.zoom, parent=self.parent)
+                line = self.lines[key] = [polyline, step, self.frame, segment.lane_width]
+            elif line[2] != self.frame - 1:
+                # hidden in the last frame
+                dpg.configure_item(line[0], show=True)
+            if line[1] != step:
+                dpg.configure_item(line[0], color=self.color(step))
+                line[1] = step
+            line[2] = self.frame
+
+    def end_frame(self):
+        for line in self.lines.values():
+            if line[2] == self.frame - 1:
+                # shaded in the last frame but not in this one
+                dpg.configure_item(line[0], show=False)
+
+    @staticmethod
+    def color(step):
+        """Green (free flow) over yellow to red (jam)"""
+        f = step / (DENSITY_STEPS - 1)
+        return int(255 * min(2 * f, 1)), int(200 * min(2 - 2 * f, 1)), 0, 160
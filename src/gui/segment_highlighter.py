@@ -3,9 +3,14 @@ import numpy as np
 
 
 class SegmentHighlighter:
-    def __init__(self, simulation, zoom):
+    def __init__(self, simulation, zoom, to_world=None):
+        """
+        :param to_world: callable(x, y) -> world coordinates of a mouse position (Visualizer.to_world),
+                         None if mouse positions are already in world coordinates
+        """
         self.simulation = simulation
         self.zoom = zoom
+        self.to_world = to_world
         self.canvas_tag = None
 
     # def attach_canvas_callback(self, canvas_tag):
@@ -37,19 +42,14 @@ class SegmentHighlighter:
                 self.display_segment_points(clicked_segment)
 
     def find_clicked_segment(self, mouse_pos):
-        # 这里实现寻找被点击路段的逻辑
-        for segment_id, segment in self.simulation.segments.items():
-            if self.is_point_in_segment(mouse_pos, segment):
-                return segment
-        return None
+        # 通过空间索引寻找被点击的路段或连接器，重叠时取中心线最近的
+        point = self.to_world(*mouse_pos) if self.to_world else mouse_pos
+        picked = self.simulation.get_spatial_index().pick(*point)
+        return picked[0] if picked else None
 
     def is_point_in_segment(self, point, segment):
-        # 简单的矩形检查
-        x_min = min(segment.points[0][0], segment.points[1][0])
-        x_max = max(segment.points[0][0], segment.points[1][0])
-        y_min = min(segment.points[0][1], segment.points[1][1])
-        y_max = max(segment.points[0][1], segment.points[1][1])
-        return x_min <= point[0] <= x_max and y_min <= point[1] <= y_max
+        # 点是否落在路面上（包含车道宽度）
+        return segment in self.simulation.get_spatial_index().pick(*point)
 
     def highlight_segment(self, segment):
         # 高亮显示路段
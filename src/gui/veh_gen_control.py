@@ -3,13 +3,18 @@ from src.vehicle.vehicle_generator import VehicleGenerator
 
 
 class VehicleGeneratorControl:
-    def __init__(self, vehicle_generator):
+    def __init__(self, vehicle_generator, submit=None):
+        """
+        :param submit: called with a function that applies a change, to run it in the simulation thread (see
+                       SimulationThread.submit); None applies changes immediately
+        """
         self.b_max = None
         self.v_max = None
         self.s_safe = None
         self.a_max = None
         self.vehicle_length = None
         self.vehicle_generator = vehicle_generator
+        self.submit = submit or (lambda fn: fn())
         self.create_veh_generator_control_windows()
 
     def create_veh_generator_control_windows(self):
@@ -17,7 +22,7 @@ class VehicleGeneratorControl:
 
         # Create Vehicle Behaviour window
         with dpg.window(tag="VehicleBehaviour", label="Vehicle Behaviour", no_close=True, no_collapse=True, width=250,
-                        height=250, no_resize=True, no_move=True, no_scrollbar=True, pos=(0, 340)):
+                        height=250, no_resize=True, no_move=True, no_scrollbar=True, pos=(0, 400)):
 
             # Vehicle parameters
             self.vehicle_length = dpg.add_input_float(tag="VehicleLength", label="Length", default_value=5.0,
@@ -31,28 +36,24 @@ class VehicleGeneratorControl:
             self.b_max = dpg.add_input_float(tag="BMax", label="b_max", default_value=5.0,
                                              callback=self.set_b_max)
 
+    def update_generators(self, name, value):
+        def update():
+            for gen in self.vehicle_generator:
+                setattr(gen, name, value)
+                gen.init_properties()  # Recalculate properties after updating the parameter
+        self.submit(update)
+
     def set_vehicle_length(self, sender, app_data):
-        for gen in self.vehicle_generator:
-            gen.length = app_data
-            gen.init_properties()  # Recalculate properties after updating length
+        self.update_generators('length', app_data)
 
     def set_a_max(self, sender, app_data):
-        for gen in self.vehicle_generator:
-            gen.a_max = app_data
-            gen.init_properties()  # Recalculate properties after updating a_max
+        self.update_generators('a_max', app_data)
 
     def set_s_safe(self, sender, app_data):
-        for gen in self.vehicle_generator:
-            gen.s_safe = app_data
-            gen.init_properties()  # Recalculate properties after updating s_safe
+        self.update_generators('s_safe', app_data)
 
     def set_v_max(self, sender, app_data):
-        for gen in self.vehicle_generator:
-            gen.v_max = app_data
-            gen.init_properties()  # Recalculate properties after updating v_max
+        self.update_generators('v_max', app_data)
 
     def set_b_max(self, sender, app_data):
-        for gen in self.vehicle_generator:
-            gen.b_max = app_data
-            gen.init_properties()  # Recalculate properties after updating b_max
-
+        self.update_generators('b_max', app_data)
@@ -0,0 +1,137 @@
+"""
+Pooled vehicle glyphs for the Visualizer.
+
+A glyph is a draw node holding the vehicle's line plus a label node holding its texts, both created once and kept
+between frames. Glyphs are keyed by vehicle id: a vehicle still on screen only gets its transform, colour, length
+and label texts pushed to dearpygui when they changed, and a vehicle that left the network (or the viewport) has its
+glyph hidden and put back in the pool for the next vehicle that appears. Per frame:
+
+    glyphs.begin_frame(zoom)
+    glyphs.place(vid, length, position, heading, color, texts)     # every vehicle to draw
+    glyphs.end_frame()                                              # recycle the glyphs that were not placed
+"""
+import dearpygui.dearpygui as dpg
+
+# drawn width of a vehicle and label font size, multiplied by the zoom as for the roads
+THICKNESS = 1.76
+LABEL_SIZE = 2
+LABEL_COLOR = (255, 255, 255)
+# position of every label text relative to the label anchor, see Visualizer.vehicle_labels
+LABEL_OFFSETS = ((0, 0), (7, 0), (0, 2), (0, 4))
+
+
+class Glyph:
+    __slots__ = ('node', 'line', 'label_node', 'texts', 'frame', 'pose', 'length', 'color', 'anchor', 'labels',
+                 'label_shown')
+
+    def __init__(self, parent, zoom):
+        self.node = dpg.add_draw_node(parent=parent)
+        self.line = dpg.draw_line((0, 0), (0, 0), thickness=THICKNESS * zoom, parent=self.node)
+        self.label_node = dpg.add_draw_node(parent=parent, show=False)
+        self.texts = [dpg.draw_text(pos=offset, text="", size=LABEL_SIZE * zoom, color=LABEL_COLOR,
+                                    parent=self.label_node) for offset in LABEL_OFFSETS]
+        self.frame = 0
+        # last values sent to dearpygui, None forces the next update
+        self.pose = self.length = self.color = self.anchor = None
+        # text of every label text, None when hidden
+        self.labels = [""] * len(self.texts)
+        self.label_shown = False
+
+    def reset(self):
+        self.pose = self.length = self.color = self.anchor = None
+
+
+class VehicleGlyphs:
+    def __init__(self, parent):
+        """
+        :param parent: draw node the glyphs are created in, its children must not be deleted by anyone else
+        """
+        self.parent = parent
+        # vehicle id -> glyph placed in the current or the last frame
+        self.glyphs = {}
+        self.free = []
+        self.zoom = None
+        self.frame = 0
+        # dearpygui items created, for benchmarks / debugging
+        self.created = 0
+
+    def begin_frame(self, zoom):
+        self.frame += 1
+        if zoom != self.zoom:
+            self.zoom = zoom
+            for glyph in list(self.glyphs.values()) + self.free:
+                dpg.configure_item(glyph.line, thickness=THICKNESS * zoom)
+                for text in glyph.texts:
+                    dpg.configure_item(text, size=LABEL_SIZE * zoom)
+
+    def place(self, vid, length, position, heading, color, texts=None, anchor=None):
+        """
+        Show vehicle vid at position, pointing along heading
+        :param length: vehicle length (m)
+        :param color: RGB(A) of the line
+        :param texts: a string per label text (see LABEL_OFFSETS), None for a hidden text; None hides the label
+        :param anchor: world position of the label
+        """
+        glyph = self.glyphs.get(vid)
+        if glyph is None:
+            if self.free:
+                glyph = self.free.pop()
+                dpg.configure_item(glyph.node, show=True)
+            else:
+                glyph = Glyph(self.parent, self.zoom)
+                self.created += 3 + len(glyph.texts)
+            self.glyphs[vid] = glyph
+        glyph.frame = self.frame
+
+        pose = (position[0], position[1], heading)
+        if pose != glyph.pose:
+            glyph.pose = pose
+            dpg.apply_transform(glyph.node, dpg.create_translation_matrix(position) *
+                                dpg.create_rotation_matrix(heading, [0, 0, 1]))
+        if length != glyph.length:
+            glyph.length = length
+            dpg.configure_item(glyph.line, p2=(length, 0))
+        if color != glyph.color:
+            glyph.color = color
+            dpg.configure_item(glyph.line, color=color)
+
+        if texts is None:
+            if glyph.label_shown:
+                dpg.configure_item(glyph.label_node, show=False)
+                glyph.label_shown = False
+            return
+        if not glyph.label_shown:
+            dpg.configure_item(glyph.label_node, show=True)
+            glyph.label_shown = True
+        if anchor != glyph.anchor:
+            glyph.anchor = anchor
+            dpg.apply_transform(glyph.label_node, dpg.create_translation_matrix(anchor))
+        for i, text in enumerate(texts):
+            old = glyph.labels[i]
+            if text == old:
+                continue
+            if text is None:
+                dpg.configure_item(glyph.texts[i], show=False)
+            elif old is None:
+                dpg.configure_item(glyph.texts[i], show=True, text=text)
+            else:
+                dpg.configure_item(glyph.texts[i], text=text)
+            glyph.labels[i] = text
+
+    def end_frame(self):
+        """Hide the glyphs of the vehicles not placed in this frame and return them to the pool"""
+        gone = [vid for vid, glyph in self.glyphs.items() if glyph.frame != self.frame]
+        for vid in gone:
+            glyph = self.glyphs.pop(vid)
+            dpg.configure_item(glyph.node, show=False)
+            if glyph.label_shown:
+                dpg.configure_item(glyph.label_node, show=False)
+                glyph.label_shown = False
+            glyph.reset()
+            self.free.append(glyph)
+
+    def clear(self):
+        """Delete every glyph"""
+        dpg.delete_item(self.parent, children_only=True)
+        self.glyphs = {}
+        self.free = []
@@ -4,8 +4,13 @@ import dearpygui.dearpygui as dpg
 import os
 import math
 from src.gui.segment_highlighter import SegmentHighlighter
+from src.geometry.connectors import Connector
 import numpy as np
 from src.gui.veh_gen_control import VehicleGeneratorControl
+from src.gui.vehicle_glyphs import VehicleGlyphs
+from src.gui.level_of_detail import LevelOfDetail, LaneDensity, DENSITY, LABELS, LEVEL_NAMES
+from src.snapshot import Snapshot, SnapshotBuffer, SimulationThread, STOPPED, SLOWING
+from src.pacing import PacingController
 
 # Get the absolute path to the image
 image_path = os.path.join(os.path.dirname(__file__), "logo_1.png")
@@ -30,7 +35,13 @@ def offset_position(position, heading, lane_width, offset_multiplier):
 
 
 class Visualizer:
-    def __init__(self, simulation):
+    def __init__(self, simulation, threaded=True, interpolate=True, level_of_detail=None):
+        """
+        :param threaded: step the simulation in a SimulationThread and draw its snapshots, False steps it in
+                         render_loop
+        :param interpolate: draw the vehicles between the last two snapshots (threaded only)
+        :param level_of_detail: LevelOfDetail with the zoom thresholds and frame budget, None for the defaults
+        """
         print("Initializing Visualizer...")
         self.simulation = simulation
         self.is_running = False
@@ -39,11 +50,36 @@ class Visualizer:
         self.zoom = 5
         self.offset = (0, 0)
 
-        # simulation speed
+        # simulation speed: target real-time factor (None for as fast as possible) and wall-clock milliseconds of
+        # stepping per frame, see PacingController
         self.speed = 1
-        self.delay = 1000
+        self.budget_ms = 10
         self.zoom_speed = 1
 
+        # the simulation publishes snapshots of its state, the GUI only draws those
+        self.simulation_thread = SimulationThread(simulation, real_time_factor=self.speed,
+                                                  budget=self.budget_ms / 1000) if threaded else None
+        self.snapshots = self.simulation_thread.buffer if threaded else SnapshotBuffer()
+        self.pacing = self.simulation_thread.pacing if threaded else \
+            PacingController(simulation.dt, self.speed, self.budget_ms / 1000)
+        self.interpolate = interpolate and threaded
+        # built here once, before both threads may ask for them
+        simulation.get_topology()
+        simulation.get_spatial_index()
+
+        # what the static layer and the grid were last drawn for, see update_static_layer / update_grid
+        self._static_zoom = None
+        self._static_topology = None
+        self._static_region = None
+        self._grid_view = None
+        # segment id -> lane line polylines (world coordinates)
+        self._lane_lines = {}
+
+        self.level_of_detail = level_of_detail or LevelOfDetail()
+        # level drawn in the last frame and start of that frame, see render_loop
+        self.detail = LABELS
+        self._frame_start = None
+
         self.setup()
         self.create_windows()
         self.create_veh_gen_control_window()
@@ -56,6 +92,12 @@ class Visualizer:
 
         self.show_status_color = False
 
+        # segments / connectors overlapping the viewport and the viewport (x_min, y_min, x_max, y_max) in world
+        # coordinates, see update_visible_roads
+        self.visible_segments = []
+        self.visible_connectors = []
+        self.view = None
+
         # 实例化SegmentHighlighter
         # self.initialize_highlighter()
 
@@ -72,7 +114,8 @@ class Visualizer:
             self.logo = dpg.add_static_texture(width, height, data, tag="logo_compressed")
 
     def create_veh_gen_control_window(self):
-        veh_gen_control_window = VehicleGeneratorControl(self.simulation.vehicle_generator)
+        veh_gen_control_window = VehicleGeneratorControl(
+            self.simulation.vehicle_generator, self.simulation_thread.submit if self.simulation_thread else None)
 
     def create_windows(self):
         # create main window to display simulation
@@ -87,22 +130,31 @@ class Visualizer:
                        no_title_bar=True,
                        no_move=True)
 
+        # grid (screen space), network (world space, retained), signals (world space, every frame), vehicles (pooled)
         dpg.add_draw_node(tag="OverlayCanvas", parent="viz_port")
+        dpg.add_draw_node(tag="StaticCanvas", parent="viz_port")
         dpg.add_draw_node(tag="Canvas", parent="viz_port")
+        dpg.add_draw_node(tag="DensityCanvas", parent="viz_port")
+        dpg.add_draw_node(tag="VehicleCanvas", parent="viz_port")
+        self.lane_density = LaneDensity("DensityCanvas")
+        self.vehicle_glyphs = VehicleGlyphs("VehicleCanvas")
 
-        with dpg.window(tag="SimControl", label="SimControl", no_close=True, no_collapse=True, width=250, height=190,
+        with dpg.window(tag="SimControl", label="SimControl", no_close=True, no_collapse=True, width=250, height=270,
                         no_resize=True, no_move=True, no_scrollbar=True, ):
 
             with dpg.group(horizontal=True):
                 dpg.add_button(label="Run", tag="RunStopButton", callback=self.toggle, width=60)
-                dpg.add_button(label="Step", tag="StepButton", callback=self.simulation.update_with_lane, width=60)
+                dpg.add_button(label="Step", tag="StepButton", callback=self.step, width=60)
 
             dpg.add_slider_int(tag="SpeedUp", label=">> Speed Up", width=150, min_value=1, max_value=100,
-                               default_value=1,
+                               default_value=self.speed,
                                callback=self.set_speed)
-            dpg.add_slider_int(tag="Delay", label=">> Delay", width=150, min_value=10, max_value=200,
-                               default_value=0,
-                               callback=self.delay)
+            dpg.add_checkbox(tag="MaxSpeed", label="As fast as possible", default_value=False,
+                             callback=self.set_speed)
+            # 每帧用于仿真步进的时间上限
+            dpg.add_slider_int(tag="StepBudget", label=">> Budget ms", width=150, min_value=1, max_value=100,
+                               default_value=self.budget_ms,
+                               callback=self.set_budget)
 
             with dpg.table(header_row=False):
                 dpg.add_table_column()
@@ -119,6 +171,14 @@ class Visualizer:
                 with dpg.table_row():
                     dpg.add_text("Frame:")
                     dpg.add_text("_", tag="FrameStatus")
+
+                with dpg.table_row():
+                    dpg.add_text("Speed:")
+                    dpg.add_text("_", tag="SpeedStatus")
+
+                with dpg.table_row():
+                    dpg.add_text("Render:")
+                    dpg.add_text("_", tag="RenderStatus")
         # with dpg.window(tag="logo", label="logo", width=300, height=300, no_resize=False, no_move=False, no_title_bar=False, no_background=True):
         #     dpg.add_image(self.logo)
         if not hasattr(self, 'show_speed'):
@@ -129,7 +189,7 @@ class Visualizer:
             self.show_id = True
         if not hasattr(self, 'show_status_color'):
             self.show_status_color = False
-        with dpg.window(label="Vehicle Info", pos=[0, 190], width=250, height=130, no_close=True, no_collapse=True,
+        with dpg.window(label="Vehicle Info", pos=[0, 270], width=250, height=130, no_close=True, no_collapse=True,
                         no_resize=True, no_move=True):
             dpg.add_checkbox(label="Show Speed", default_value=self.show_speed,
                              callback=lambda sender, app_data: setattr(self, 'show_speed', app_data))
@@ -147,7 +207,7 @@ class Visualizer:
             dpg.add_mouse_release_handler(callback=self.mouse_release)
             dpg.add_mouse_wheel_handler(callback=self.mouse_wheel)
 
-    def update_panels(self):
+    def update_panels(self, snapshot):
         # Update status text
         if self.is_running:
             dpg.set_value("StatusText", "Running")
@@ -157,8 +217,16 @@ class Visualizer:
             dpg.configure_item("StatusText", color=(255, 0, 0))
 
         # Update time and frame text
-        dpg.set_value("TimeStatus", f"{self.simulation.t:.2f}s")
-        dpg.set_value("FrameStatus", self.simulation.frame_count)
+        dpg.set_value("TimeStatus", f"{snapshot.t:.2f}s")
+        dpg.set_value("FrameStatus", snapshot.frame_count)
+        # achieved against requested real-time factor
+        achieved = self.pacing.achieved if self.is_running else None
+        requested = self.pacing.requested
+        dpg.set_value("SpeedStatus", ("_" if achieved is None else f"x{achieved:.1f}") +
+                      (f" / x{requested:g}" if requested else " / max"))
+        frame_time = self.level_of_detail.frame_time
+        dpg.set_value("RenderStatus", "_" if frame_time is None else
+                      f"{frame_time * 1000:.1f} ms, {LEVEL_NAMES[self.detail]}")
 
     def toggle(self):
         if self.is_running:
@@ -168,243 +236,253 @@ class Visualizer:
 
     def run(self):
         self.is_running = True
+        self.pacing.reset()
+        if self.simulation_thread:
+            self.simulation_thread.set_running(True)
         dpg.set_item_label("RunStopButton", "Stop")
         dpg.bind_item_theme("RunStopButton", "StopButtonTheme")
 
     def stop(self):
         self.is_running = False
+        if self.simulation_thread:
+            self.simulation_thread.set_running(False)
         dpg.set_item_label("RunStopButton", "Run")
         dpg.bind_item_theme("RunStopButton", "RunButtonTheme")
 
+    def step(self):
+        if self.simulation_thread:
+            self.simulation_thread.step()
+        else:
+            self.simulation.update_with_lane()
+
     def show(self):
         dpg.show_viewport()
-        while dpg.is_dearpygui_running():
-            self.render_loop()
-            dpg.render_dearpygui_frame()
+        if self.simulation_thread:
+            self.simulation_thread.start()
+        try:
+            while dpg.is_dearpygui_running():
+                self.render_loop()
+                dpg.render_dearpygui_frame()
+        finally:
+            if self.simulation_thread:
+                self.simulation_thread.close()
         dpg.destroy_context()
 
     def render_loop(self):
         # print('updating frame: ', self.simulation.frame_count)
+        # frame time from the start of the last frame to this one, dearpygui's rendering included
+        now = time.perf_counter()
+        interval = 1 / 60
+        if self._frame_start is not None:
+            interval = now - self._frame_start
+            self.level_of_detail.frame_done(interval)
+        self._frame_start = now
         self.update_inertial_zoom()
-        # Remove old drawings
-        dpg.delete_item("OverlayCanvas", children_only=True)
+        # Remove old drawings, the network layer, the grid and the vehicle glyphs are kept between frames
         dpg.delete_item("Canvas", children_only=True)
 
-        self.draw_segments()
-        self.draw_connectors()
+        self.update_visible_roads()
+        self.update_static_layer()
+        self.update_grid()
+
+        if self.simulation_thread is None:
+            if self.is_running:
+                steps = self.pacing.steps(interval)
+                start = time.perf_counter()
+                self.simulation.run(steps)
+                self.pacing.record(steps, time.perf_counter() - start, interval)
+            self.snapshots.publish(Snapshot(self.simulation, self.snapshots.latest))
+        previous, snapshot = self.snapshots.pair
+        if snapshot is None:
+            # the simulation thread has not published yet
+            return
+        if self.interpolate:
+            xy, heading = snapshot.interpolate(previous, self.snapshots.alpha())
+        else:
+            xy, heading = snapshot.xy, snapshot.heading
 
-        self.draw_tl()
-        self.draw_grid(10)
-        self.draw_grid(50)
+        self.draw_tl(snapshot)
 
         # Apply transformations
         self.apply_transformation()
 
         # Update panels
-        self.update_panels()
-
-        if self.is_running:
-            self.simulation.run(self.speed, self.delay)
-
-        self.draw_vehicles()
-
-        self.draw_vehicle_at_connections()
+        self.update_panels(snapshot)
+
+        # Vehicles, or lane densities when zoomed out (or over the frame budget)
+        self.detail = self.level_of_detail.level(self.zoom)
+        self.vehicle_glyphs.begin_frame(self.zoom)
+        self.lane_density.begin_frame(self.zoom)
+        if self.detail == DENSITY:
+            self.draw_lane_density(snapshot)
+        else:
+            self.draw_vehicles(snapshot, xy, heading, labels=self.detail == LABELS)
+            self.draw_vehicle_at_connections(snapshot, xy, heading)
+        self.lane_density.end_frame()
+        self.vehicle_glyphs.end_frame()
+
+    def update_visible_roads(self):
+        """Query the simulation's spatial index for the segments and connectors in the viewport"""
+        x_min, y_min = self.to_world(0, 0)
+        x_max, y_max = self.to_world(self.canvas_width, self.canvas_height)
+        self.view = (min(x_min, x_max), min(y_min, y_max), max(x_min, x_max), max(y_min, y_max))
+        roads = self.simulation.get_spatial_index().query_rect(x_min, y_min, x_max, y_max)
+        self.visible_segments = [road for road in roads if not isinstance(road, Connector)]
+        self.visible_connectors = [road for road in roads if isinstance(road, Connector)]
+
+    def update_static_layer(self):
+        """
+        Redraw segments and connectors into StaticCanvas when the zoom (line thickness) or the network changed,
+        or the viewport left the drawn area. The area is the viewport plus one viewport of margin on every side,
+        so panning mostly just moves the layer's transform.
+        """
+        x_min, y_min = self.to_world(0, 0)
+        x_max, y_max = self.to_world(self.canvas_width, self.canvas_height)
+        topology = self.simulation.get_topology()
+        region = self._static_region
+        if self._static_zoom == self.zoom and self._static_topology is topology and region is not None \
+                and region[0] <= x_min and region[1] <= y_min and x_max <= region[2] and y_max <= region[3]:
+            return
+        if self._static_topology is not topology:
+            self._lane_lines = {}
+        margin_x, margin_y = x_max - x_min, y_max - y_min
+        region = (x_min - margin_x, y_min - margin_y, x_max + margin_x, y_max + margin_y)
+        roads = self.simulation.get_spatial_index().query_rect(*region)
+
+        dpg.delete_item("StaticCanvas", children_only=True)
+        self.draw_segments([road for road in roads if not isinstance(road, Connector)])
+        self.draw_connectors([road for road in roads if isinstance(road, Connector)])
+        self._static_zoom, self._static_topology, self._static_region = self.zoom, topology, region
+
+    def update_grid(self):
+        """Redraw the grid lines when the view moved or zoomed"""
+        view = (self.zoom, self.offset, self.canvas_width, self.canvas_height)
+        if view == self._grid_view:
+            return
+        dpg.delete_item("OverlayCanvas", children_only=True)
+        self.draw_grid(10)
+        self.draw_grid(50)
+        self._grid_view = view
 
-    def draw_connectors(self):
-        for _, connector in self.simulation.connectors.items():
+    def draw_connectors(self, connectors=None, parent="StaticCanvas"):
+        for connector in self.visible_connectors if connectors is None else connectors:
             connector_width = len(connector.connections) * connector.lane_width
             dpg.draw_polyline(connector.points,
                               color=(180, 180, 220, 10),
                               thickness=connector_width * self.zoom,
-                              parent="Canvas")
+                              parent=parent)
             dpg.draw_polyline(connector.points,
                               color=(180, 180, 220, 10),
                               thickness=0.5 * self.zoom,
-                              parent="Canvas")
+                              parent=parent)
 
-    def draw_segments(self):
-        for _, segment in self.simulation.segments.items():
-            segment_width = segment.num_lanes * segment.lane_width
-            dpg.draw_polyline(segment.points,
-                              color=(180, 180, 220, 10),
-                              thickness=segment_width * self.zoom,
-                              parent="Canvas",
-                              )
+    def lane_lines(self, segment):
+        """Polylines of the lane borders of a segment, offset along the normal of its first piece (cached)"""
+        lines = self._lane_lines.get(segment.id)
+        if lines is None:
+            points = np.asarray(segment.points, dtype=float)
             # Calculate the unit normal vector of the segment
             # Assuming points are given in order and we use the first two to calculate direction
-            delta = np.array(segment.points[1]) - np.array(segment.points[0])
+            delta = points[1] - points[0]
             normal_vector = np.array([-delta[1], delta[0]])  # Rotate by 90 degrees counter-clockwise
             unit_normal_vector = normal_vector / np.linalg.norm(normal_vector)
 
-            # Calculate the lane lines
-            half_segment_width = segment_width / 2
-            lane_width = segment.lane_width * self.zoom
-            num_lanes = segment.num_lanes
-            lane_offset = np.linspace(-half_segment_width, half_segment_width, num=num_lanes + 1)
-
-            for offset in lane_offset:
-                lane_points = []
-                for p in segment.points:
-                    # Offset each point along the unit normal vector
-                    adjusted_point = np.array(p) + offset * unit_normal_vector
-                    lane_points.append(tuple(adjusted_point))
+            half_segment_width = segment.num_lanes * segment.lane_width / 2
+            lane_offset = np.linspace(-half_segment_width, half_segment_width, num=segment.num_lanes + 1)
+            lines = self._lane_lines[segment.id] = \
+                (points[None, :, :] + lane_offset[:, None, None] * unit_normal_vector).tolist()
+        return lines
 
+    def draw_segments(self, segments=None, parent="StaticCanvas"):
+        for segment in self.visible_segments if segments is None else segments:
+            segment_width = segment.num_lanes * segment.lane_width
+            dpg.draw_polyline(segment.points,
+                              color=(180, 180, 220, 10),
+                              thickness=segment_width * self.zoom,
+                              parent=parent,
+                              )
+            for lane_points in self.lane_lines(segment):
                 # Draw the lane line
                 dpg.draw_polyline(lane_points,
                                   color=(102, 102, 102),  # White color for lane lines
                                   thickness=0.1 * self.zoom,
-                                  parent="Canvas",
+                                  parent=parent,
                                   )
             # dpg.draw_arrow(segment.points[-1], segment.points[-2], thickness=0, size=1, color=(0, 0, 0, 50), parent="Canvas")
 
-    def draw_vehicles(self):
-        for _, segment in self.simulation.segments.items():
-            for lane in segment.lanes:
-                for vehicle in lane.vehicles:
-                    progress = vehicle.x / segment.length
-                    # if progress > 1:
-                    #     progress = 1
-                    if progress < 0 or progress > 1:
-                        print('progress outbound at lane', progress, 'id:', vehicle.id, 'lane_id:', lane.lane_id+"&"+vehicle.at_lane,
-                              'road_index:', vehicle.current_road_index, 'path:', vehicle.path, 'x:', vehicle.x)
-
-                    position = segment.get_point(progress)
-
-                    offset_num = ((vehicle.at_lane + 1) * 2 - 1 - segment.num_lanes) / 2
-                    heading = segment.get_heading(progress)
-                    position_at_lane = offset_position(position, heading, segment.lane_width, offset_num)
-
-                    node = dpg.add_draw_node(parent="Canvas")
-                    if not self.show_status_color:
-                        dpg.draw_line(
-                            (0, 0),
-                            (vehicle.length, 0),
-                            thickness=1.76 * self.zoom,
-                            color=(0, 0, 200, 127),
-                            parent=node,
-                        )
-                    elif self.show_status_color:
-                        if vehicle.stopped:
-                            dpg.draw_line(
-                                (0, 0),
-                                (vehicle.length, 0),
-                                thickness=1.76 * self.zoom,
-                                color=(255, 0, 0),
-                                parent=node
-                            )
-                        elif vehicle.slowing_down:
-                            dpg.draw_line(
-                                (0, 0),
-                                (vehicle.length, 0),
-                                thickness=1.76 * self.zoom,
-                                color=(0, 255, 0),
-                                parent=node
-                            )
-                            # print('slowing down color change: %s' % vehicle.id)
-                        else:
-                            dpg.draw_line(
-                                (0, 0),
-                                (vehicle.length, 0),
-                                thickness=1.76 * self.zoom,
-                                color=(0, 0, 200),
-                                parent=node
-                            )
-
-                    translate = dpg.create_translation_matrix(position_at_lane)
-                    rotate = dpg.create_rotation_matrix(heading, [0, 0, 1])
-                    dpg.apply_transform(node, translate * rotate)
-
-                    # Draw speed text
-                    # Calculate text position relative to the vehicle's tail
-                    text_position = (
-                        position_at_lane[0] + vehicle.length * math.cos(heading),
-                        position_at_lane[1] + vehicle.length * math.sin(heading)
-                    )
-                    # Optionally offset the text vertically so it doesn't overlap with the vehicle
-                    text_position = (text_position[0], text_position[1] + 2)
-
-                    self.activate_vehicle_info(lane, text_position, vehicle)
-
-    def activate_vehicle_info(self, lane, text_position, vehicle):
+    def vehicle_color(self, status):
+        if not self.show_status_color:
+            return 0, 0, 200, 127
+        if status == STOPPED:
+            return 255, 0, 0
+        if status == SLOWING:
+            return 0, 255, 0
+        return 0, 0, 200
+
+    def vehicle_labels(self, vid, lane_id, x, v, a):
+        """Label texts of a vehicle on a segment, in the order of vehicle_glyphs.LABEL_OFFSETS, None if all hidden"""
+        if not (self.show_speed or self.show_acceleration or self.show_id):
+            return None
         # 绘制速度、加速度和ID的
-        if self.show_speed:
-            # 绘制速度
-            dpg.draw_text(
-                pos=text_position,
-                text=f"V:{vehicle.v:.2f}",
-                size=2 * self.zoom,
-                color=(255, 255, 255),
-                parent="Canvas"
-            )
-            new_pos = (text_position[0] + 7, text_position[1])
-            dpg.draw_text(pos=new_pos, text=f"at:{str(lane.lane_id) + ' ' + str(vehicle.x)}",
-                          size=2 * self.zoom, color=(255, 255, 255), parent="Canvas")
-        if self.show_acceleration:
-            # 计算并绘制加速度
-            acceleration_position = (text_position[0], text_position[1] + 2)
-            dpg.draw_text(
-                pos=acceleration_position,
-                text=f"A:{vehicle.a:.2f}",
-                size=2 * self.zoom,
-                color=(255, 255, 255),
-                parent="Canvas"
-            )
-        if self.show_id:
-            # 计算并绘制ID
-            id_position = (text_position[0], text_position[1] + 4)
-            dpg.draw_text(
-                pos=id_position,
-                text=f"ID:{vehicle.id}",
-                size=2 * self.zoom,
-                color=(255, 255, 255),
-                parent="Canvas"
-            )
-
-    def draw_vehicle_at_connections(self):
-        for connector in self.simulation.connectors.values():
-            if not connector.vehicles:
-                continue
-            for vehicle in connector.vehicles:
-                progress = vehicle.x / connector.length
-                # if progress > 1:
-                #     progress = 1
-                # elif progress < 0:
-                #     progress = 0
-
-                # print('getting position: ', vehicle.id)
-                if progress<0 or progress>1:
-                    print('progress outbound at connector', progress, 'id:', vehicle.id, 'lane_id:', vehicle.at_lane,
-                          'road_index:', vehicle.current_road_index, 'path:', vehicle.path, 'x:', vehicle.x)
-
-                position = connector.get_point(progress)
-
-                offset_num = ((vehicle.at_lane + 1) * 2 - 1 - connector.num_lanes) / 2
-                # print('getting heading: ', vehicle.id)
-                heading = connector.get_heading(progress)
-
-                position_at_lane = offset_position(position, heading, connector.lane_width, offset_num)
-
-                node1 = dpg.add_draw_node(parent="Canvas")
-
-                translate = dpg.create_translation_matrix(position_at_lane)
-                rotate = dpg.create_rotation_matrix(heading, [0, 0, 1])
-                dpg.apply_transform(node1, translate * rotate)
-
-                dpg.draw_line(
-                    (0, 0),
-                    (vehicle.length, 0),
-                    thickness=1.76 * self.zoom,
-                    color=(0, 0, 200, 127),
-                    parent=node1,
-                )
-
-                # self.activate_vehicle_info(lane, text_position, vehicle)
-
-    def draw_tl(self):
+        return (f"V:{v:.2f}" if self.show_speed else None,
+                f"at:{str(lane_id) + ' ' + str(x)}" if self.show_speed else None,
+                f"A:{a:.2f}" if self.show_acceleration else None,
+                f"ID:{vid}" if self.show_id else None)
+
+    def visible_rows(self, snapshot, roads, xy):
+        """Snapshot rows of the vehicles on roads whose position lies in the viewport (plus the cull margin)"""
+        rows = [snapshot.rows[road] for road in roads if road in snapshot.rows]
+        if not rows:
+            return np.zeros(0, dtype=int)
+        rows = np.concatenate([np.arange(start, stop) for start, stop in rows])
+        margin = self.level_of_detail.cull_margin
+        x_min, y_min, x_max, y_max = self.view
+        x, y = xy[rows].T
+        return rows[(x >= x_min - margin) & (x <= x_max + margin) & (y >= y_min - margin) & (y <= y_max + margin)]
+
+    def draw_vehicles(self, snapshot, xy, heading, labels=True):
+        """
+        :param snapshot: Snapshot to draw
+        :param xy: vehicle positions, those of the snapshot or interpolated ones
+        :param heading: vehicle headings, same
+        :param labels: draw the vehicle texts, unless more than level_of_detail.max_labels vehicles are visible
+        """
+        rows = self.visible_rows(snapshot, self.visible_segments, xy)
+        labels = labels and len(rows) <= self.level_of_detail.max_labels
+        for i, x, length, v, a, status, position_at_lane, vehicle_heading in zip(
+                rows.tolist(), snapshot.x[rows].tolist(), snapshot.length[rows].tolist(), snapshot.v[rows].tolist(),
+                snapshot.a[rows].tolist(), snapshot.status[rows].tolist(), xy[rows].tolist(),
+                heading[rows].tolist()):
+            vid = snapshot.ids[i]
+            texts = self.vehicle_labels(vid, snapshot.lane_ids[i], x, v, a) if labels else None
+            anchor = None
+            if texts is not None:
+                # Calculate text position relative to the vehicle's tail, offset vertically so it doesn't
+                # overlap with the vehicle
+                anchor = (position_at_lane[0] + length * math.cos(vehicle_heading),
+                          position_at_lane[1] + length * math.sin(vehicle_heading) + 2)
+            self.vehicle_glyphs.place(vid, length, position_at_lane, vehicle_heading, self.vehicle_color(status),
+                                      texts, anchor)
+
+    def draw_vehicle_at_connections(self, snapshot, xy, heading):
+        rows = self.visible_rows(snapshot, self.visible_connectors, xy)
+        for i, length, position_at_lane, vehicle_heading in zip(
+                rows.tolist(), snapshot.length[rows].tolist(), xy[rows].tolist(), heading[rows].tolist()):
+            self.vehicle_glyphs.place(snapshot.ids[i], length, position_at_lane, vehicle_heading, (0, 0, 200, 127))
+
+    def draw_lane_density(self, snapshot):
+        """Shade every lane of the visible segments by its vehicle density (connectors are not shaded)"""
+        for segment in self.visible_segments:
+            rows = snapshot.rows.get(segment)
+            if rows is not None:
+                self.lane_density.shade(segment, np.bincount(snapshot.lane[rows[0]:rows[1]],
+                                                             minlength=segment.num_lanes).tolist())
+
+    def draw_tl(self, snapshot):
         """
         绘制交通灯
         """
-        for _, segment in self.simulation.segments.items():
+        for segment in self.visible_segments:
             segment_width = segment.num_lanes * segment.lane_width
             if segment.has_traffic_signal:
                 # Get the last two points of the segment.
@@ -440,7 +518,7 @@ class Visualizer:
                 ]
 
                 with dpg.draw_node(parent="Canvas"):
-                    if segment.traffic_signal_state:  # 为绿灯
+                    if snapshot.signals[segment.id]:  # 为绿灯
                         dpg.draw_line(p1=traffic_light_start, p2=traffic_light_end, color=(0, 255, 0),
                                       thickness=0.5 * self.zoom)
 
@@ -452,7 +530,10 @@ class Visualizer:
         screen_center = dpg.create_translation_matrix([self.canvas_width / 2, self.canvas_height / 2, -0.01])
         translate = dpg.create_translation_matrix(self.offset)
         scale = dpg.create_scale_matrix([self.zoom, self.zoom])
+        dpg.apply_transform("StaticCanvas", screen_center * scale * translate)
         dpg.apply_transform("Canvas", screen_center * scale * translate)
+        dpg.apply_transform("DensityCanvas", screen_center * scale * translate)
+        dpg.apply_transform("VehicleCanvas", screen_center * scale * translate)
 
     def close_logo(self):
         dpg.delete_item("logo")
@@ -526,11 +607,13 @@ class Visualizer:
             self.zoom_speed = 1
 
     def set_speed(self):
-        self.speed = dpg.get_value("SpeedUp")
+        self.speed = None if dpg.get_value("MaxSpeed") else dpg.get_value("SpeedUp")
+        self.pacing.real_time_factor = self.speed
+        self.pacing.reset()
 
-    def slow_down(self):
-        delay = dpg.get_value("Delay")
-        self.delay = int(delay)
+    def set_budget(self):
+        self.budget_ms = dpg.get_value("StepBudget")
+        self.pacing.budget = self.budget_ms / 1000
 
     def draw_grid(self, unit=10, opacity=10):
         color = (255, 255, 255, opacity)
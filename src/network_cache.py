@@ -0,0 +1,172 @@
+"""
+Compiled network cache: the derived geometry of every segment, curve and connector in one binary file.
+
+    with NetworkCache('.toysim_cache/test6.tsnet'):
+        sim = build_simulation()
+
+    python -m src.network_cache examples.grid --cache-dir .toysim_cache   # compile ahead of time
+    python -m src.runner examples.grid --duration 60 --network-cache .toysim_cache
+
+Objects built inside the block take their geometry (length, point / heading tables, arc-length tables, curve
+paths, see Segment.derive_geometry) from the cache instead of computing it. Entries are keyed by a digest of
+the object's definition (class, points, curve resolution, CACHE_VERSION), so an edited scenario misses on
+exactly the objects that changed; on leaving the block the file is rewritten with the entries of this network
+whenever something was compiled or left unused.
+
+File layout: MAGIC, uint32 header length, JSON header, padding to 8 bytes, float64 data. The header holds the
+network digest and, per entry, the (name, offset, shape) of its arrays. The data is memory-mapped read-only,
+loaded arrays are views into the file.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'TSNET001'
+# bump when the derived geometry changes, every cached entry is then recompiled
+CACHE_VERSION = 1
+
+_active = []
+
+
+def active():
+    """The cache of the innermost `with NetworkCache(...)` block, None outside"""
+    return _active[-1] if _active else None
+
+
+def definition_digest(segment):
+    h = hashlib.sha1(('%d %s %s' % (CACHE_VERSION, type(segment).__name__, segment.curve_resolution)).encode())
+    h.update(np.ascontiguousarray(segment.points, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+class NetworkCache:
+    def __init__(self, path):
+        self.path = path
+        # digest -> {name: array}, entries of the file are sliced from the data on first use
+        self.entries = {}
+        self.index = {}
+        self.data = None
+        self.used = []
+        self.hits = 0
+        self.misses = 0
+        self.network_digest = None
+        if os.path.exists(path):
+            self.load()
+
+    def __enter__(self):
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _active.remove(self)
+        if exc[0] is None and self.used and (self.misses or len(set(self.used)) != len(self.index)):
+            self.save()
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return
+            size, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(size).decode('utf-8'))
+        if header['version'] != CACHE_VERSION:
+            return
+        offset = len(MAGIC) + 4 + size
+        offset += -offset % 8
+        if header['size']:
+            # plain ndarray views slice much faster than np.memmap ones
+            self.data = np.memmap(self.path, dtype='<f8', mode='r', offset=offset).view(np.ndarray)
+        self.index = header['entries']
+        self.network_digest = header['network']
+
+    def get(self, digest):
+        geometry = self.entries.get(digest)
+        if geometry is None:
+            arrays = self.index.get(digest)
+            if arrays is None:
+                self.misses += 1
+                return None
+            geometry = self.entries[digest] = {}
+            for name, start, shape in arrays:
+                size = shape[0] * shape[1] if len(shape) == 2 else shape[0]
+                geometry[name] = self.data[start:start + size].reshape(shape)
+        self.hits += 1
+        self.used.append(digest)
+        return geometry
+
+    def put(self, digest, geometry):
+        self.entries[digest] = geometry
+        self.used.append(digest)
+
+    def save(self):
+        """Write the entries used by this network, atomically"""
+        used = list(dict.fromkeys(self.used))
+        self.network_digest = hashlib.sha1(' '.join(used).encode()).hexdigest()
+        entries = {}
+        chunks = []
+        size = 0
+        for digest in used:
+            arrays = []
+            for name, array in self.entries[digest].items():
+                array = np.asarray(array, dtype='<f8')
+                arrays.append((name, size, list(array.shape)))
+                chunks.append(array.reshape(-1))
+                size += array.size
+            entries[digest] = arrays
+        header = json.dumps({'version': CACHE_VERSION, 'network': self.network_digest, 'size': size,
+                             'entries': entries}).encode('utf-8')
+        offset = len(MAGIC) + 4 + len(header)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header + b'\0' * (-offset % 8))
+            if chunks:
+                f.write(np.concatenate(chunks).tobytes())
+        try:
+            os.replace(tmp, self.path)
+        except OSError:
+            # Windows refuses to replace a file that is still mapped, the next run compiles again
+            os.remove(tmp)
+            logging.warning("network cache %s is in use and was not updated", self.path)
+
+
+def cache_path(cache_dir, scenario, kwargs=None):
+    """One cache file per scenario and set of build_simulation arguments"""
+    is_file = scenario.endswith(('.py', '.json', '.toml'))
+    name = os.path.splitext(os.path.basename(scenario))[0] if is_file else scenario
+    key = hashlib.sha1(json.dumps([os.path.abspath(scenario) if is_file else scenario,
+                                   kwargs or {}], sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, '%s-%s.tsnet' % (name, key))
+
+
+def compile_network(scenario, cache_dir, engine='object', **kwargs):
+    """
+    Build the scenario inside its cache (see runner.load_scenario), compiling what is missing
+    :return: (Simulation, NetworkCache)
+    """
+    from src.runner import load_scenario
+
+    with NetworkCache(cache_path(cache_dir, scenario, kwargs)) as cache:
+        sim = load_scenario(scenario, engine, **kwargs)
+    return sim, cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the geometry of a ToySim scenario into a cache file")
+    parser.add_argument('scenario', help="module name (examples.test6) or path to a scenario .py file")
+    parser.add_argument('--cache-dir', default='.toysim_cache')
+    args = parser.parse_args(argv)
+    # under `python -m` this module is __main__, the segments look up the active cache in src.network_cache
+    from src.network_cache import compile_network as compile_
+    sim, cache = compile_(args.scenario, args.cache_dir)
+    print("%s: %d objects, %d compiled, %d from cache, network %s" % (
+        cache.path, len(sim.segments) + len(sim.connectors), cache.misses, cache.hits, cache.network_digest))
+
+
+if __name__ == '__main__':
+    main()
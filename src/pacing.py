@@ -0,0 +1,86 @@
+"""
+Pacing of an interactive run: how many simulation steps to take per frame.
+
+    pacing = PacingController(sim.dt, real_time_factor=10, budget=0.010)
+    while ...:
+        steps = pacing.steps(interval)                 # interval: wall-clock seconds since the last frame
+        start = time.perf_counter()
+        sim.run(steps)
+        pacing.record(steps, time.perf_counter() - start, interval)
+        print(pacing.achieved, pacing.requested)
+
+With a real-time factor the steps owed for the elapsed wall-clock time are run, fractions carried over to the next
+frame; without one (as fast as possible) as many steps as fit in the budget. In both cases the step count is capped
+by budget / measured step cost, so a slow network lowers the achieved factor instead of the frame rate.
+"""
+
+# the simulation gives up catching up with wall-clock time when it is this many frames behind
+MAX_FRAMES_BEHIND = 4
+
+
+class PacingController:
+    def __init__(self, dt, real_time_factor=1.0, budget=None, smoothing=0.2):
+        """
+        :param dt: simulation step (s)
+        :param real_time_factor: target simulated seconds per wall-clock second, None for as fast as the budget allows
+        :param budget: wall-clock seconds of stepping per frame, None for unlimited (needs a real-time factor)
+        :param smoothing: weight of the last frame in the measured averages
+        """
+        self.dt = dt
+        self.real_time_factor = real_time_factor
+        self.budget = budget
+        self.smoothing = smoothing
+        # exponential averages of the wall-clock cost of one step (s) and of the achieved real-time factor
+        self.step_cost = None
+        self.achieved = None
+        # simulated seconds owed to the real-time factor
+        self._owed = 0.0
+
+    @property
+    def requested(self):
+        return self.real_time_factor
+
+    def steps(self, interval):
+        """
+        :param interval: wall-clock seconds since the last frame
+        :return: number of steps to run in this frame
+        """
+        if self.real_time_factor:
+            self._owed += self.real_time_factor * interval
+            steps = int(self._owed / self.dt)
+            if self.budget is None or self.step_cost is None:
+                return steps
+        elif self.budget is None:
+            raise ValueError("running as fast as possible needs a budget")
+        elif self.step_cost is None:
+            # nothing measured yet
+            return 1
+        else:
+            steps = None
+        fit = max(int(self.budget / self.step_cost), 1)
+        return fit if steps is None else min(steps, fit)
+
+    def record(self, steps, elapsed, interval):
+        """
+        :param steps: steps run in the frame
+        :param elapsed: wall-clock seconds they took
+        :param interval: wall-clock seconds since the last frame, as given to steps()
+        """
+        if steps:
+            cost = elapsed / steps
+            self.step_cost = cost if self.step_cost is None else self.step_cost + self.smoothing * (
+                cost - self.step_cost)
+        if self.real_time_factor:
+            # keep the fraction of a step, drop what cannot be caught up within a few frames
+            self._owed = min(max(self._owed - steps * self.dt, 0.0),
+                             self.dt + MAX_FRAMES_BEHIND * self.real_time_factor * interval)
+        else:
+            self._owed = 0.0
+        if interval > 0:
+            rate = steps * self.dt / interval
+            self.achieved = rate if self.achieved is None else self.achieved + self.smoothing * (rate - self.achieved)
+
+    def reset(self):
+        """Forget the time owed, e.g. after a pause"""
+        self._owed = 0.0
+        self.achieved = None
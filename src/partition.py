@@ -0,0 +1,360 @@
+"""
+Spatially partitioned simulation, every partition of the network stepped by its own worker process.
+
+    with PartitionedSimulation('examples.grid', partitions=4, seed=1, scenario_kwargs={'cols': 4, 'rows': 4}) as sim:
+        sim.run(3600)
+        print(sim.summary())
+
+Every worker builds the whole scenario, then keeps the segments of its partition, the connectors leaving them
+and the generators feeding them. Vehicles leaving a connector towards another partition are pickled into the
+worker's shared-memory outbox and picked up by the destination worker before it delivers the step's arrivals,
+so the exchange costs one barrier per step. Arrivals are delivered in the global connector order, and all
+random draws come from per-entity streams (Simulation.set_seed), hence a partitioned run gives the same
+vehicle states as a single-process run with the same seed.
+"""
+import multiprocessing
+import pickle
+import struct
+import traceback
+from collections import Counter, defaultdict
+from multiprocessing import shared_memory
+
+from src.runner import load_scenario
+
+
+def generator_sources(gen):
+    """Segments a vehicle generator puts vehicles on"""
+    return {config['path'][0] for _, config in gen.vehicles if config.get('path')}
+
+
+def partition_network(sim, parts, tolerance=0.1, passes=8):
+    """
+    Split the segments of a simulation into `parts` spatially compact partitions of similar load, with few
+    connectors between partitions. Connectors belong to the partition of their from_segment; the source
+    segments of a vehicle generator are kept together.
+    :param tolerance: allowed load excess of a partition over the mean during refinement
+    :return: {segment id: partition index}
+    """
+    # units: groups of segments that have to share a partition
+    parent = {sid: sid for sid in sim.segments}
+
+    def find(sid):
+        while parent[sid] != sid:
+            parent[sid] = parent[parent[sid]]
+            sid = parent[sid]
+        return sid
+
+    for gen in sim.vehicle_generator:
+        sources = sorted(generator_sources(gen))
+        for sid in sources[1:]:
+            parent[find(sid)] = find(sources[0])
+
+    members = defaultdict(list)
+    for sid in sim.segments:
+        members[find(sid)].append(sid)
+    units = list(members)
+    if parts > len(units):
+        raise ValueError("cannot split %d segment groups into %d partitions" % (len(units), parts))
+
+    # load: lane length of the segments plus of the connectors leaving them
+    weight = Counter()
+    for sid, segment in sim.segments.items():
+        weight[find(sid)] += segment.length * len(segment.lanes)
+    for connector in sim.connectors.values():
+        weight[find(connector.from_segment)] += connector.length * connector.num_lanes
+    position = {}
+    for unit in units:
+        points = [point for sid in members[unit] for point in (sim.segments[sid].points[0],
+                                                                sim.segments[sid].points[-1])]
+        position[unit] = (sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+
+    links = defaultdict(Counter)
+    for connector in sim.connectors.values():
+        a, b = find(connector.from_segment), find(connector.to_segment)
+        if a != b:
+            links[a][b] += 1
+            links[b][a] += 1
+
+    # recursive coordinate bisection on the unit positions, split at the weighted median
+    part = {}
+
+    def bisect(group, parts, first):
+        if parts == 1:
+            for unit in group:
+                part[unit] = first
+            return
+        xs = [position[unit][0] for unit in group]
+        ys = [position[unit][1] for unit in group]
+        axis = 0 if max(xs) - min(xs) >= max(ys) - min(ys) else 1
+        group = sorted(group, key=lambda unit: (position[unit][axis], position[unit][1 - axis]))
+        left_parts = parts // 2
+        target = sum(weight[unit] for unit in group) * left_parts / parts
+        cumulative = 0
+        split = 0
+        while split < len(group) - (parts - left_parts) and \
+                (split < left_parts or cumulative + weight[group[split]] / 2 < target):
+            cumulative += weight[group[split]]
+            split += 1
+        bisect(group[:split], left_parts, first)
+        bisect(group[split:], parts - left_parts, first + left_parts)
+
+    bisect(units, parts, 0)
+
+    # greedy refinement: move boundary units to the partition they have most connectors to
+    load = Counter()
+    size = Counter(part.values())
+    for unit in units:
+        load[part[unit]] += weight[unit]
+    limit = (1 + tolerance) * sum(weight.values()) / parts
+    for _ in range(passes):
+        moved = 0
+        for unit in units:
+            own = part[unit]
+            connections = Counter()
+            for other, count in links[unit].items():
+                connections[part[other]] += count
+            best, gain = own, 0
+            for candidate, count in sorted(connections.items()):
+                if candidate != own and count - connections[own] > gain \
+                        and load[candidate] + weight[unit] <= limit and size[own] > 1:
+                    best, gain = candidate, count - connections[own]
+            if best != own:
+                part[unit] = best
+                load[own] -= weight[unit]
+                load[best] += weight[unit]
+                size[own] -= 1
+                size[best] += 1
+                moved += 1
+        if not moved:
+            break
+
+    return {sid: part[find(sid)] for sid in sim.segments}
+
+
+def cut_connectors(sim, assignment):
+    """Connectors whose vehicles are handed over between partitions"""
+    return [cid for cid, connector in sim.connectors.items()
+            if assignment[connector.from_segment] != assignment[connector.to_segment]]
+
+
+def vehicle_states(sim):
+    """
+    :return: sorted (vehicle id, segment / connector id, lane, x, v, a) of every vehicle on the network
+    """
+    states = []
+    for sid, segment in sim.segments.items():
+        for lane in segment.lanes:
+            for veh in lane.vehicles:
+                states.append((str(veh.id), sid, str(lane.lane_index), veh.x, veh.v, veh.a))
+    for cid, connector in sim.connectors.items():
+        for from_lane, to_lane_dic in connector.connections.items():
+            for to_lane, d_que in to_lane_dic.items():
+                for veh in d_que:
+                    states.append((str(veh.id), cid, from_lane + '>' + to_lane, veh.x, veh.v, veh.a))
+    return sorted(states)
+
+
+class _Exchange:
+    """
+    Simulation.handover of a worker. The outbox of every worker is a shared-memory block of two halves used
+    alternately, so a worker can write the next step while slower peers still read the previous one.
+    """
+    HEADER = struct.Struct('<Q')
+
+    def __init__(self, sim, index, assignment, outboxes, capacity, barrier):
+        self.sim = sim
+        self.index = index
+        self.assignment = assignment
+        self.outboxes = outboxes
+        self.capacity = capacity
+        self.barrier = barrier
+        self.half = 0
+        # global order of the connectors, taken before the simulation is restricted to the partition
+        self.connector_order = {cid: i for i, cid in enumerate(sim.connectors)}
+
+    def __call__(self, arrivals):
+        received = []
+        outgoing = defaultdict(list)
+        for seq, arrival in enumerate(arrivals):
+            veh, connector_id, segment_id, _ = arrival
+            key = (self.connector_order[connector_id], seq)
+            destination = self.assignment[segment_id]
+            if destination == self.index:
+                received.append((key, arrival))
+            else:
+                if self.sim.vehicle_arrays is not None:
+                    self.sim.vehicle_arrays.release(veh)
+                self.sim.vehicles.pop(veh.id, None)
+                outgoing[destination].append((key, arrival))
+
+        offset = self.half * self.capacity
+        buf = self.outboxes[self.index].buf
+        if outgoing:
+            payload = pickle.dumps(dict(outgoing), protocol=pickle.HIGHEST_PROTOCOL)
+            if len(payload) + self.HEADER.size > self.capacity:
+                raise RuntimeError("handover of %d bytes exceeds the outbox capacity of %d bytes"
+                                   % (len(payload), self.capacity))
+            buf[offset + self.HEADER.size:offset + self.HEADER.size + len(payload)] = payload
+            self.HEADER.pack_into(buf, offset, len(payload))
+        else:
+            self.HEADER.pack_into(buf, offset, 0)
+
+        self.barrier.wait()
+
+        for peer, outbox in enumerate(self.outboxes):
+            if peer == self.index:
+                continue
+            size, = self.HEADER.unpack_from(outbox.buf, offset)
+            if size:
+                start = offset + self.HEADER.size
+                incoming = pickle.loads(outbox.buf[start:start + size]).get(self.index)
+                if incoming:
+                    for key, arrival in incoming:
+                        self.sim.vehicles[arrival[0].id] = arrival[0]
+                    received.extend(incoming)
+        self.half ^= 1
+
+        received.sort(key=lambda item: item[0])
+        return [arrival for _, arrival in received]
+
+
+def _restrict(sim, owned):
+    # compile the topology of the whole network first: vehicles carry its numbers from partition to partition
+    sim.get_topology()
+    sim.segments = {sid: segment for sid, segment in sim.segments.items() if sid in owned}
+    sim.connectors = {cid: connector for cid, connector in sim.connectors.items() if connector.from_segment in owned}
+    sim.vehicle_generator = [gen for gen in sim.vehicle_generator if generator_sources(gen) <= owned]
+
+
+def _worker(index, scenario, engine, seed, scenario_kwargs, assignment, outbox_names, capacity, barrier, conn):
+    outboxes = []
+    try:
+        outboxes = [shared_memory.SharedMemory(name=name) for name in outbox_names]
+        sim = load_scenario(scenario, engine, **scenario_kwargs)
+        sim.set_seed(seed)
+        sim.handover = _Exchange(sim, index, assignment, outboxes, capacity, barrier)
+        _restrict(sim, {sid for sid, part in assignment.items() if part == index})
+        conn.send(('ready', None))
+        while True:
+            command, arg = conn.recv()
+            if command == 'run':
+                for _ in range(arg):
+                    sim.update_with_lane()
+                conn.send(('done', sim.t))
+            elif command == 'stats':
+                conn.send(('stats', {
+                    'vehicles_generated': sum(gen.veh_cnt for gen in sim.vehicle_generator),
+                    'vehicles_exited': sim.exited_vehicles,
+                    'vehicles_active': len(vehicle_states(sim)),
+                    'segments': len(sim.segments),
+                    'connectors': len(sim.connectors),
+                }))
+            elif command == 'states':
+                conn.send(('states', vehicle_states(sim)))
+            elif command == 'close':
+                break
+    except BaseException:
+        barrier.abort()
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        for outbox in outboxes:
+            outbox.close()
+
+
+class PartitionedSimulation:
+    """
+    Runs a scenario split over `partitions` worker processes, see the module docstring
+    :param scenario: scenario module, see runner.load_scenario
+    :param seed: seed of the per-entity random streams, the same seed gives the same run as
+                 Simulation.set_seed(seed) in a single process
+    :param scenario_kwargs: further arguments of the scenario's build_simulation
+    :param handover_capacity: bytes per outbox half, bounds the vehicles one partition hands over per step
+    """
+    def __init__(self, scenario, partitions, engine='object', seed=0, scenario_kwargs=None,
+                 handover_capacity=1 << 20):
+        self.scenario = scenario
+        self.partitions = partitions
+        self.engine = engine
+        self.seed = seed
+        scenario_kwargs = scenario_kwargs or {}
+
+        sim = load_scenario(scenario, engine, **scenario_kwargs)
+        self.dt = sim.dt
+        self.t = sim.t
+        self.assignment = partition_network(sim, partitions)
+        self.cut_connectors = cut_connectors(sim, self.assignment)
+
+        ctx = multiprocessing.get_context('spawn')
+        self._outboxes = [shared_memory.SharedMemory(create=True, size=2 * handover_capacity)
+                          for _ in range(partitions)]
+        barrier = ctx.Barrier(partitions)
+        self._conns = []
+        self._workers = []
+        for index in range(partitions):
+            parent_conn, child_conn = ctx.Pipe()
+            worker = ctx.Process(target=_worker, name='partition-%d' % index, daemon=True,
+                                 args=(index, scenario, engine, seed, scenario_kwargs, self.assignment,
+                                       [outbox.name for outbox in self._outboxes], handover_capacity, barrier,
+                                       child_conn))
+            worker.start()
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+        self._gather('ready')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _gather(self, expected):
+        replies = [conn.recv() for conn in self._conns]
+        errors = [arg for kind, arg in replies if kind == 'error']
+        if errors:
+            # report the worker that failed first rather than the peers whose barrier broke
+            errors.sort(key=lambda message: 'BrokenBarrierError' in message)
+            self.close()
+            raise RuntimeError("partition worker failed:\n%s" % errors[0])
+        return [arg for kind, arg in replies if kind == expected]
+
+    def _broadcast(self, command, arg=None):
+        for conn in self._conns:
+            conn.send((command, arg))
+
+    def run(self, steps):
+        """Advance every partition by `steps` time steps"""
+        self._broadcast('run', steps)
+        self.t = self._gather('done')[0]
+
+    def vehicle_states(self):
+        """Same as vehicle_states(sim) of a single-process run"""
+        self._broadcast('states')
+        return sorted(state for states in self._gather('states') for state in states)
+
+    def summary(self):
+        self._broadcast('stats')
+        stats = self._gather('stats')
+        summary = {'engine': self.engine, 'partitions': self.partitions, 'sim_time': self.t,
+                   'cut_connectors': len(self.cut_connectors)}
+        for key in ('vehicles_generated', 'vehicles_exited', 'vehicles_active'):
+            summary[key] = sum(s[key] for s in stats)
+        summary['segments_per_partition'] = [s['segments'] for s in stats]
+        return summary
+
+    def close(self):
+        if not self._workers:
+            return
+        for conn, worker in zip(self._conns, self._workers):
+            if worker.is_alive():
+                try:
+                    conn.send(('close', None))
+                except OSError:
+                    pass
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        for outbox in self._outboxes:
+            outbox.close()
+            outbox.unlink()
+        self._workers = []
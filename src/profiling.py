@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+
+
+class StepProfiler:
+    """
+    Per-phase timers and counters of Simulation.update_with_lane, kept for the last `window` steps.
+    Enabled with Simulation.enable_profiling(); while Simulation.profiler is None nothing is measured.
+    """
+    PHASES = ('lanes', 'segment_transfers', 'connectors', 'connector_transfers', 'signals', 'generators')
+    COUNTERS = ('vehicles_updated', 'lane_change_evaluations', 'transfers', 'generator_insertions')
+
+    def __init__(self, window=600):
+        self.window = window
+        self.durations = np.zeros((window, len(self.PHASES)))
+        self.counters = np.zeros((window, len(self.COUNTERS)), dtype=np.int64)
+        self.steps = 0
+
+        self._marks = [0.0] * (len(self.PHASES) + 1)
+        self._phase = 0
+
+    def begin(self):
+        self._phase = 0
+        self._marks[0] = time.perf_counter()
+
+    def lap(self):
+        """Close the current phase"""
+        self._phase += 1
+        self._marks[self._phase] = time.perf_counter()
+
+    def end(self, *counters):
+        """
+        Store the step
+        :param counters: one value per COUNTERS entry
+        """
+        row = self.steps % self.window
+        self.durations[row] = np.diff(self._marks)
+        self.counters[row] = counters
+        self.steps += 1
+
+    def _rows(self):
+        return min(self.steps, self.window)
+
+    @property
+    def last(self):
+        """Phase durations (s) and counters of the last step"""
+        if not self.steps:
+            return {}
+        row = (self.steps - 1) % self.window
+        result = dict(zip(self.PHASES, self.durations[row].tolist()))
+        result.update(zip(self.COUNTERS, self.counters[row].tolist()))
+        return result
+
+    def summary(self):
+        """
+        Rolling statistics over the last `window` steps
+        :return: {'steps', 'step_ms', 'phases': {phase: {mean_ms, p50_ms, p99_ms, max_ms, share}},
+                  'counters': {counter: mean per step}}
+        """
+        n = self._rows()
+        if not n:
+            return {'steps': 0, 'step_ms': 0.0, 'phases': {}, 'counters': {}}
+        durations = self.durations[:n] * 1000
+        total = durations.sum()
+        p50, p99 = np.percentile(durations, [50, 99], axis=0)
+        phases = {}
+        for i, phase in enumerate(self.PHASES):
+            phases[phase] = {
+                'mean_ms': float(durations[:, i].mean()),
+                'p50_ms': float(p50[i]),
+                'p99_ms': float(p99[i]),
+                'max_ms': float(durations[:, i].max()),
+                'share': float(durations[:, i].sum() / total) if total > 0 else 0.0,
+            }
+        counters = dict(zip(self.COUNTERS, self.counters[:n].mean(axis=0).tolist()))
+        return {'steps': n, 'step_ms': float(total / n), 'phases': phases, 'counters': counters}
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = ["last %d steps, %.3f ms/step" % (summary['steps'], summary['step_ms']),
+                 "%-20s %9s %9s %9s %9s %6s" % ('phase', 'mean ms', 'p50 ms', 'p99 ms', 'max ms', 'share')]
+        for phase, stats in summary['phases'].items():
+            lines.append("%-20s %9.3f %9.3f %9.3f %9.3f %5.1f%%" % (
+                phase, stats['mean_ms'], stats['p50_ms'], stats['p99_ms'], stats['max_ms'], stats['share'] * 100))
+        for counter, mean in summary['counters'].items():
+            lines.append("%-24s %9.2f / step" % (counter, mean))
+        return '\n'.join(lines)
@@ -0,0 +1,191 @@
+"""
+Monte-Carlo replications of a scenario in a process pool.
+
+    python -m src.replication examples.test6 --replications 100 --duration 900 --warmup 300 --output kpis.json
+
+Replication i runs with Simulation.set_seed(seeds[i]): each replication, and each generator, segment and
+connector within it, draws from its own random stream, so replications are independent and the result does
+not depend on the number of processes.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+from collections import defaultdict
+
+import numpy as np
+from scipy import stats
+
+from src.event_log import EventType
+from src.runner import load_scenario
+from src.simulator import ENGINES
+from src.travel_time import free_flow_time
+
+KPIS = ('throughput', 'mean_speed', 'delay')
+
+
+class KPICollector:
+    """
+    Segment traversals of a run, built from the simulator events (plugged in as Simulation.event_log).
+    Only traversals that end after `start` are counted.
+    """
+    def __init__(self, sim, start=0.0):
+        self.sim = sim
+        self.start = start
+        self.segment_of_lane = {lane.lane_id: segment for segment in sim.segments.values() for lane in segment.lanes}
+        # vehicle id -> (segment, entry time)
+        self.entered = {}
+        # segment id -> [traversals, travel time, free-flow time]
+        self.traversals = defaultdict(lambda: [0, 0.0, 0.0])
+        self.network_exits = 0
+
+    def record(self, t, event_type, vehicle, src=None, dst=None, x=0.0):
+        if event_type in (EventType.SEGMENT_TO_CONNECTOR, EventType.VEHICLE_EXITED):
+            entry = self.entered.pop(vehicle, None)
+            if entry is not None and t >= self.start:
+                segment, entry_t = entry
+                totals = self.traversals[segment.id]
+                totals[0] += 1
+                totals[1] += t - entry_t
+                totals[2] += free_flow_time(segment.length, self.sim.vehicles[vehicle])
+            if event_type == EventType.VEHICLE_EXITED and t >= self.start:
+                self.network_exits += 1
+        elif event_type in (EventType.VEHICLE_ENTERED, EventType.CONNECTOR_TO_SEGMENT):
+            self.entered[vehicle] = (self.segment_of_lane[dst], t)
+
+    def kpis(self, window):
+        """
+        :param window: simulated seconds the traversals were counted over
+        :return: {'network': {kpi: value}, 'segments': {segment id: {kpi: value}}}. throughput in vehicles per
+                 hour, mean_speed (space mean, from travel times) in m/s, delay in seconds per vehicle
+        """
+        segments = {}
+        total = [0, 0.0, 0.0, 0.0]
+        for sid, segment in self.sim.segments.items():
+            count, travel_time, free_flow = self.traversals.get(sid, (0, 0.0, 0.0))
+            segments[sid] = {
+                'throughput': count * 3600 / window,
+                'mean_speed': count * segment.length / travel_time if travel_time > 0 else math.nan,
+                'delay': (travel_time - free_flow) / count if count else math.nan,
+            }
+            total[0] += count
+            total[1] += travel_time
+            total[2] += free_flow
+            total[3] += count * segment.length
+        network = {
+            'throughput': self.network_exits * 3600 / window,
+            'mean_speed': total[3] / total[1] if total[1] > 0 else math.nan,
+            'delay': (total[1] - total[2]) / total[0] if total[0] else math.nan,
+        }
+        return {'network': network, 'segments': segments}
+
+
+def build(scenario, engine, scenario_kwargs):
+    if callable(scenario):
+        return scenario(engine=engine, **scenario_kwargs)
+    return load_scenario(scenario, engine, **scenario_kwargs)
+
+
+def run_replication(task):
+    """
+    One replication
+    :param task: (scenario, engine, scenario_kwargs, seed, warmup, duration)
+    """
+    scenario, engine, scenario_kwargs, seed, warmup, duration = task
+    sim = build(scenario, engine, scenario_kwargs)
+    sim.set_seed(seed)
+    collector = KPICollector(sim, start=sim.t + warmup)
+    sim.event_log = collector
+    sim.run(int(round((warmup + duration) / sim.dt)))
+    result = collector.kpis(duration)
+    result['seed'] = seed
+    return result
+
+
+def confidence_interval(values, confidence=0.95):
+    """
+    Student-t interval of the mean, replications where the KPI is undefined (NaN) are left out
+    :return: {'mean', 'std', 'half_width', 'ci_low', 'ci_high', 'n'}
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if not n:
+        return {'mean': math.nan, 'std': math.nan, 'half_width': math.nan,
+                'ci_low': math.nan, 'ci_high': math.nan, 'n': 0}
+    mean = float(values.mean())
+    std = float(values.std(ddof=1)) if n > 1 else math.nan
+    half_width = float(stats.t.ppf((1 + confidence) / 2, n - 1) * std / math.sqrt(n)) if n > 1 else math.nan
+    return {'mean': mean, 'std': std, 'half_width': half_width,
+            'ci_low': mean - half_width, 'ci_high': mean + half_width, 'n': n}
+
+
+def aggregate(results, confidence=0.95):
+    network = {kpi: confidence_interval([r['network'][kpi] for r in results], confidence) for kpi in KPIS}
+    segments = {}
+    for sid in results[0]['segments']:
+        segments[sid] = {kpi: confidence_interval([r['segments'][sid][kpi] for r in results], confidence)
+                         for kpi in KPIS}
+    return {'replications': len(results), 'confidence': confidence, 'network': network, 'segments': segments}
+
+
+def run_replications(scenario, seeds, duration, warmup=0.0, engine='object', scenario_kwargs=None,
+                     processes=None, confidence=0.95):
+    """
+    Run one replication per seed in a process pool and aggregate the KPIs
+    :param scenario: scenario module name or path (see runner.load_scenario), or a picklable factory
+                     callable(engine=..., **scenario_kwargs) -> Simulation
+    :param seeds: iterable of seeds, or the number of replications (seeds 0 .. n-1)
+    :param duration: simulated seconds over which the KPIs are measured, after `warmup` seconds
+    :param processes: pool size, None for every core
+    :return: aggregated KPIs with confidence intervals (see aggregate), plus the per-replication results
+    """
+    seeds = list(range(seeds)) if isinstance(seeds, int) else list(seeds)
+    tasks = [(scenario, engine, scenario_kwargs or {}, seed, warmup, duration) for seed in seeds]
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes) as pool:
+        results = pool.map(run_replication, tasks, chunksize=1)
+    summary = aggregate(results, confidence)
+    summary['per_replication'] = results
+    return summary
+
+
+def format_summary(summary, top=10):
+    lines = ["%d replications, %d%% confidence intervals" % (summary['replications'], summary['confidence'] * 100),
+             "%-14s %12s %12s" % ('network', 'mean', '+/-')]
+    for kpi, ci in summary['network'].items():
+        lines.append("%-14s %12.3f %12.3f" % (kpi, ci['mean'], ci['half_width']))
+    lines.append("segments with the largest delay")
+    lines.append("%-14s %18s %18s %18s" % ('segment', 'throughput veh/h', 'mean speed m/s', 'delay s'))
+    ranked = sorted(summary['segments'].items(), key=lambda item: -np.nan_to_num(item[1]['delay']['mean']))
+    for sid, kpis in ranked[:top]:
+        lines.append("%-14s %18s %18s %18s" % (sid, *("%.2f +/- %.2f" % (kpis[kpi]['mean'], kpis[kpi]['half_width'])
+                                                      for kpi in KPIS)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte-Carlo replications of a ToySim scenario")
+    parser.add_argument('scenario', help="module name (examples.test6) or path to a scenario .py file")
+    parser.add_argument('--replications', type=int, default=50)
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--duration', type=float, required=True, help="simulated seconds measured")
+    parser.add_argument('--warmup', type=float, default=0.0, help="simulated seconds before measuring")
+    parser.add_argument('--engine', choices=ENGINES, default='object')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--output', default=None, help="write the KPIs to this JSON file")
+    args = parser.parse_args(argv)
+
+    seeds = range(args.first_seed, args.first_seed + args.replications)
+    summary = run_replications(args.scenario, seeds, args.duration, args.warmup, args.engine,
+                               processes=args.processes, confidence=args.confidence)
+    print(format_summary(summary))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Shortest paths over the segment / connector graph (see Topology).
+
+    router = sim.get_router('free_flow')
+    router.path('0-0-3', '2-0-5')      # ['0-0-3', '0-0-5', '1-0-3', ...]
+
+Segments are the nodes; following connector c from segment a to b costs c plus b. Dijkstra runs once per
+origin, and the shortest-path tree is kept, so every later destination of that origin is a table walk and
+every path is built once and then shared by all vehicles that take it. build() fills the table for many
+origins in one call.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+WEIGHTS = ('length', 'free_flow')
+# m/s, for roads without speed limit (the default v_max of Vehicle)
+DEFAULT_SPEED = 15
+
+
+class Router:
+    def __init__(self, topology, weight='length', default_speed=DEFAULT_SPEED):
+        """
+        :param topology: Topology of the network
+        :param weight: 'length' (m) or 'free_flow' (s, length over speed limit)
+        :param default_speed: speed of roads without speed limit, for 'free_flow'
+        """
+        if weight not in WEIGHTS:
+            raise ValueError("unknown route weight %r, expected one of %s" % (weight, WEIGHTS))
+        self.topology = topology
+        self.weight = weight
+
+        def cost(road):
+            if weight == 'length':
+                return road.length
+            return road.length / (road.speed_limit or default_speed)
+
+        self.segment_cost = np.array([cost(segment) for segment in topology.segments], dtype=float)
+        self.connector_cost = np.array([cost(connector) for connector in topology.connectors], dtype=float)
+
+        n = len(topology.segments)
+        c = topology.out_connectors
+        self.graph = csr_matrix((self.connector_cost[c] + self.segment_cost[topology.successors],
+                                 (topology.connector_from[c], topology.successors)), shape=(n, n))
+        # origin -> (cost from the end of the origin, predecessor), from dijkstra
+        self._trees = {}
+        # (origin, destination) -> path, None when unreachable
+        self._paths = {}
+
+    def build(self, origins=None):
+        """
+        Shortest-path trees of many origins in one Dijkstra call
+        :param origins: segment ids, None for every segment (all pairs)
+        """
+        index = self.topology.segment_index
+        todo = [index[sid] for sid in (origins if origins is not None else index) if index[sid] not in self._trees]
+        if not todo:
+            return
+        dist, pred = dijkstra(self.graph, indices=todo, return_predecessors=True)
+        for i, o in enumerate(todo):
+            self._trees[o] = (dist[i], pred[i])
+
+    def _tree(self, o):
+        tree = self._trees.get(o)
+        if tree is None:
+            dist, pred = dijkstra(self.graph, indices=o, return_predecessors=True)
+            tree = self._trees[o] = (dist, pred)
+        return tree
+
+    def _segment(self, sid):
+        o = self.topology.segment_index.get(sid)
+        if o is None:
+            raise KeyError("unknown segment %r" % sid)
+        return o
+
+    def cost(self, origin, destination):
+        """
+        :return: cost of the shortest path, both end segments included; inf when unreachable
+        """
+        o, d = self._segment(origin), self._segment(destination)
+        if o == d:
+            return float(self.segment_cost[o])
+        return float(self.segment_cost[o] + self._tree(o)[0][d])
+
+    def path(self, origin, destination):
+        """
+        :return: segment ids from origin to destination, the same list object for every call
+        """
+        key = (origin, destination)
+        if key in self._paths:
+            path = self._paths[key]
+        else:
+            o, d = self._segment(origin), self._segment(destination)
+            path = [origin]
+            if o != d:
+                _, pred = self._tree(o)
+                if pred[d] < 0:
+                    path = None
+                else:
+                    nodes = [d]
+                    while nodes[-1] != o:
+                        nodes.append(pred[nodes[-1]])
+                    path = [self.topology.segments[s].id for s in reversed(nodes)]
+            self._paths[key] = path
+        if path is None:
+            raise ValueError("segment %s cannot be reached from segment %s" % (destination, origin))
+        return path
+
+    def check_path(self, path):
+        """Raise ValueError unless every segment of path exists and consecutive ones are joined by a connector"""
+        segments, connectors = self.topology.route(path)
+        for i, s in enumerate(segments):
+            if s < 0:
+                raise ValueError("path %s: unknown segment %r" % (path, path[i]))
+        for i, c in enumerate(connectors):
+            if c < 0:
+                raise ValueError("path %s: no connector from %s to %s" % (path, path[i], path[i + 1]))
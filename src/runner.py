@@ -0,0 +1,165 @@
+"""
+Headless runner, drives a Simulation without importing the GUI.
+
+    python -m src.runner examples.test6 --duration 600
+    python -m src.runner examples/test6.py --duration 3600 --engine vectorized --rtf 10 --summary out.json
+    python -m src.runner examples.test6 --duration 600 --event-log run.events
+    python -m src.runner examples.grid --duration 60 --network-cache .toysim_cache
+
+A scenario is any module exposing build_simulation(engine) -> Simulation, or a JSON / TOML scenario file (see
+src.scenario).
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import time
+
+from src.network_cache import NetworkCache, cache_path
+from src.scenario import SCENARIO_FILES, load_scenario_file
+from src.simulator import ENGINES, configure_logging
+
+
+def load_scenario(scenario, engine='object', network_cache=None, **kwargs):
+    """
+    Build a Simulation from a scenario module or scenario file
+    :param scenario: dotted module name (examples.test6), path to a .py file or to a .json / .toml scenario file
+                     (see src.scenario)
+    :param engine: see Simulation
+    :param network_cache: directory of compiled network caches (see src.network_cache), None builds from scratch
+    :param kwargs: further arguments of the scenario's build_simulation
+    :return: Simulation
+    """
+    if network_cache is not None:
+        with NetworkCache(cache_path(network_cache, scenario, kwargs)):
+            return load_scenario(scenario, engine, **kwargs)
+    if scenario.endswith(SCENARIO_FILES):
+        if kwargs:
+            raise TypeError("a scenario file takes no build arguments, got %s" % ', '.join(kwargs))
+        return load_scenario_file(scenario, engine)
+    if scenario.endswith('.py'):
+        name = os.path.splitext(os.path.basename(scenario))[0]
+        spec = importlib.util.spec_from_file_location(name, scenario)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(scenario)
+    if not hasattr(module, 'build_simulation'):
+        raise AttributeError("scenario %s has no build_simulation(engine) function" % scenario)
+    return module.build_simulation(engine=engine, **kwargs)
+
+
+def active_vehicles(sim):
+    vehicles = [veh for segment in sim.segments.values() for lane in segment.lanes for veh in lane.vehicles]
+    vehicles.extend(veh for connector in sim.connectors.values() for veh in connector.vehicles)
+    return vehicles
+
+
+def run_headless(sim, duration, real_time_factor=None):
+    """
+    Advance the simulation by `duration` simulated seconds
+    :param real_time_factor: None runs as fast as possible, see Simulation.run
+    :return: summary statistics of the run
+    """
+    steps = int(round(duration / sim.dt))
+    sim_start = sim.t
+    wall_start = time.perf_counter()
+    sim.run(steps, real_time_factor)
+    wall_time = time.perf_counter() - wall_start
+
+    sim_time = sim.t - sim_start
+    vehicles = active_vehicles(sim)
+    return {
+        'engine': sim.engine,
+        'steps': steps,
+        'sim_time': sim_time,
+        'wall_time': wall_time,
+        'speedup': sim_time / wall_time if wall_time > 0 else float('inf'),
+        'steps_per_second': steps / wall_time if wall_time > 0 else float('inf'),
+        'vehicles_generated': sum(gen.veh_cnt for gen in sim.vehicle_generator),
+        'vehicles_exited': sim.exited_vehicles,
+        'vehicles_active': len(vehicles),
+        'mean_speed_active': sum(veh.v for veh in vehicles) / len(vehicles) if vehicles else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a ToySim scenario without the GUI")
+    parser.add_argument('scenario', help="module name (examples.test6), path to a scenario .py file or to a "
+                                         ".json / .toml scenario file")
+    parser.add_argument('--duration', type=float, required=True, help="simulated seconds")
+    parser.add_argument('--engine', choices=ENGINES, default='object')
+    parser.add_argument('--seed', type=int, default=None,
+                        help="per-entity random streams, runs become reproducible (see Simulation.set_seed)")
+    parser.add_argument('--rtf', type=float, default=None,
+                        help="target real-time factor, omit to run as fast as possible")
+    parser.add_argument('--summary', default=None, help="write the summary statistics to this JSON file")
+    parser.add_argument('--profile', action='store_true', help="print per-phase step timings at the end")
+    parser.add_argument('--event-log', default=None,
+                        help="record vehicle events to this binary file, read it with python -m src.event_log")
+    parser.add_argument('--trajectories', default=None,
+                        help="record vehicle trajectories to this directory, read them with src.trajectory")
+    parser.add_argument('--trajectory-interval', type=float, default=1.0, help="simulated seconds between samples")
+    parser.add_argument('--detectors', default=None,
+                        help="stream loop detector (middle of every segment) and turning counter (every connector) "
+                             "aggregates to this CSV file")
+    parser.add_argument('--detector-interval', type=float, default=60.0, help="simulated seconds per aggregate")
+    parser.add_argument('--travel-times', default=None,
+                        help="write travel time and delay statistics per segment, connector movement and route to "
+                             "this JSON file")
+    parser.add_argument('--restore', default=None,
+                        help="start from this checkpoint of the same scenario instead of an empty network")
+    parser.add_argument('--checkpoint', default=None, help="write the final state to this checkpoint file")
+    parser.add_argument('--network-cache', default=None,
+                        help="directory of compiled network caches, the geometry is compiled once and then loaded")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_level)
+    sim = load_scenario(args.scenario, args.engine, network_cache=args.network_cache)
+    if args.seed is not None:
+        sim.set_seed(args.seed)
+    if args.restore:
+        sim.restore(args.restore)
+    if args.profile:
+        sim.enable_profiling()
+    if args.event_log:
+        sim.enable_event_log(args.event_log)
+    if args.trajectories:
+        sim.enable_trajectory_recorder(args.trajectories, args.trajectory_interval)
+    if args.travel_times:
+        sim.enable_travel_times()
+    if args.detectors:
+        detectors = sim.enable_detectors(args.detector_interval, args.detectors)
+        for segment_id, segment in sim.segments.items():
+            detectors.add_loop(segment_id, segment.length / 2)
+        for connector_id in sim.connectors:
+            detectors.add_turn_counter(connector_id)
+    try:
+        summary = run_headless(sim, args.duration, args.rtf)
+    finally:
+        sim.disable_event_log()
+        sim.disable_trajectory_recorder()
+        sim.disable_detectors()
+    if args.checkpoint:
+        sim.checkpoint(args.checkpoint)
+    if args.travel_times:
+        with open(args.travel_times, 'w') as f:
+            json.dump(sim.travel_times.summary(), f, indent=2)
+    if args.profile:
+        summary['profile'] = sim.profiler.summary()
+
+    for key, value in summary.items():
+        if key != 'profile':
+            print("%-20s %s" % (key, round(value, 3) if isinstance(value, float) else value))
+    if args.profile:
+        print(sim.profiler.format_summary())
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
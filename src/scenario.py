@@ -0,0 +1,430 @@
+"""
+Declarative scenario files: the network, signals and demand of a Simulation as JSON or TOML.
+
+    sim = load_scenario_file('examples/test6.json', engine='vectorized')
+    python -m src.runner examples/test6.json --duration 600          # wherever a scenario module is accepted
+    python -m src.scenario export examples.grid grid.json --kwargs '{"cols": 20, "rows": 20}'
+    python -m src.scenario check grid.json
+
+Schema (version 1), every section optional, keys of the sections in any order:
+
+    {"format": "toysim-scenario", "version": 1,
+     "settings": {"dt": 0.0166667, "seed": 1},
+     "segments": [{"id": "0", "type": "line", "points": [[4.5, 118], [4.5, 18]], "lanes": 3},
+                  {"id": "c", "type": "quadratic", "points": [start, control, end], "lanes": 2}],   # or "cubic"
+     "connectors": [{"from": "0", "to": "6", "points": [[4.5, 18], [4.5, -18]],
+                     "connect_info": [[0, 0], [1, 1], [2, 2]], "bezier": false}],
+     "signals": [{"id": "s", "groups": [["0", "2"], ["1", "3"]], "cycle": [[false, true], [true, false]]}],
+     "generators": [{"id": "vg0", "vehicle_rate": 30,
+                     "vehicles": [{"weight": 3, "path": ["0", "6"], "v": 12},
+                                  {"weight": 1, "origin": "0", "destination": "5"}]}]}
+
+Segments may also set speed_limit, lane_width and ban_lane_change_distance; signals and generators take the
+remaining keys as their configuration (TrafficSignal / VehicleGenerator), a vehicle entry as its Vehicle config.
+The connector id is always "<from>_<to>". In TOML the sections are arrays of tables ([[segments]] ...).
+
+Loading runs in three passes. JSON is parsed incrementally, one section element at a time, into compact records
+(the file is never held as a whole, nor as one tree of Python objects); then every reference is checked (segments
+of connectors, signals and paths, connector lane pairs against the lane counts, a connector between every two
+consecutive segments of a path) and all problems are reported together in a ScenarioError; only then the objects
+are built and added in one go.
+"""
+import argparse
+import json
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11, JSON scenarios only
+    tomllib = None
+
+from src.geometry.connectors import Connector
+from src.geometry.cubic_curve import CubicCurve
+from src.geometry.quadratic_curve import QuadraticCurve
+from src.geometry.segment import Segment
+from src.signal.SignalGroup import TrafficSignal
+from src.simulator import Simulation
+from src.vehicle.vehicle_generator import VehicleGenerator
+
+FORMAT = 'toysim-scenario'
+FORMAT_VERSION = 1
+# file extensions of scenario files, see runner.load_scenario
+SCENARIO_FILES = ('.json', '.toml')
+SECTIONS = ('segments', 'connectors', 'signals', 'generators')
+# segment type -> (class, number of points, None for any number >= 2)
+SEGMENT_TYPES = {'line': (Segment, None), 'quadratic': (QuadraticCurve, 3), 'cubic': (CubicCurve, 4)}
+SEGMENT_ATTRIBUTES = ('speed_limit', 'lane_width', 'ban_lane_change_distance')
+# TrafficSignal configuration written by write_scenario
+SIGNAL_ATTRIBUTES = ('cycle', 'slow_distance', 'slow_factor', 'stop_distance', 'slow_speed')
+# keys VehicleGenerator.generate_vehicle writes into the vehicle configs
+GENERATED_KEYS = ('vg_id', 'vg_num', 'id')
+# problems listed in a ScenarioError
+MAX_ERRORS = 20
+
+
+class ScenarioError(ValueError):
+    def __init__(self, path, errors):
+        self.path = path
+        self.errors = errors
+        shown = errors[:MAX_ERRORS]
+        more = ['... and %d more' % (len(errors) - len(shown))] if len(errors) > len(shown) else []
+        super().__init__("%s: %d problem(s)\n  %s" % (path, len(errors), '\n  '.join(shown + more)))
+
+
+class _JsonStream:
+    """
+    Incremental reader of a JSON scenario: the top-level object is walked by hand and every value (every element
+    of a section array) is decoded on its own with json's C decoder, from a buffer of about chunk_size characters
+    """
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.pos > self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        """Next non-whitespace character, '' at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("expected %r at character %d, found %r" % (char, self.pos, found or 'end of file'))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # a number may go on in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """
+        :return: iterator of (key, value) of the top-level object, (section, element) for every element of a
+                 section array
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key in SECTIONS and self.peek() == '[':
+                self.pos += 1
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield key, self.value()
+                        if self.peek() == ']':
+                            self.pos += 1
+                            break
+                        self.expect(',')
+            else:
+                yield key, self.value()
+            if self.peek() == '}':
+                return
+            self.expect(',')
+
+
+def iter_scenario(path):
+    """(key, value) of a scenario file, one (section, element) per section element, see _JsonStream"""
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ValueError("TOML scenarios need Python 3.11 or later (tomllib), use JSON")
+        with open(path, 'rb') as f:
+            document = tomllib.load(f)
+        for key, value in document.items():
+            if key in SECTIONS and isinstance(value, list):
+                for element in value:
+                    yield key, element
+            else:
+                yield key, value
+        return
+    with open(path, encoding='utf-8') as f:
+        yield from _JsonStream(f).items()
+
+
+def _points(value, count):
+    points = tuple((float(x), float(y)) for x, y in value)
+    if len(points) < 2 or count is not None and len(points) != count:
+        raise ValueError("%s points" % len(points))
+    return points
+
+
+class ScenarioDefinition:
+    """Records of a scenario file, shape-checked while reading, see check() for the references"""
+    def __init__(self, path):
+        self.path = path
+        self.settings = {}
+        # id -> (type, points, lanes, attributes)
+        self.segments = {}
+        # id -> (from, to, points, connect_info, bezier)
+        self.connectors = {}
+        # (id, groups, config)
+        self.signals = []
+        # (id, [(weight, vehicle config)], config)
+        self.generators = []
+        self.errors = []
+
+    @classmethod
+    def read(cls, path):
+        definition = cls(path)
+        counts = dict.fromkeys(SECTIONS, 0)
+        try:
+            for key, value in iter_scenario(path):
+                if key in SECTIONS:
+                    where = '%s[%d]' % (key, counts[key])
+                    counts[key] += 1
+                    try:
+                        getattr(definition, '_add_' + key[:-1])(value)
+                    except (KeyError, TypeError, ValueError) as e:
+                        definition.errors.append('%s: %s%s' % (
+                            where, 'missing ' if isinstance(e, KeyError) else '', e))
+                elif key == 'format':
+                    if value != FORMAT:
+                        definition.errors.append('format %r is not %r' % (value, FORMAT))
+                elif key == 'version':
+                    if value != FORMAT_VERSION:
+                        definition.errors.append('unsupported version %r' % value)
+                elif key == 'settings':
+                    definition.settings = dict(value)
+                else:
+                    definition.errors.append('unknown key %r' % key)
+        except ValueError as e:
+            definition.errors.append('not a valid scenario file: %s' % e)
+        return definition
+
+    def _add_segment(self, element):
+        sid = str(element['id'])
+        kind = element.get('type', 'line')
+        if kind not in SEGMENT_TYPES:
+            raise ValueError("unknown type %r" % kind)
+        if sid in self.segments:
+            raise ValueError("duplicate segment %r" % sid)
+        lanes = int(element['lanes'])
+        if lanes < 1:
+            raise ValueError("%d lanes" % lanes)
+        attributes = {name: element[name] for name in SEGMENT_ATTRIBUTES if name in element}
+        self.segments[sid] = (kind, _points(element['points'], SEGMENT_TYPES[kind][1]), lanes, attributes)
+
+    def _add_connector(self, element):
+        from_segment, to_segment = str(element['from']), str(element['to'])
+        cid = from_segment + '_' + to_segment
+        if cid in self.connectors:
+            raise ValueError("duplicate connector %r" % cid)
+        connect_info = [[int(a), int(b)] for a, b in element['connect_info']]
+        if not connect_info:
+            raise ValueError("empty connect_info")
+        bezier = bool(element.get('bezier', False))
+        self.connectors[cid] = (from_segment, to_segment, _points(element['points'], 3 if bezier else None),
+                                connect_info, bezier)
+
+    def _add_signal(self, element):
+        config = {key: value for key, value in element.items() if key not in ('id', 'groups')}
+        if 'cycle' in config:
+            config['cycle'] = [tuple(bool(state) for state in phase) for phase in config['cycle']]
+        groups = [[str(sid) for sid in group] for group in element['groups']]
+        self.signals.append((str(element['id']), groups, config))
+
+    def _add_generator(self, element):
+        vehicles = []
+        for vehicle in element['vehicles']:
+            config = {key: value for key, value in vehicle.items() if key != 'weight'}
+            if 'path' in config:
+                config['path'] = [str(sid) for sid in config['path']]
+            elif 'origin' not in config or 'destination' not in config:
+                raise ValueError("vehicle without path or origin / destination")
+            weight = int(vehicle.get('weight', 1))
+            if weight < 1:
+                raise ValueError("weight %d" % weight)
+            vehicles.append((weight, config))
+        if not vehicles:
+            raise ValueError("no vehicles")
+        config = {key: value for key, value in element.items() if key not in ('id', 'vehicles')}
+        self.generators.append((str(element['id']), vehicles, config))
+
+    def check(self):
+        """
+        Check every reference, raise ScenarioError with all problems found while reading and here
+        """
+        errors = list(self.errors)
+        segments = self.segments
+        for cid, (from_segment, to_segment, _, connect_info, _) in self.connectors.items():
+            for sid in (from_segment, to_segment):
+                if sid not in segments:
+                    errors.append('connector %s: unknown segment %r' % (cid, sid))
+            if from_segment in segments and to_segment in segments:
+                from_lanes, to_lanes = segments[from_segment][2], segments[to_segment][2]
+                for a, b in connect_info:
+                    if not (0 <= a < from_lanes and 0 <= b < to_lanes):
+                        errors.append('connector %s: lane pair [%d, %d] outside %d x %d lanes' % (
+                            cid, a, b, from_lanes, to_lanes))
+        signalled = {}
+        for signal_id, groups, _ in self.signals:
+            for group in groups:
+                for sid in group:
+                    if sid not in segments:
+                        errors.append('signal %s: unknown segment %r' % (signal_id, sid))
+                    elif sid in signalled:
+                        errors.append('signal %s: segment %r already controlled by signal %s' % (
+                            signal_id, sid, signalled[sid]))
+                    else:
+                        signalled[sid] = signal_id
+        for gen_id, vehicles, _ in self.generators:
+            for _, config in vehicles:
+                path = config.get('path')
+                ends = path if path is not None else [config['origin'], config['destination']]
+                unknown = [sid for sid in ends if sid not in segments]
+                if unknown:
+                    errors.append('generator %s: unknown segment(s) %s' % (gen_id, ', '.join(map(repr, unknown))))
+                elif path is not None:
+                    if not path:
+                        errors.append('generator %s: empty path' % gen_id)
+                    for a, b in zip(path[:-1], path[1:]):
+                        if a + '_' + b not in self.connectors:
+                            errors.append('generator %s: no connector from %r to %r' % (gen_id, a, b))
+        if errors:
+            raise ScenarioError(self.path, errors)
+
+    def build(self, engine='object'):
+        """
+        :return: the Simulation of the checked definition
+        """
+        sim = Simulation(engine=engine)
+        if 'dt' in self.settings:
+            sim.dt = float(self.settings['dt'])
+        for sid, (kind, points, lanes, attributes) in self.segments.items():
+            segment = SEGMENT_TYPES[kind][0](sid, points, lanes)
+            for name, value in attributes.items():
+                setattr(segment, name, value)
+            sim.add_segment(segment)
+        for cid, (from_segment, to_segment, points, connect_info, bezier) in self.connectors.items():
+            sim.add_connector(Connector(cid, points, from_segment, to_segment, connect_info,
+                                        generative_bezier_curve=bezier))
+        for signal_id, groups, config in self.signals:
+            sim.add_signal(TrafficSignal(signal_id, [[sim.segments[sid] for sid in group] for group in groups],
+                                         dict(config)))
+        for gen_id, vehicles, config in self.generators:
+            sim.add_vehicle_generator(VehicleGenerator(gen_id, dict(config, vehicles=[
+                (weight, dict(vehicle)) for weight, vehicle in vehicles])))
+        if self.settings.get('seed') is not None:
+            sim.set_seed(self.settings['seed'])
+        return sim
+
+
+def load_scenario_file(path, engine='object'):
+    """
+    Read, check and build a scenario file (.json or .toml)
+    :return: Simulation
+    """
+    definition = ScenarioDefinition.read(path)
+    definition.check()
+    return definition.build(engine)
+
+
+def _elements(sim):
+    for sid, segment in sim.segments.items():
+        kind = 'quadratic' if isinstance(segment, QuadraticCurve) else 'cubic' if isinstance(segment, CubicCurve) \
+            else 'line'
+        element = {'id': sid, 'type': kind, 'points': [[float(x), float(y)] for x, y in segment.points],
+                   'lanes': len(segment.lanes)}
+        yield 'segments', element
+    for connector in sim.connectors.values():
+        points = (connector.start, connector.control, connector.end) if connector.generative_bezier_curve \
+            else connector.points
+        element = {'from': connector.from_segment, 'to': connector.to_segment,
+                   'points': [[float(x), float(y)] for x, y in points],
+                   'connect_info': [[int(a), int(b)] for a, b in connector.connect_info]}
+        if connector.generative_bezier_curve:
+            element['bezier'] = True
+        yield 'connectors', element
+    for signal_id, signal in sim.traffic_signals.items():
+        element = {'id': signal_id, 'groups': [[segment.id for segment in group] for group in signal.segments_group]}
+        element.update({name: getattr(signal, name) for name in SIGNAL_ATTRIBUTES})
+        yield 'signals', element
+    for gen in sim.vehicle_generator:
+        yield 'generators', {
+            'id': gen.vg_id, 'vehicle_rate': gen.vehicle_rate, 'route_weight': gen.route_weight,
+            'vehicles': [dict({key: value for key, value in config.items() if key not in GENERATED_KEYS},
+                              weight=weight) for weight, config in gen.vehicles]}
+
+
+def write_scenario(sim, path, seed=None):
+    """
+    Write the network, signals and generators of sim as a JSON scenario file, one section element per line
+    :param seed: settings.seed of the file, defaults to the seed of sim
+    """
+    settings = {'dt': sim.dt}
+    seed = sim.seed if seed is None else seed
+    if seed is not None:
+        settings['seed'] = seed
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"format": "%s", "version": %d,\n"settings": %s' % (FORMAT, FORMAT_VERSION, json.dumps(settings)))
+        section = None
+        for key, element in _elements(sim):
+            if key != section:
+                f.write('%s,\n"%s": [\n' % (']' if section else '', key))
+                section = key
+            else:
+                f.write(',\n')
+            f.write(json.dumps(element))
+        f.write(']}\n' if section else '}\n')
+
+
+def main(argv=None):
+    from src.runner import load_scenario
+
+    parser = argparse.ArgumentParser(description="Check ToySim scenario files, or export a scenario module")
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('check', help="read and check a scenario file")
+    check.add_argument('path')
+    export = commands.add_parser('export', help="write a scenario (module or file) as a JSON scenario file")
+    export.add_argument('scenario', help="module name (examples.test6), .py, .json or .toml path")
+    export.add_argument('path')
+    export.add_argument('--kwargs', default='{}', help="JSON object of build_simulation arguments")
+    args = parser.parse_args(argv)
+    if args.command == 'check':
+        definition = ScenarioDefinition.read(args.path)
+        try:
+            definition.check()
+        except ScenarioError as e:
+            parser.exit(1, '%s\n' % e)
+        print("%s: %d segments, %d connectors, %d signals, %d generators" % (
+            args.path, len(definition.segments), len(definition.connectors), len(definition.signals),
+            len(definition.generators)))
+        return
+    sim = load_scenario(args.scenario, **json.loads(args.kwargs))
+    write_scenario(sim, args.path)
+    print("%s: %d segments, %d connectors" % (args.path, len(sim.segments), len(sim.connectors)))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,42 +5,71 @@ from src.geometry.quadratic_curve import QuadraticCurve
 from src.geometry.cubic_curve import CubicCurve
 from src.geometry.segment import Segment
 from src.geometry.connectors import Connector
+from src.geometry.spatial_index import SpatialIndex
+from src.topology import Topology
+from src.routing import Router
 from src.vehicle.vehicle import Vehicle
+from src.vehicle.vehicle_arrays import VehicleArrays, LaneTable, QueueTable
+from src.vehicle import mobil
+from src.profiling import StepProfiler
+from src.event_log import EventLog, EventType
+from src.trajectory import TrajectoryRecorder
+from src.detectors import Detectors
+from src.travel_time import TravelTimeStats
+from src import checkpoint
 from src.signal.SignalGroup import TrafficSignal
 import random
 import logging
+import numpy as np
 import colorlog
 from logging.handlers import RotatingFileHandler
 
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-color_formatter = colorlog.ColoredFormatter(
-        '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
-        log_colors={
-            'DEBUG': 'cyan',
-            'INFO': 'green',
-            'WARNING': 'yellow',
-            'ERROR': 'red',
-            'CRITICAL': 'red,bg_white',
-        }
-    )
-# 将颜色输出格式添加到控制台日志处理器
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(color_formatter)
-
-file_handler = RotatingFileHandler('app.log', maxBytes=100 * 1024 * 1024)
-file_handler.setLevel(logging.INFO)
-
-logger = logging.getLogger()
-for handler in logger.handlers:
-    logger.removeHandler(handler)
-    # 将控制台日志处理器添加到logger对象
+def configure_logging(level=logging.INFO, log_file=None):
+    """
+    Colored console logging, plus a rotating file when log_file is given. Called by the entry points
+    (GUI examples, runner); importing the simulator leaves logging alone.
+    """
+    color_formatter = colorlog.ColoredFormatter(
+            '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
+            log_colors={
+                'DEBUG': 'cyan',
+                'INFO': 'green',
+                'WARNING': 'yellow',
+                'ERROR': 'red',
+                'CRITICAL': 'red,bg_white',
+            }
+        )
+    # 将颜色输出格式添加到控制台日志处理器
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(color_formatter)
+
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
     logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    if log_file:
+        file_handler = RotatingFileHandler(log_file, maxBytes=100 * 1024 * 1024)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(file_handler)
+    logger.setLevel(level)
+
+
+ENGINES = ('object', 'vectorized')
 
 
 class Simulation:
-    def __init__(self):
+    def __init__(self, engine='object'):
+        """
+        :param engine: 'object' updates every Vehicle one at a time,
+                       'vectorized' runs IDM and integration as batched NumPy operations (see VehicleArrays); its
+                       per-step overhead pays off from several hundred vehicles, small networks run faster on 'object'
+        """
+        if engine not in ENGINES:
+            raise ValueError("unknown engine %r, expected one of %s" % (engine, ENGINES))
+        self.engine = engine
+        self.vehicle_arrays = VehicleArrays() if engine == 'vectorized' else None
+
         self.segments = {}
         self.connectors = {}
         self.vehicles = {}
@@ -48,39 +77,127 @@ class Simulation:
 
         self.t = 0.0
         self.frame_count = 0
+        # vehicles that reached the end of their path
+        self.exited_vehicles = 0
         self.dt = 1 / 60
         self.traffic_signals = {}
 
+        # StepProfiler, see enable_profiling
+        self.profiler = None
+        # EventLog, or any recorder with the same record method (see replication.KPICollector)
+        self.event_log = None
+        # TrajectoryRecorder, sampled after every step, see enable_trajectory_recorder
+        self.trajectory_recorder = None
+        # Detectors (loop detectors and turning counters), see enable_detectors
+        self.detectors = None
+        # TravelTimeStats, fed on every transfer, see enable_travel_times
+        self.travel_times = None
+
+        # None draws from the global random module, see set_seed
+        self.seed = None
+        self._streams = {}
+        # callable(arrivals) -> arrivals, lets a partitioned run exchange vehicles leaving connectors
+        # (see src/partition.py)
+        self.handover = None
+        # SpatialIndex over segments and connectors, see get_spatial_index
+        self._spatial_index = None
+        # integer-indexed graph, compiled on first use and again after roads were added (see get_topology)
+        self._topology = None
+        # route weight -> Router on the current topology, see get_router
+        self._routers = {}
+        # network-wide lane and connector queue numbering of the vectorized engine, see lane_table / queue_table
+        self._lane_table = None
+        self._queue_table = None
+        # lane numbers whose head reached the end of the lane, set by update_lanes_vectorized
+        self._leaving_lanes = []
+        # queue numbers with a vehicle past the end of its connector, set by update_connectors_vectorized
+        self._leaving_queues = []
+
         # self.lanes = {}
 
+    def set_seed(self, seed):
+        """
+        Give every segment, connector and vehicle generator its own random stream derived from seed. The draws
+        of an entity then only depend on the events at that entity, so a run is reproducible whatever the order
+        in which entities are updated (and whichever process updates them).
+        """
+        self.seed = seed
+        self._streams = {}
+        for gen in self.vehicle_generator:
+            gen.set_rng(self.rng('generator/%s' % gen.vg_id))
+
+    def rng(self, name):
+        """
+        :return: the random stream of an entity, the global random module when no seed is set
+        """
+        if self.seed is None:
+            return random
+        stream = self._streams.get(name)
+        if stream is None:
+            stream = self._streams[name] = random.Random('%s/%s' % (self.seed, name))
+        return stream
+
     def add_signal(self, signal):
         self.traffic_signals[signal.signal_id] = signal
 
     def add_vehicle(self, veh):
         self.vehicles[veh.id] = veh
+        veh.route, veh.route_connectors = self.get_topology().route(veh.path)
         if len(veh.path) > 0:
             # 从lanes列表中随机选取一个对象
-            obj_lane = random.choice(self.segments[veh.path[0]].lanes)
-            if not obj_lane.vehicles:
-                # 如果车道上的车辆列表为空，则直接添加车辆
-                obj_lane.add_vehicle(veh)
-                veh.at_lane = obj_lane.lane_index
-                # log the add veh time and veh id
-                logging.info("T: %s, ADD VEH: %s, AT LANE: %s, POS: %s" % (self.t, veh.id, obj_lane.lane_id, veh.x))
-            elif obj_lane.vehicles[-1].x > veh.s0:
+            obj_lane = self.rng('segment/' + veh.path[0]).choice(self.segments[veh.path[0]].lanes)
+            # 如果车道上的车辆列表为空，则直接添加车辆
+            if not obj_lane.vehicles or obj_lane.vehicles[-1].x > veh.s0:
+                if self.vehicle_arrays is not None:
+                    self.vehicle_arrays.register(veh)
                 obj_lane.add_vehicle(veh)
                 veh.at_lane = obj_lane.lane_index
-                # log the add veh time and veh id
-                logging.info("T: %s, ADD VEH: %s, AT LANE: %s, POS: %s" % (self.t, veh.id, obj_lane.lane_id, veh.x))
+                veh.trip_start = veh.entered_t = self.t
+                if self.event_log is not None:
+                    self.event_log.record(self.t, EventType.VEHICLE_ENTERED, veh.id, None, obj_lane.lane_id, veh.x)
 
     def add_segment(self, seg):
         self.segments.update({seg.id: seg})
+        self._topology = None
 
     def add_connector(self, connector: Connector):
         self.connectors.update({connector.id: connector})
+        self._topology = None
+
+    def get_topology(self):
+        """
+        :return: Topology, the integer-indexed graph of the segments and connectors
+        """
+        if self._topology is None:
+            self._topology = Topology(self.segments, self.connectors)
+        return self._topology
+
+    def get_router(self, weight='length'):
+        """
+        :param weight: 'length' or 'free_flow', see Router
+        :return: Router with cached shortest paths, rebuilt when the topology changed
+        """
+        topology = self.get_topology()
+        router = self._routers.get(weight)
+        if router is None or router.topology is not topology:
+            router = self._routers[weight] = Router(topology, weight)
+        return router
+
+    def get_spatial_index(self):
+        """
+        :return: SpatialIndex over the segments and connectors (picking, nearest road, viewport queries), rebuilt
+                 when segments or connectors were added since the last call
+        """
+        objects = len(self.segments) + len(self.connectors)
+        if self._spatial_index is None or len(self._spatial_index.objects) != objects:
+            self._spatial_index = SpatialIndex(list(self.segments.values()) + list(self.connectors.values()))
+        return self._spatial_index
 
     def add_vehicle_generator(self, gen):
+        gen.resolve_paths(self)
         self.vehicle_generator.append(gen)
+        if self.seed is not None:
+            gen.set_rng(self.rng('generator/%s' % gen.vg_id))
 
     def create_vehicle(self, **kwargs):
         veh = Vehicle(kwargs)
@@ -109,15 +226,26 @@ class Simulation:
         gen = VehicleGenerator(kwargs)
         self.add_vehicle_generator(gen)
 
-    def run(self, steps, delay: int):
+    def run(self, steps, real_time_factor=None):
         """
         Run the simulation for a given number of steps
         :param steps:
-        :param delay: ms
+        :param real_time_factor: None runs unthrottled, otherwise simulated seconds per wall-clock second
+                                 (1 = real time, 10 = ten times faster than real time)
         :return:
         """
+        if not real_time_factor:
+            for _ in range(steps):
+                self.update_with_lane()
+            return
+
+        wall_start = time.perf_counter()
+        sim_start = self.t
         for _ in range(steps):
-            self.update_with_lane(delay)
+            self.update_with_lane()
+            ahead = (self.t - sim_start) / real_time_factor - (time.perf_counter() - wall_start)
+            if ahead > 0:
+                time.sleep(ahead)
 
     # update_without_lane未加入换道逻辑，已弃用
     def update_without_lane(self):
@@ -181,39 +309,221 @@ class Simulation:
         self.t += self.dt
         self.frame_count += 1
 
-    def update_with_lane(self, delay: int):
+    def update_with_lane(self, *args):
+        # *args swallows the (sender, app_data, user_data) of the GUI Step button callback
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin()
+
         # Update vehicles
+        if self.engine == 'vectorized':
+            updated, lc_evaluations = self.update_lanes_vectorized()
+        else:
+            updated, lc_evaluations = self.update_lanes()
+        if self.detectors is not None:
+            self.detectors.update(self.t + self.dt, self.dt)
+        if profiler is not None:
+            profiler.lap()
+
+        # Check segment for out of bounds vehicle, perform segment->connector transfer
+        transfers = self.transfer_segments_to_connectors()
+        if profiler is not None:
+            profiler.lap()
+
+        if self.engine == 'vectorized':
+            updated += self.update_connectors_vectorized()
+        else:
+            updated += self.update_connectors()
+        if profiler is not None:
+            profiler.lap()
+        # Check connectors for out of bounds vehicle, perform connector->segment transfer
+        transfers += self.transfer_connectors_to_segments()
+        if profiler is not None:
+            profiler.lap()
+
+        # Update traffic lights
+        for signal_id, signal in self.traffic_signals.items():
+            signal.update(self)
+        if profiler is not None:
+            profiler.lap()
+            generated = sum(gen.veh_cnt for gen in self.vehicle_generator)
+
+        # Update vehicle generators
+        for gen in self.vehicle_generator:
+            gen.update(self)
+
+        if profiler is not None:
+            profiler.lap()
+            profiler.end(updated, lc_evaluations, transfers,
+                         sum(gen.veh_cnt for gen in self.vehicle_generator) - generated)
+
+        # Increment time
+        self.t += self.dt
+        self.frame_count += 1
+
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.sample(self)
+
+    def enable_profiling(self, window=600):
+        """
+        Time every phase of update_with_lane and count the work done, over a rolling window of steps
+        :return: the StepProfiler, also reachable as self.profiler
+        """
+        self.profiler = StepProfiler(window)
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def enable_event_log(self, path, **kwargs):
+        """
+        Record vehicle entries, lane changes, transfers and exits to a binary file, see EventLog
+        :param kwargs: passed to EventLog
+        :return: the EventLog, also reachable as self.event_log
+        """
+        self.disable_event_log()
+        self.event_log = EventLog(path, **kwargs)
+        return self.event_log
+
+    def disable_event_log(self):
+        """Stop recording and write the remaining events"""
+        if self.event_log is not None:
+            self.event_log.close()
+            self.event_log = None
+
+    def enable_trajectory_recorder(self, path, interval=1.0, **kwargs):
+        """
+        Record the position, speed and acceleration of every vehicle every interval simulated seconds, see
+        TrajectoryRecorder
+        :param path: directory of the recording
+        :param kwargs: passed to TrajectoryRecorder
+        :return: the TrajectoryRecorder, also reachable as self.trajectory_recorder
+        """
+        self.disable_trajectory_recorder()
+        self.trajectory_recorder = TrajectoryRecorder(path, interval, **kwargs)
+        return self.trajectory_recorder
+
+    def disable_trajectory_recorder(self):
+        """Stop recording and write the remaining samples"""
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
+            self.trajectory_recorder = None
+
+    def enable_detectors(self, interval=60.0, path=None):
+        """
+        Aggregate loop detectors and turning counters every interval simulated seconds, see Detectors
+        :param path: CSV file the aggregates are streamed to, None to keep them in memory only
+        :return: the Detectors to place the detectors with, also reachable as self.detectors
+        """
+        self.disable_detectors()
+        self.detectors = Detectors(self, interval, path)
+        return self.detectors
+
+    def disable_detectors(self):
+        """Emit the last, partial interval and close the file"""
+        if self.detectors is not None:
+            self.detectors.close()
+            self.detectors = None
+
+    def enable_travel_times(self, quantiles=(0.5, 0.9, 0.95), start=None):
+        """
+        Travel time and delay statistics per segment, connector movement and route, see TravelTimeStats
+        :param start: simulation time from which traversals are counted, defaults to now
+        :return: the TravelTimeStats, also reachable as self.travel_times
+        """
+        self.travel_times = TravelTimeStats(self, quantiles, self.t if start is None else start)
+        return self.travel_times
+
+    def disable_travel_times(self):
+        self.travel_times = None
+
+    def checkpoint(self, path=None):
+        """
+        Dynamic state of the simulation (vehicles, queues, signals, generators, random streams), see src.checkpoint
+        :param path: file the checkpoint is also written to
+        :return: the checkpoint as bytes
+        """
+        data = checkpoint.checkpoint(self)
+        if path is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return data
+
+    def restore(self, data):
+        """
+        Return to the state of a checkpoint of this simulation or of one built from the same scenario
+        :param data: bytes of checkpoint(), or the path of a checkpoint file
+        """
+        checkpoint.restore(self, data)
+
+    def fork(self, fn, branches, processes=None):
+        """
+        Run fn(simulation, branch) for every branch in a worker process starting from the current state, see
+        src.checkpoint.fork
+        :return: results of fn in branch order
+        """
+        return checkpoint.fork(self, fn, branches, processes)
+
+    @staticmethod
+    def apply_signal(segment, head_veh: Vehicle):
+        """
+        Change the stop / slow flags of the head vehicle of a lane according to the signal of its segment
+        """
+        if segment.traffic_signal_state:
+            # If TRUE: traffic signal is green or doesn't exist, Then let vehicles pass
+            head_veh.unstop()
+            head_veh.unslow()
+        else:
+            # If traffic signal is red
+            if head_veh.x >= segment.length - segment.traffic_signal.slow_distance:
+                # Slow vehicles in slowing zone
+                if not head_veh.slowing_down:
+                    head_veh.slow(segment.traffic_signal.slow_speed)
+                # print("slowing down: %s  %.2f" % (head_veh.id, head_veh.x), head_veh.slowing_down)
+            if segment.length - segment.traffic_signal.stop_distance <= \
+                    head_veh.x <= segment.length - segment.traffic_signal.stop_distance / 2:
+                if not head_veh.stopped:
+                    head_veh.stop()
+
+    @staticmethod
+    def adjacent_lanes(segment, lane_index):
+        """
+        :return: [self_lane, left_lane, right_lane], missing neighbours are None
+        """
+        return [
+            segment.lanes[lane_index],
+            segment.lanes[lane_index - 1] if lane_index > 0 else None,
+            segment.lanes[lane_index + 1] if lane_index + 1 < len(segment.lanes) else None
+        ]
+
+    def record_lane_change(self, segment, from_lane, veh):
+        to_lane = next(lane for lane in segment.lanes if veh in lane.vehicles)
+        self.event_log.record(self.t, EventType.LANE_CHANGE, veh.id, from_lane.lane_id, to_lane.lane_id, veh.x)
+
+    def update_lanes(self):
+        """
+        :return: number of vehicles updated, number of lane change evaluations
+        """
+        updated = 0
+        lc_evaluations = 0
+        events = self.event_log
         for segment in self.segments.values():
             for lane_index, lane in enumerate(segment.lanes):
-                adjacent_lanes = [
-                    lane,
-                    segment.lanes[lane_index - 1] if lane_index > 0 else None,
-                    segment.lanes[lane_index + 1] if lane_index + 1 < len(segment.lanes) else None
-                ]
+                adjacent_lanes = self.adjacent_lanes(segment, lane_index)
 
                 # update vehicles on each lane
                 if len(lane.vehicles) != 0:
                     head_veh: Vehicle = lane.vehicles[0]
                     # segment.update()
-                    if segment.traffic_signal_state:
-                        # If TRUE: traffic signal is green or doesn't exist, Then let vehicles pass
-                        head_veh.unstop()
-                        head_veh.unslow()
-                    else:
-                        # If traffic signal is red
-                        if head_veh.x >= segment.length - segment.traffic_signal.slow_distance:
-                            # Slow vehicles in slowing zone
-                            if not head_veh.slowing_down:
-                                head_veh.slow(segment.traffic_signal.slow_speed)
-                            # print("slowing down: %s  %.2f" % (head_veh.id, head_veh.x), head_veh.slowing_down)
-                        if segment.length - segment.traffic_signal.stop_distance <= \
-                                head_veh.x <= segment.length - segment.traffic_signal.stop_distance / 2:
-                            if not head_veh.stopped:
-                                head_veh.stop()
+                    self.apply_signal(segment, head_veh)
                     # 注意：slow() 和 stop() 用于改变车辆的状态标记，IDM函数会根据状态标记记性对应的加速度计算
                     head_veh.present_a = head_veh.IDM(None, self.dt)  # 计算假使保持在当前车道上的加速度
+                    updated += 1
                     if not head_veh.x > segment.length - segment.ban_lane_change_distance:
+                        lc_evaluations += 1
                         head_veh.a = head_veh.evaluate_and_perform_lane_change(adjacent_lanes)
+                        if events is not None and head_veh not in lane.vehicles:
+                            self.record_lane_change(segment, lane, head_veh)
                         head_veh.update_position_and_velocity()
                     else:
                         head_veh.a = head_veh.present_a
@@ -223,64 +533,180 @@ class Simulation:
                 if len(lane.vehicles) > 1:
                     for veh in lane.vehicles[1:]:
                         veh.present_a = veh.IDM(veh.lead, self.dt)
+                        updated += 1
                         if not veh.x > segment.length - segment.ban_lane_change_distance:
+                            lc_evaluations += 1
                             veh.a = veh.evaluate_and_perform_lane_change(adjacent_lanes)
+                            if events is not None and veh not in lane.vehicles:
+                                self.record_lane_change(segment, lane, veh)
                             veh.update_position_and_velocity()
                         else:
                             veh.a = veh.present_a
                             veh.update_position_and_velocity()
+        return updated, lc_evaluations
 
-            # Check segment for out of bounds vehicle, perform segment->connector transfer
-            for lane in segment.lanes:
-                # If seg has no vehicles, continue
-                if len(lane.vehicles) == 0:
-                    continue
-                # If not
-                vehicle = lane.vehicles[0]
-                # If first vehicle is out of road bounds
-                if vehicle.x >= lane.lane_length:
-                    print('sim_time:', self.t, vehicle.id, vehicle.x, vehicle.at_lane)
-                    # If vehicle has a next road
-                    if vehicle.current_road_index + 1 < len(vehicle.path):
-                        # Update current road to next road
-                        # vehicle.current_road_index += 1
-                        # Add it to the next road
-                        # next_road_id = vehicle.path[vehicle.current_road_index]
-                        next_connector_index = vehicle.path[vehicle.current_road_index] + "_" + \
-                                               vehicle.path[vehicle.current_road_index + 1]
-                        next_connector: Connector = self.connectors[next_connector_index]
-                        if next_connector.is_available:
-                            from_lane = next_connector.get_closest_lane(vehicle.at_lane)
-                            to_lane_candidates = next_connector.connections[from_lane]
-                            # 选取连接器链接的下游路段lane
-                            vehicle.to_lane = random.choice(list(to_lane_candidates.keys()))
-                            # obj_connect = to_lane_candidates[vehicle.to_lane]
-                            vehicle.x = 0
-                            lane.remove_vehicle(vehicle)
-                            next_connector.add_vehicle(vehicle, from_lane, vehicle.to_lane)
-                            # 更新vehicle在连接器上的相对位置，便于绘制
-                            vehicle.at_lane = int(from_lane) - next_connector.innermost_connection_id
-                            print('sim_time:', self.t, 'reset x', vehicle.id, vehicle.x, vehicle.at_lane)
-
-
-                        # self.segments[next_road_id].lanes[vehicle.at_lane].add_vehicle(vehicle)
-                        # remove it from its road
-                        # lane.vehicles.remove(vehicle)
-                        # lane.remove_vehicle(vehicle)
-                        # Reset vehicle properties
-                        # vehicle.x = 0
-                    else:
-                        # lane.vehicles.remove(vehicle)
-                        vehicle.x = 0
-                        lane.remove_vehicle(vehicle)
+    def lane_table(self):
+        """
+        Lanes numbered over the whole network for the vectorized engine, lanes of a segment numbered consecutively
+        :return: LaneTable
+        """
+        table = self._lane_table
+        if table is None or table.segments is not self.segments or table.key != self._lane_table_key():
+            table = self._lane_table = LaneTable(self.segments, self._lane_table_key())
+        return table
 
+    def _lane_table_key(self):
+        return len(self.segments), len(self.traffic_signals)
+
+    def queue_table(self):
+        """
+        Connector queues numbered over the whole network for the vectorized engine
+        :return: QueueTable
+        """
+        table = self._queue_table
+        if table is None or table.connectors is not self.connectors or table.key != len(self.connectors):
+            table = self._queue_table = QueueTable(self.connectors, len(self.connectors))
+        return table
 
+    def update_lanes_vectorized(self):
+        """
+        Same as update_lanes, but as array operations over every lane at once: lane changes of all lanes are
+        decided by the batched MOBIL kernel on the start-of-step state and applied first, then IDM and
+        integration run on the resulting lanes. Python only runs per lane (lane heads) and per lane change.
+        """
+        table = self.lane_table()
+        lanes = table.lanes
+        arrays = self.vehicle_arrays
+        occupied = []
+        heads = []
+        for number, chain in enumerate(table.chains()):
+            head_veh = chain.head
+            if head_veh is not None:
+                occupied.append(number)
+                heads.append(head_veh.slot)
+        if not heads:
+            self._leaving_lanes = []
+            return 0, 0
+
+        occupied = np.array(occupied)
+        arrays.apply_signals(np.array(heads), table.green()[occupied], table.slow_from[occupied],
+                             table.slow_speed[occupied], table.stop_from[occupied], table.stop_to[occupied])
+        batch = arrays.batch(heads)
+        lane_group = np.full(len(lanes), -1)
+        lane_group[occupied] = np.arange(len(occupied))
+        group_lane = occupied[batch.group]
+        left = table.left[group_lane]
+        right = table.right[group_lane]
+
+        # vehicles in the ban zone and vehicles holding the lane change lock never change lane
+        slots = batch.slots
+        candidates = (arrays.x[slots] <= table.ban_x[group_lane]) & (arrays.t[slots] >= arrays.lc_unlock_t[slots]) \
+            & ((left >= 0) | (right >= 0))
+        present_a = arrays.idm(slots)
+        egos, targets = mobil.lane_changes(arrays, batch, present_a, candidates, left, right, lane_group)
+
+        levels = batch.levels
+        if len(egos):
+            for i, target in zip(egos.tolist(), targets.tolist()):
+                veh = arrays.vehicles[slots[i]]
+                target_lane = lanes[target][2]
+                target_lead, _ = veh.search_adjacent_lane(target_lane)
+                segment, _, present_lane = lanes[group_lane[i]]
+                veh.implement_lane_change(present_lane, target_lane, target_lead)
+                if self.event_log is not None:
+                    self.record_lane_change(segment, present_lane, veh)
+            chains = table.chains()
+            occupied = np.array([number for number, chain in enumerate(chains) if chain])
+            levels = arrays.walk([chains[number].head.slot for number in occupied.tolist()])
+
+        updated = arrays.step(levels, self.dt)
+        # lanes whose head reached the end, the only ones transfer_segments_to_connectors has to look at
+        heads, _ = levels[0]
+        self._leaving_lanes = occupied[arrays.x[heads] >= table.lane_length[occupied]].tolist()
+        return updated, int(candidates.sum())
+
+    def transfer_segments_to_connectors(self):
+        """
+        :return: number of vehicles that left their segment
+        """
+        transfers = 0
+        events = self.event_log
+        detectors = self.detectors
+        travel_times = self.travel_times
+        topology = self.get_topology()
+        lanes = self.lane_table().lanes
+        if self.vehicle_arrays is not None:
+            lanes = [lanes[number] for number in self._leaving_lanes]
+            self._leaving_lanes = []
+        for segment, _, lane in lanes:
+            vehicle = lane.vehicles.head
+            # If seg has no vehicles, continue
+            if vehicle is None:
+                continue
+            # If first vehicle is out of road bounds
+            if vehicle.x >= lane.lane_length:
+                # If vehicle has a next road
+                if vehicle.current_road_index + 1 < len(vehicle.route):
+                    # Update current road to next road
+                    # vehicle.current_road_index += 1
+                    c = vehicle.route_connectors[vehicle.current_road_index]
+                    if c < 0:
+                        raise KeyError("no connector from %s to %s" % (
+                            vehicle.path[vehicle.current_road_index], vehicle.path[vehicle.current_road_index + 1]))
+                    next_connector: Connector = topology.connectors[c]
+                    if next_connector.is_available:
+                        entry_lane = topology.entry_lane[c]
+                        from_lane = entry_lane[min(vehicle.at_lane, len(entry_lane) - 1)]
+                        # 选取连接器链接的下游路段lane
+                        vehicle.to_lane = self.rng(topology.connector_stream[c]).choice(
+                            topology.exit_lanes[c][from_lane])
+                        if events is not None:
+                            events.record(self.t, EventType.SEGMENT_TO_CONNECTOR, vehicle.id, lane.lane_id,
+                                          next_connector.id, vehicle.x)
+                        if travel_times is not None:
+                            travel_times.left_segment(segment, vehicle, self.t)
+                        vehicle.entered_t = self.t
+                        vehicle.x = 0
+                        lane.remove_vehicle(vehicle)
+                        next_connector.add_vehicle(vehicle, from_lane, vehicle.to_lane)
+                        if detectors is not None:
+                            detectors.entered_connector(next_connector, from_lane, vehicle.to_lane, vehicle)
+                        transfers += 1
+                        # 更新vehicle在连接器上的相对位置，便于绘制
+                        vehicle.at_lane = int(from_lane) - next_connector.innermost_connection_id
+
+                    # self.segments[next_road_id].lanes[vehicle.at_lane].add_vehicle(vehicle)
+                    # remove it from its road
+                    # lane.vehicles.remove(vehicle)
+                    # lane.remove_vehicle(vehicle)
+                    # Reset vehicle properties
+                    # vehicle.x = 0
+                else:
+                    # lane.vehicles.remove(vehicle)
+                    if events is not None:
+                        events.record(self.t, EventType.VEHICLE_EXITED, vehicle.id, lane.lane_id, None, vehicle.x)
+                    if travel_times is not None:
+                        travel_times.left_segment(segment, vehicle, self.t)
+                        travel_times.trip_done(vehicle, self.t)
+                    vehicle.x = 0
+                    lane.remove_vehicle(vehicle)
+                    self.exited_vehicles += 1
+                    transfers += 1
+                    if self.vehicle_arrays is not None:
+                        self.vehicle_arrays.release(vehicle)
+        return transfers
+
+    def update_connectors(self):
+        """
+        :return: number of vehicles updated
+        """
+        updated = 0
         for connector in self.connectors.values():
             for from_lane, to_lane_dic in connector.connections.items():
                 for to_lane, d_que in to_lane_dic.items():
                     if len(d_que) == 0:
                         continue
-                    # Check connectors for out of bounds vehicle, perform connector->segment transfer
+                    updated += len(d_que)
                     head_veh = d_que[0]
                     head_veh.a = head_veh.IDM(None, self.dt)
                     head_veh.update_position_and_velocity()
@@ -292,29 +718,61 @@ class Simulation:
                                 continue
                             veh.a = veh.IDM(veh.lead, self.dt)
                             veh.update_position_and_velocity()
-
-
-                    # if head_veh.x > connector.length:
-                    #     head_veh.x = 0
-                    #     connector.remove_vehicle(head_veh, from_lane, to_lane)
-                    #     self.segments[connector.to_segment].lanes[int(to_lane)].add_vehicle(head_veh)
-                    #     head_veh.current_road_index += 1
-                    for veh in list(d_que):
-                        if veh.x > connector.length:
-                            veh.x = 0
-                            connector.remove_vehicle(veh, from_lane, to_lane)
-                            self.segments[connector.to_segment].lanes[int(to_lane)].add_vehicle(veh)
-                            veh.current_road_index += 1
-
-        # Update traffic lights
-        for signal_id, signal in self.traffic_signals.items():
-            signal.update(self)
-
-        # Update vehicle generators
-        for gen in self.vehicle_generator:
-            gen.update(self)
-
-        # Increment time
-        self.t += self.dt
-        self.frame_count += 1
-        # time.sleep(delay/100)
+        return updated
+
+    def update_connectors_vectorized(self):
+        table = self.queue_table()
+        occupied = []
+        heads = []
+        for number, (_, _, _, d_que) in enumerate(table.queues):
+            if d_que:
+                occupied.append(number)
+                heads.append(d_que[0].slot)
+        arrays = self.vehicle_arrays
+        levels = arrays.walk(heads)
+        updated = arrays.step(levels, self.dt)
+        # queues with a vehicle past the end, the only ones transfer_connectors_to_segments has to look at
+        if levels:
+            slots = np.concatenate([slots for slots, _ in levels])
+            queue = np.array(occupied)[np.concatenate([group for _, group in levels])]
+            self._leaving_queues = np.unique(queue[arrays.x[slots] > table.lengths[queue]]).tolist()
+        return updated
+
+    def transfer_connectors_to_segments(self):
+        """
+        :return: number of vehicles that entered a segment
+        """
+        # (vehicle, connector id, segment id, lane index), in connector order
+        arrivals = []
+        travel_times = self.travel_times
+        queues = self.queue_table().queues
+        if self.vehicle_arrays is not None:
+            queues = [queues[number] for number in self._leaving_queues]
+            self._leaving_queues = []
+        for connector, from_lane, to_lane, d_que in queues:
+            # if head_veh.x > connector.length:
+            #     head_veh.x = 0
+            #     connector.remove_vehicle(head_veh, from_lane, to_lane)
+            #     self.segments[connector.to_segment].lanes[int(to_lane)].add_vehicle(head_veh)
+            #     head_veh.current_road_index += 1
+            for veh in list(d_que):
+                if veh.x > connector.length:
+                    connector.remove_vehicle(veh, from_lane, to_lane)
+                    if travel_times is not None:
+                        travel_times.left_connector(connector, from_lane, to_lane, veh, self.t)
+                    veh.current_road_index += 1
+                    arrivals.append((veh, connector.id, connector.to_segment, int(to_lane)))
+
+        if self.handover is not None:
+            arrivals = self.handover(arrivals)
+        for veh, connector_id, segment_id, lane_index in arrivals:
+            lane = self.segments[segment_id].lanes[lane_index]
+            if self.event_log is not None:
+                self.event_log.record(self.t, EventType.CONNECTOR_TO_SEGMENT, veh.id, connector_id, lane.lane_id, veh.x)
+            if self.vehicle_arrays is not None and veh.slot is None:
+                # handed over by another partition
+                self.vehicle_arrays.register(veh)
+            veh.x = 0
+            veh.entered_t = self.t
+            lane.add_vehicle(veh)
+        return len(arrivals)
@@ -0,0 +1,234 @@
+"""
+Immutable state snapshots of a Simulation, and a worker thread that steps the simulation and publishes them.
+
+    worker = SimulationThread(sim, real_time_factor=1, budget=0.010)
+    worker.start()
+    worker.set_running(True)
+    ...
+    previous, latest = worker.buffer.pair           # from any thread, e.g. once per rendered frame
+    xy, heading = latest.interpolate(previous, worker.buffer.alpha())
+    ...
+    worker.close()
+
+A snapshot holds what a viewer needs (vehicle positions, headings, lanes and status, signal states) as read-only
+arrays built in the worker thread, so the reader never touches the live simulation and neither side waits for the
+other: the simulation runs at its own pace (worker.pacing) and publishes once per publish_interval, the GUI renders
+the latest snapshot at its frame rate, optionally interpolated from the previous one.
+"""
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from src.pacing import PacingController
+
+# Snapshot.status
+MOVING, SLOWING, STOPPED = 0, 1, 2
+
+
+class Snapshot:
+    def __init__(self, simulation, previous=None):
+        """
+        :param simulation: read in the calling thread, which must be the one stepping it
+        :param previous: snapshot published before this one, to match the vehicles for interpolate()
+        """
+        self.t = simulation.t
+        self.frame_count = simulation.frame_count
+        self.published = time.perf_counter()
+        # vehicles are grouped by road, those of road r are rows[r] = (start, stop)
+        self.rows = {}
+        ids, lane_ids, lane_index, x, xy, heading, length, v, a, status = [], [], [], [], [], [], [], [], [], []
+        placed_roads = []
+        for segment in simulation.segments.values():
+            placed = [(lane, vehicle) for lane in segment.lanes for vehicle in lane.vehicles]
+            if placed:
+                placed_roads.append((segment, placed, [lane.lane_index for lane, _ in placed]))
+        for connector in simulation.connectors.values():
+            if connector.vehicles:
+                placed_roads.append((connector, [(None, vehicle) for vehicle in connector.vehicles],
+                                     [vehicle.at_lane for vehicle in connector.vehicles]))
+        for road, placed, lanes in placed_roads:
+            road_x = [vehicle.x for _, vehicle in placed]
+            positions, headings = road.positions(road_x, road.lane_offsets(lanes))
+            self.rows[road] = (len(ids), len(ids) + len(placed))
+            for lane, vehicle in placed:
+                ids.append(vehicle.id)
+                lane_ids.append(None if lane is None else lane.lane_id)
+                length.append(vehicle.length)
+                v.append(vehicle.v)
+                a.append(vehicle.a)
+                status.append(STOPPED if vehicle.stopped else SLOWING if vehicle.slowing_down else MOVING)
+            lane_index.extend(lanes)
+            x.extend(road_x)
+            xy.append(positions)
+            heading.append(headings)
+
+        self.ids = tuple(ids)
+        # lane id of the vehicles on a segment, None on a connector
+        self.lane_ids = tuple(lane_ids)
+        # lane index on the segment, lane (connection key) on the connector
+        self.lane = self._frozen(lane_index, dtype=int)
+        self.x = self._frozen(x)
+        self.xy = self._frozen(np.concatenate(xy) if xy else np.zeros((0, 2)))
+        self.heading = self._frozen(np.concatenate(heading) if heading else np.zeros(0))
+        self.length = self._frozen(length)
+        self.v = self._frozen(v)
+        self.a = self._frozen(a)
+        self.status = self._frozen(status, dtype=np.int8)
+        # segment id -> traffic signal state, for the signalised segments
+        self.signals = {sid: segment.traffic_signal_state for sid, segment in simulation.segments.items()
+                        if segment.has_traffic_signal}
+
+        # row of every vehicle in the previous snapshot, -1 for the vehicles that entered since
+        self.previous_rows = None
+        if previous is not None:
+            index = {vid: i for i, vid in enumerate(previous.ids)}
+            self.previous_rows = self._frozen([index.get(vid, -1) for vid in self.ids], dtype=int)
+            self.previous_published = previous.published
+
+    @staticmethod
+    def _frozen(values, dtype=float):
+        array = np.asarray(values, dtype=dtype)
+        array.flags.writeable = False
+        return array
+
+    def interpolate(self, previous, alpha):
+        """
+        Vehicle positions and headings between previous (alpha 0) and this snapshot (alpha 1)
+        :param previous: the snapshot this one was built from, anything else returns the positions of this one
+        :return: (xy (n, 2), heading (n,))
+        """
+        if previous is None or self.previous_rows is None or self.previous_published != previous.published \
+                or alpha >= 1:
+            return self.xy, self.heading
+        known = self.previous_rows >= 0
+        rows = self.previous_rows[known]
+        xy = self.xy.copy()
+        heading = self.heading.copy()
+        xy[known] = previous.xy[rows] + alpha * (self.xy[known] - previous.xy[rows])
+        turn = (self.heading[known] - previous.heading[rows] + np.pi) % (2 * np.pi) - np.pi
+        heading[known] = previous.heading[rows] + alpha * turn
+        return xy, heading
+
+
+class SnapshotBuffer:
+    """
+    Double buffer of snapshots. The writer replaces the (previous, latest) pair in one assignment, which is atomic,
+    so readers always get a consistent pair without locking.
+    """
+    def __init__(self):
+        self.pair = (None, None)
+
+    @property
+    def latest(self):
+        return self.pair[1]
+
+    def publish(self, snapshot):
+        self.pair = (self.pair[1], snapshot)
+
+    def alpha(self, now=None):
+        """
+        Interpolation factor for rendering one publish interval behind the latest snapshot: 0 when it was just
+        published (previous is shown), 1 once the interval between the last two snapshots has elapsed again
+        """
+        previous, latest = self.pair
+        if previous is None or latest is None:
+            return 1.0
+        interval = latest.published - previous.published
+        if interval <= 0:
+            return 1.0
+        now = time.perf_counter() if now is None else now
+        return min(max((now - latest.published) / interval, 0.0), 1.0)
+
+
+class SimulationThread(threading.Thread):
+    def __init__(self, simulation, real_time_factor=1.0, budget=None, publish_interval=1 / 60):
+        """
+        :param real_time_factor: simulated seconds per wall-clock second while running, None for as fast as the
+                                 budget allows (see PacingController)
+        :param budget: wall-clock seconds of stepping per publish interval, None for unlimited
+        :param publish_interval: wall-clock seconds between two snapshots while running
+        """
+        super().__init__(name='simulation', daemon=True)
+        self.simulation = simulation
+        self.pacing = PacingController(simulation.dt, real_time_factor, budget)
+        self.publish_interval = publish_interval
+        self.buffer = SnapshotBuffer()
+        self.running = False
+        # exception that stopped the simulation, if any
+        self.error = None
+        self._commands = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._closing = False
+
+    def set_running(self, running):
+        self.running = running
+        self._wake.set()
+
+    def submit(self, fn, *args):
+        """Call fn(*args) in the simulation thread between two steps, e.g. to change the scenario while running"""
+        self._commands.put((fn, args))
+        self._wake.set()
+
+    def step(self, steps=1):
+        self.submit(self.simulation.run, steps)
+
+    def close(self, timeout=None):
+        self._closing = True
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def publish(self):
+        self.buffer.publish(Snapshot(self.simulation, self.buffer.latest))
+
+    def run(self):
+        self.publish()
+        # start of the current frame, one frame steps the simulation and publishes a snapshot
+        frame_start = None
+        while not self._closing:
+            self._wake.clear()
+            changed = self._run_commands()
+            if not self.running:
+                frame_start = None
+                if changed:
+                    self.publish()
+                self._wake.wait()
+                continue
+
+            now = time.perf_counter()
+            if frame_start is None:
+                self.pacing.reset()
+            interval = self.publish_interval if frame_start is None else now - frame_start
+            frame_start = now
+            steps = self.pacing.steps(interval)
+            try:
+                self.simulation.run(steps)
+            except Exception as e:
+                self._fail(e)
+            self.pacing.record(steps, time.perf_counter() - now, interval)
+            if steps or changed:
+                self.publish()
+            # until the next frame, commands wake the thread up earlier
+            self._wake.wait(max(frame_start + self.publish_interval - time.perf_counter(), 0))
+
+    def _run_commands(self):
+        """Run the submitted functions, return whether there were any"""
+        changed = False
+        while True:
+            try:
+                fn, args = self._commands.get_nowait()
+            except queue.Empty:
+                return changed
+            changed = True
+            try:
+                fn(*args)
+            except Exception as e:
+                self._fail(e)
+
+    def _fail(self, error):
+        logging.exception("simulation stopped at t=%.2f: %s", self.simulation.t, error)
+        self.error = error
+        self.running = False
@@ -0,0 +1,76 @@
+"""
+Integer-indexed network graph compiled from the segments and connectors of a Simulation.
+
+    topology = sim.get_topology()
+    s = topology.segment_index['3']
+    topology.out_connectors[topology.out_start[s]:topology.out_start[s + 1]]   # connectors leaving segment 3
+
+Segments, lanes and connectors are numbered in insertion order, so the numbers stay valid when roads are added
+later, and every process that builds the same scenario numbers it the same way (see partition._restrict).
+"""
+import numpy as np
+
+
+class Topology:
+    def __init__(self, segments, connectors):
+        """
+        :param segments: {segment id: Segment}
+        :param connectors: {connector id: Connector}
+        """
+        self.segments = list(segments.values())
+        self.segment_index = {segment.id: i for i, segment in enumerate(self.segments)}
+        # lanes of segment s are lanes[lane_start[s]:lane_start[s + 1]]
+        self.lane_start = np.concatenate(([0], np.cumsum([len(segment.lanes) for segment in self.segments])))
+        self.lanes = [lane for segment in self.segments for lane in segment.lanes]
+
+        self.connectors = list(connectors.values())
+        self.connector_index = {connector.id: i for i, connector in enumerate(self.connectors)}
+        # -1 when the segment is not part of this network
+        self.connector_from = np.array([self.segment_index.get(c.from_segment, -1) for c in self.connectors], dtype=int)
+        self.connector_to = np.array([self.segment_index.get(c.to_segment, -1) for c in self.connectors], dtype=int)
+        # CSR adjacency: connectors leaving segment s are out_connectors[out_start[s]:out_start[s + 1]], the segments
+        # they lead to successors[...] of the same slice
+        order = np.argsort(self.connector_from, kind='stable')
+        order = order[self.connector_from[order] >= 0]
+        self.out_connectors = order
+        self.successors = self.connector_to[order]
+        self.out_start = np.searchsorted(self.connector_from[order], np.arange(len(self.segments) + 1))
+        # (from segment, to segment) -> connector
+        self.connector_between = {(int(self.connector_from[c]), int(self.connector_to[c])): c
+                                  for c in range(len(self.connectors))}
+
+        # Lane mapping of every connector. Indexed from Python once per transferred vehicle, where tuples are
+        # faster than NumPy scalars:
+        #   entry_lane[c][u]: key of the connection taken from upstream lane u, same as get_closest_lane(u); lanes
+        #                     past the end of the tuple map like its last entry
+        #   exit_lanes[c][key]: downstream lane keys of that connection, in connections order
+        self.entry_lane = []
+        self.exit_lanes = []
+        # name of the random stream of every connector (see Simulation.rng)
+        self.connector_stream = []
+        for connector in self.connectors:
+            upstream = len(segments[connector.from_segment].lanes) if connector.from_segment in segments else 0
+            size = max(upstream, max(int(key) for key in connector.connections) + 1)
+            self.entry_lane.append(tuple(connector.get_closest_lane(u) for u in range(size)))
+            self.exit_lanes.append({key: tuple(to_lanes) for key, to_lanes in connector.connections.items()})
+            self.connector_stream.append('connector/' + connector.id)
+
+        # path tuple -> (segments, connectors), shared by every vehicle on the path
+        self._routes = {}
+
+    def route(self, path):
+        """
+        :param path: segment ids
+        :return: (segments, connectors) int arrays, connectors[i] joins segments[i] and segments[i + 1],
+                 -1 where the network has no such segment / connector
+        """
+        key = tuple(path)
+        route = self._routes.get(key)
+        if route is None:
+            segments = np.array([self.segment_index.get(sid, -1) for sid in key], dtype=int)
+            connectors = np.array([self.connector_between.get((int(a), int(b)), -1) if a >= 0 and b >= 0 else -1
+                                   for a, b in zip(segments[:-1], segments[1:])], dtype=int)
+            segments.flags.writeable = False
+            connectors.flags.writeable = False
+            route = self._routes[key] = (segments, connectors)
+        return route
@@ -0,0 +1,313 @@
+"""
+Columnar trajectory recorder: a sample of every active vehicle at a fixed simulated interval.
+
+    sim.enable_trajectory_recorder('run.traj', interval=1.0)
+    ...
+    sim.disable_trajectory_recorder()
+
+    reader = TrajectoryReader('run.traj')
+    reader.read(t_min=600, t_max=900)                  # RECORD array of a time window
+    reader.read(vehicles=['12', '40'], fields=('t', 'px', 'py'))
+    python -m src.trajectory run.traj [--vehicle 12]  # summary / one trajectory as text
+
+Samples are taken from a Snapshot (positions through the vectorized road geometry) into a preallocated RECORD
+chunk; a full chunk is handed to a writer thread and recording goes on in a second one, so at most two chunks are
+held in memory and the step loop never waits for the disk (unless the writer falls a whole chunk behind).
+
+Directory layout: one chunk-NNNNNN.bin per chunk, the columns of RECORD stored one after the other (each padded to
+8 bytes) and read back through memory maps, plus index.json with the chunks (rows, time range, vehicle range) and
+the vehicle and road name tables, rewritten after every chunk. Within a chunk the rows are in time order, so a time
+window only maps the pages it covers and a vehicle selection reads the vehicle column only.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+from src.snapshot import Snapshot
+
+INDEX = 'index.json'
+FORMAT_VERSION = 1
+
+RECORD = np.dtype([
+    ('t', '<f8'),
+    # ids into the vehicle / road name tables
+    ('vehicle', '<i4'),
+    ('road', '<i4'),
+    # lane index on a segment, lane (connection key) on a connector
+    ('lane', '<i2'),
+    ('x', '<f4'),
+    ('v', '<f4'),
+    ('a', '<f4'),
+    # world position
+    ('px', '<f4'),
+    ('py', '<f4'),
+])
+
+SEGMENT, CONNECTOR = 'segment', 'connector'
+
+
+def column_offsets(rows):
+    """Byte offset of every RECORD column in a chunk of rows, and the chunk size"""
+    offsets = {}
+    size = 0
+    for name in RECORD.names:
+        offsets[name] = size
+        size += rows * RECORD[name].itemsize
+        size += -size % 8
+    return offsets, size
+
+
+class TrajectoryRecorder:
+    def __init__(self, path, interval=1.0, chunk_rows=1 << 18):
+        """
+        :param path: directory of the recording, created if needed
+        :param interval: simulated seconds between two samples
+        :param chunk_rows: rows per chunk file
+        """
+        self.path = path
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+        self.buffer = np.zeros(chunk_rows, dtype=RECORD)
+        self.rows = 0
+        self.next_sample = None
+
+        self.vehicles = {}
+        self.vehicle_names = []
+        # (kind, id) -> road number
+        self.roads = {}
+        self.road_names = []
+
+        # chunk number -> index entry, of the chunks written
+        self.chunks = {}
+        self.chunk_count = 0
+        self._lock = threading.Lock()
+        # buffers for the next chunk, at most one is ever waiting
+        self._free = queue.SimpleQueue()
+        self._free.put(np.zeros(chunk_rows, dtype=RECORD))
+        self._full = queue.SimpleQueue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name='trajectory-writer', daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _vehicle(self, vid):
+        number = self.vehicles.get(vid)
+        if number is None:
+            number = self.vehicles[vid] = len(self.vehicle_names)
+            self.vehicle_names.append(str(vid))
+        return number
+
+    def _road(self, road):
+        key = (CONNECTOR if hasattr(road, 'connections') else SEGMENT, str(road.id))
+        number = self.roads.get(key)
+        if number is None:
+            number = self.roads[key] = len(self.road_names)
+            self.road_names.append(key)
+        return number
+
+    def sample(self, simulation):
+        """Record the active vehicles if a sample is due, called after every step (see Simulation.update_with_lane)"""
+        if self.next_sample is not None and simulation.t < self.next_sample - 1e-9:
+            return
+        self.next_sample = simulation.t + self.interval
+        snapshot = Snapshot(simulation)
+        n = len(snapshot.ids)
+        if not n:
+            return
+        records = np.empty(n, dtype=RECORD)
+        records['t'] = snapshot.t
+        records['vehicle'] = [self._vehicle(vid) for vid in snapshot.ids]
+        road = records['road']
+        for obj, (start, stop) in snapshot.rows.items():
+            road[start:stop] = self._road(obj)
+        records['lane'] = snapshot.lane
+        records['x'] = snapshot.x
+        records['v'] = snapshot.v
+        records['a'] = snapshot.a
+        records['px'] = snapshot.xy[:, 0]
+        records['py'] = snapshot.xy[:, 1]
+        self.append(records)
+
+    def append(self, records):
+        done = 0
+        while done < len(records):
+            count = min(len(records) - done, self.chunk_rows - self.rows)
+            self.buffer[self.rows:self.rows + count] = records[done:done + count]
+            self.rows += count
+            done += count
+            if self.rows == self.chunk_rows:
+                self._rotate()
+
+    def _rotate(self):
+        """Hand the full buffer to the writer and go on in a free one, or write it here if there is none"""
+        number, rows = self.chunk_count, self.rows
+        self.chunk_count += 1
+        self.rows = 0
+        try:
+            buffer = self._free.get_nowait()
+        except queue.Empty:
+            self._write_chunk(number, self.buffer, rows)
+            return
+        self._full.put((number, self.buffer, rows))
+        self.buffer = buffer
+
+    def _run(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            number, buffer, rows = item
+            self._write_chunk(number, buffer, rows)
+            self._free.put(buffer)
+
+    def _write_chunk(self, number, buffer, rows):
+        name = 'chunk-%06d.bin' % number
+        records = buffer[:rows]
+        offsets, size = column_offsets(rows)
+        data = np.memmap(os.path.join(self.path, name), dtype=np.uint8, mode='w+', shape=(size,))
+        for field in RECORD.names:
+            dtype = RECORD[field]
+            start = offsets[field]
+            data[start:start + rows * dtype.itemsize].view(dtype)[:] = records[field]
+        data.flush()
+        del data
+        entry = {'file': name, 'rows': rows, 't_min': float(records['t'][0]), 't_max': float(records['t'][-1]),
+                 'vehicle_min': int(records['vehicle'].min()), 'vehicle_max': int(records['vehicle'].max())}
+        with self._lock:
+            self.chunks[number] = entry
+            self._write_index()
+
+    def _write_index(self):
+        index = {'version': FORMAT_VERSION, 'interval': self.interval,
+                 'chunks': [self.chunks[number] for number in sorted(self.chunks)],
+                 # names interned so far, a superset of those in the chunks listed
+                 'vehicles': list(self.vehicle_names), 'roads': [list(key) for key in list(self.road_names)]}
+        tmp = os.path.join(self.path, INDEX + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self.path, INDEX))
+
+    def close(self):
+        """Write the last, partial chunk and the final index"""
+        if self._closed:
+            return
+        self._closed = True
+        self._full.put(None)
+        self._writer.join()
+        if self.rows:
+            self._write_chunk(self.chunk_count, self.buffer, self.rows)
+            self.chunk_count += 1
+            self.rows = 0
+        with self._lock:
+            self._write_index()
+
+
+class TrajectoryReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX)) as f:
+            index = json.load(f)
+        if index['version'] != FORMAT_VERSION:
+            raise ValueError("%s: unsupported trajectory format %s" % (path, index['version']))
+        self.interval = index['interval']
+        self.chunks = index['chunks']
+        self.vehicle_names = index['vehicles']
+        self.vehicle_index = {name: i for i, name in enumerate(self.vehicle_names)}
+        # road number -> (SEGMENT or CONNECTOR, id)
+        self.road_names = [tuple(key) for key in index['roads']]
+        self._maps = {}
+
+    @property
+    def rows(self):
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    def _column(self, chunk, field):
+        data = self._maps.get(chunk['file'])
+        if data is None:
+            data = self._maps[chunk['file']] = np.memmap(os.path.join(self.path, chunk['file']), dtype=np.uint8,
+                                                         mode='r')
+        rows = chunk['rows']
+        start = column_offsets(rows)[0][field]
+        dtype = RECORD[field]
+        return data[start:start + rows * dtype.itemsize].view(dtype)
+
+    def read(self, t_min=None, t_max=None, vehicles=None, fields=None):
+        """
+        Rows with t_min <= t <= t_max of the given vehicles, in recording order
+        :param vehicles: vehicle ids, None for all
+        :param fields: RECORD fields to read, None for all
+        :return: structured array of those fields
+        """
+        fields = list(RECORD.names) if fields is None else list(fields)
+        dtype = np.dtype([(field, RECORD[field]) for field in fields])
+        wanted = None
+        if vehicles is not None:
+            wanted = np.array(sorted({self.vehicle_index[str(vid)] for vid in vehicles
+                                      if str(vid) in self.vehicle_index}), dtype=RECORD['vehicle'])
+            if not len(wanted):
+                return np.zeros(0, dtype=dtype)
+        parts = []
+        for chunk in self.chunks:
+            if t_min is not None and chunk['t_max'] < t_min or t_max is not None and chunk['t_min'] > t_max:
+                continue
+            if wanted is not None and (chunk['vehicle_max'] < wanted[0] or chunk['vehicle_min'] > wanted[-1]):
+                continue
+            start, stop = 0, chunk['rows']
+            if t_min is not None or t_max is not None:
+                t = self._column(chunk, 't')
+                if t_min is not None:
+                    start = int(np.searchsorted(t, t_min, side='left'))
+                if t_max is not None:
+                    stop = int(np.searchsorted(t, t_max, side='right'))
+            if start >= stop:
+                continue
+            rows = slice(start, stop)
+            if wanted is not None:
+                rows = start + np.flatnonzero(np.isin(self._column(chunk, 'vehicle')[start:stop], wanted))
+                if not len(rows):
+                    continue
+            part = np.empty(len(rows) if wanted is not None else stop - start, dtype=dtype)
+            for field in fields:
+                part[field] = self._column(chunk, field)[rows]
+            parts.append(part)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    def vehicle(self, vid, fields=None):
+        """Trajectory of one vehicle"""
+        return self.read(vehicles=[vid], fields=fields)
+
+    def close(self):
+        self._maps = {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a ToySim trajectory recording")
+    parser.add_argument('path', help="recording directory")
+    parser.add_argument('--vehicle', default=None, help="print the trajectory of this vehicle")
+    args = parser.parse_args(argv)
+    reader = TrajectoryReader(args.path)
+    if args.vehicle is None:
+        t_min = min((chunk['t_min'] for chunk in reader.chunks), default=None)
+        t_max = max((chunk['t_max'] for chunk in reader.chunks), default=None)
+        print("%s: %d rows in %d chunks, %d vehicles, %d roads, t %s .. %s, every %ss" % (
+            args.path, reader.rows, len(reader.chunks), len(reader.vehicle_names), len(reader.road_names),
+            t_min, t_max, reader.interval))
+        return
+    for record in reader.vehicle(args.vehicle):
+        kind, rid = reader.road_names[record['road']]
+        print("t=%.2f %s %s lane %d x=%.2f v=%.2f a=%.2f (%.2f, %.2f)" % (
+            record['t'], kind, rid, record['lane'], record['x'], record['v'], record['a'], record['px'], record['py']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Online travel-time and delay statistics per segment, per connector movement and per generator route.
+
+    stats = sim.enable_travel_times(quantiles=(0.5, 0.9, 0.95), start=300)
+    sim.run(...)
+    stats.segments['0-0-3'].delay.mean                  # any time during the run
+    stats.routes['vg0-0-3 0-0-3>0-0-5>1-0-3>1-0-5'].travel_time.quantile(0.9)
+    stats.summary()                                      # everything as nested dicts, see TravelStats.summary
+
+Vehicles carry the time they entered the network (trip_start) and their current segment or connector
+(entered_t), set by the simulator on every transfer. When a vehicle leaves a road its travel time and its delay
+(travel time minus the free-flow time, road length / desired speed) are added to the statistics of the road, or
+of the connector movement (connector, from lane, to lane); when it leaves the network the same is done for its
+trip, keyed by generator and path. Every statistic keeps count, mean and variance (Welford), minimum, maximum and
+P-square estimates of the quantiles (Jain & Chlamtac), so memory does not grow with the length of the run.
+"""
+import math
+from collections import defaultdict
+
+
+def free_flow_time(length, veh):
+    """
+    Time to cover length at the vehicle's desired speed, Vehicle._v_max: v_max is lowered while a red signal
+    slows the vehicle down
+    """
+    return length / veh._v_max
+
+
+class RunningStats:
+    """Count, mean and variance by Welford's update, minimum and maximum"""
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        """Sample variance, NaN below two values"""
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class P2Quantile:
+    """
+    P-square estimate of the p-quantile: five markers whose heights are adjusted by piecewise-parabolic
+    interpolation as values arrive, exact up to five values
+    """
+    __slots__ = ('p', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        desired = self.desired
+        for i in range(5):
+            desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if d >= 1 and n[i + 1] - n[i] > 1 or d <= -1 and n[i - 1] - n[i] < -1:
+                d = 1 if d > 0 else -1
+                # parabolic prediction, linear when it would leave the neighbours' interval
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return math.nan
+        if len(q) < 5 or self.positions[4] == 5:
+            # the values themselves, linear interpolation between the closest ranks
+            f = self.p * (len(q) - 1)
+            i = int(f)
+            return q[i] if i + 1 >= len(q) else q[i] + (f - i) * (q[i + 1] - q[i])
+        return q[2]
+
+
+class OnlineStats:
+    """RunningStats plus one P2Quantile per quantile"""
+    __slots__ = ('running', 'quantiles')
+
+    def __init__(self, quantiles):
+        self.running = RunningStats()
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        self.running.add(x)
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    @property
+    def count(self):
+        return self.running.count
+
+    @property
+    def mean(self):
+        return self.running.mean if self.running.count else math.nan
+
+    @property
+    def variance(self):
+        return self.running.variance
+
+    def quantile(self, p):
+        for quantile in self.quantiles:
+            if quantile.p == p:
+                return quantile.value()
+        raise KeyError("quantile %s is not tracked" % p)
+
+    def summary(self):
+        running = self.running
+        summary = {'count': running.count, 'mean': self.mean, 'std': running.std if running.count > 1 else math.nan,
+                   'min': running.min if running.count else math.nan,
+                   'max': running.max if running.count else math.nan}
+        for quantile in self.quantiles:
+            summary['p%g' % (quantile.p * 100)] = quantile.value()
+        return summary
+
+
+class TravelStats:
+    """Travel time and delay (s) of the traversals of one segment, connector movement or route"""
+    __slots__ = ('travel_time', 'delay')
+
+    def __init__(self, quantiles):
+        self.travel_time = OnlineStats(quantiles)
+        self.delay = OnlineStats(quantiles)
+
+    def add(self, travel_time, free_flow_time):
+        self.travel_time.add(travel_time)
+        self.delay.add(travel_time - free_flow_time)
+
+    @property
+    def count(self):
+        return self.travel_time.count
+
+    def summary(self):
+        return {'travel_time': self.travel_time.summary(), 'delay': self.delay.summary()}
+
+
+class TravelTimeStats:
+    def __init__(self, simulation, quantiles=(0.5, 0.9, 0.95), start=0.0):
+        """
+        :param quantiles: quantiles estimated for every statistic
+        :param start: simulation time before which nothing is counted (warm-up), a traversal counts when it ends
+                      after start
+        """
+        self.simulation = simulation
+        self.quantiles = tuple(quantiles)
+        self.start = start
+        self.segments = defaultdict(self._new)
+        # (connector id, from lane, to lane) -> TravelStats
+        self.movements = defaultdict(self._new)
+        # route_key(vehicle) -> TravelStats
+        self.routes = defaultdict(self._new)
+        # path tuple -> length (m) of its segments and connectors
+        self._route_lengths = {}
+
+    def _new(self):
+        return TravelStats(self.quantiles)
+
+    @staticmethod
+    def route_key(veh):
+        """Generator and path of a vehicle, as 'generator segment>segment>...'"""
+        return '%s %s' % (getattr(veh, 'vg_id', None), '>'.join(veh.path))
+
+    def left_segment(self, segment, veh, t):
+        if t >= self.start and veh.entered_t is not None:
+            self.segments[segment.id].add(t - veh.entered_t, free_flow_time(segment.length, veh))
+
+    def left_connector(self, connector, from_lane, to_lane, veh, t):
+        if t >= self.start and veh.entered_t is not None:
+            self.movements[(connector.id, from_lane, to_lane)].add(t - veh.entered_t,
+                                                                  free_flow_time(connector.length, veh))
+
+    def trip_done(self, veh, t):
+        if t < self.start or veh.trip_start is None:
+            return
+        path = tuple(veh.path)
+        length = self._route_lengths.get(path)
+        if length is None:
+            topology = self.simulation.get_topology()
+            length = self._route_lengths[path] = sum(topology.segments[s].length for s in veh.route if s >= 0) + sum(
+                topology.connectors[c].length for c in veh.route_connectors if c >= 0)
+        self.routes[self.route_key(veh)].add(t - veh.trip_start, free_flow_time(length, veh))
+
+    def summary(self):
+        """
+        :return: {'segments': {id: ...}, 'movements': {'connector from>to': ...}, 'routes': {key: ...}}, every
+                 entry {'travel_time': {...}, 'delay': {...}} with count, mean, std, min, max and the quantiles
+        """
+        return {
+            # items copied first, the simulation may add entries meanwhile when it runs in another thread
+            'segments': {sid: stats.summary() for sid, stats in list(self.segments.items())},
+            'movements': {'%s %s>%s' % key: stats.summary() for key, stats in list(self.movements.items())},
+            'routes': {key: stats.summary() for key, stats in list(self.routes.items())},
+        }
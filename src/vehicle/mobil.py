@@ -0,0 +1,133 @@
+import numpy as np
+
+# constants of Vehicle.calculate_incentive / evaluate_and_perform_lane_change
+REJECT = -1000
+# extra clearance to the target leader / follower on top of the vehicle length
+MIN_GAP = 2
+# the target follower may not be forced to brake harder than this
+FOLLOWER_A_LIMIT = -4
+THRESHOLD = 0.2
+# additional bias against changing to the right lane
+RIGHT_BIAS = 0.2
+
+
+def neighbours(batch, x, egos, target_group):
+    """
+    Find the leader and follower of every ego vehicle in its target lane, for all lane pairs at once.
+    Positions of the target lanes and of the egos are merged in a single sort; ties count the target
+    vehicle as ahead, except for the head of the lane (same as VehicleChain.search).
+    :param x: positions in batch order
+    :param egos: batch indices of the egos
+    :param target_group: batch group of each ego's target lane, -1 for an empty lane
+    :return: batch indices of the target leader and follower, -1 if none
+    """
+    n = len(batch)
+    leader = np.full(len(egos), -1, dtype=np.int64)
+    follower = np.full(len(egos), -1, dtype=np.int64)
+    occupied = target_group >= 0
+    if not occupied.any():
+        return leader, follower
+    egos = egos[occupied]
+    target_group = target_group[occupied]
+
+    starts = batch.starts
+    ends = batch.ends
+
+    group = np.concatenate((batch.group, target_group))
+    neg_x = np.concatenate((-x, -x[egos]))
+    # on equal keys vehicles of the batch sort before the queries
+    is_query = np.concatenate((np.zeros(n, dtype=np.int8), np.ones(len(egos), dtype=np.int8)))
+    order = np.lexsort((is_query, neg_x, group))
+    vehicles_before = np.cumsum(is_query[order] == 0)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    # vehicles of the target lane at or ahead of the ego
+    ahead = vehicles_before[position[n:]] - starts[target_group]
+
+    head = starts[target_group]
+    behind_head = x[head] > x[egos]
+    lead = np.where(behind_head & (ahead > 0), head + ahead - 1, -1)
+    follow = np.where(behind_head, head + ahead, head)
+    follow = np.where(follow < ends[target_group], follow, -1)
+
+    leader[occupied] = lead
+    follower[occupied] = follow
+    return leader, follower
+
+
+def incentives(arrays, batch, present_a, egos, target_group):
+    """
+    Vectorized Vehicle.calculate_incentive of every ego towards its target lane
+    :return: incentive and batch index of the target leader, which identifies the target gap
+    """
+    slots = batch.slots
+    x = arrays.x[slots]
+    leader, follower = neighbours(batch, x, egos, target_group)
+    has_leader = leader >= 0
+    has_follower = follower >= 0
+
+    ego_slots = slots[egos]
+    leader_slots = np.where(has_leader, slots[leader], -1)
+    follower_slots = np.where(has_follower, slots[follower], -1)
+
+    ego_x = x[egos]
+    clearance = arrays.length[ego_slots] + MIN_GAP
+    unsafe = (has_leader & (x[leader] - ego_x < clearance)) | (has_follower & (ego_x - x[follower] < clearance))
+
+    target_a = arrays.idm(ego_slots, leader_slots)
+    follow_a_latent = np.zeros(len(egos))
+    follow_a = np.zeros(len(egos))
+    if has_follower.any():
+        follow_a_latent[has_follower] = arrays.idm(follower_slots[has_follower], ego_slots[has_follower])
+        follow_a[has_follower] = arrays.idm(follower_slots[has_follower], leader_slots[has_follower])
+
+    politeness = arrays.politeness[ego_slots]
+    incentive = target_a - present_a[egos] - politeness * (follow_a_latent - follow_a) - THRESHOLD
+    incentive[(follow_a_latent <= FOLLOWER_A_LIMIT) | unsafe] = REJECT
+    return incentive, leader
+
+
+def lane_changes(arrays, batch, present_a, candidates, left_lane, right_lane, lane_group):
+    """
+    Batched MOBIL decision for every lane of the batch.
+    :param present_a: acceleration of every vehicle if it stays in its lane
+    :param candidates: boolean array over the batch, vehicles allowed to change lane
+    :param left_lane: per vehicle, number of its left neighbour lane, -1 if there is none
+    :param right_lane: per vehicle, number of its right neighbour lane, -1 if there is none
+    :param lane_group: per lane number, its batch group, -1 for a lane without vehicles
+    :return: batch indices of the vehicles that change lane and their target lane numbers
+    """
+    egos = np.flatnonzero(candidates)
+    if not len(egos):
+        return egos, egos
+
+    side = {}
+    for name, lanes in (('left', left_lane), ('right', right_lane)):
+        target = lanes[egos]
+        exists = target >= 0
+        incentive = np.full(len(egos), -np.inf)
+        leader = np.full(len(egos), -1, dtype=np.int64)
+        if exists.any():
+            incentive[exists], leader[exists] = incentives(
+                arrays, batch, present_a, egos[exists], lane_group[target[exists]])
+        side[name] = (incentive, leader, target)
+
+    left_incentive = side['left'][0]
+    right_incentive = side['right'][0]
+    go_left = (left_incentive > right_incentive) & (left_incentive > 0)
+    go_right = ~go_left & (right_incentive > left_incentive) & (right_incentive > RIGHT_BIAS)
+
+    accepted = go_left | go_right
+    left = go_left[accepted]
+    incentive = np.where(left, left_incentive[accepted], right_incentive[accepted])
+    leader = np.where(left, side['left'][1][accepted], side['right'][1][accepted])
+    target_lane = np.where(left, side['left'][2][accepted], side['right'][2][accepted])
+    egos = egos[accepted]
+
+    # conflict resolution: one vehicle per target gap, the one with the largest incentive wins
+    order = np.lexsort((-incentive, leader, target_lane))
+    gap = np.stack((target_lane[order], leader[order]))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(gap[:, 1:] != gap[:, :-1], axis=0)
+    keep = np.sort(order[first])
+    return egos[keep], target_lane[keep]
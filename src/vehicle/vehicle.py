@@ -2,7 +2,6 @@ import uuid
 import numpy as np
 from src.geometry.lanes import Lane
 from typing import List
-import logging
 
 
 # create Vehicle class for simulation
@@ -14,8 +13,11 @@ class Vehicle:
         # update config
         self.update_config(config)
 
+        # set by the VehicleChain of the lane (or the connector queue) holding the vehicle
         self.lead = None
         self.follow = None
+        # block of the VehicleChain holding the vehicle, None when not on a lane
+        self.lane_block = None
         self.present_a = None
 
         self.dt = 1 / 60
@@ -31,6 +33,13 @@ class Vehicle:
         # 通过连接器进入下一个路段的lane_id
         self.to_lane = None
 
+        # slot in VehicleArrays when the simulation runs the vectorized engine
+        self.slot = None
+
+        # simulation time the vehicle entered the network / its current segment or connector, None before
+        self.trip_start = None
+        self.entered_t = None
+
     def set_default_config(self):
         self.id = uuid.uuid4()
 
@@ -48,6 +57,9 @@ class Vehicle:
         self.b_max = 9
 
         self.path = []
+        # path as segment / connector numbers of Simulation.get_topology(), set when the vehicle is added
+        self.route = None
+        self.route_connectors = None
         self.current_road_index = 0
         self.at_lane = None
 
@@ -121,14 +133,14 @@ class Vehicle:
                 right_incentive, r_leader, r_follower, target_a_r = self.calculate_incentive(lanes[2])
 
                 if left_incentive > right_incentive and left_incentive > 0:
-                    self.implement_lane_change(lanes[0], lanes[1], l_leader, l_follower)
+                    self.implement_lane_change(lanes[0], lanes[1], l_leader)
 
                     # print(self.id, "now:", self.t, "lc_unlock_t:", self.lc_unlock_t)
                     # if l_leader and l_leader.x - self.x < 2.5:
                     # print("close lc crash hazard:", self.id, "left", l_leader.id, self.x, l_leader.x, l_follower.x, left_incentive, target_a_l)
                     return target_a_l
                 elif right_incentive > left_incentive and right_incentive > 0.2:  # Add bias to right side
-                    self.implement_lane_change(lanes[0], lanes[2], r_leader, r_follower)
+                    self.implement_lane_change(lanes[0], lanes[2], r_leader)
                     return target_a_r
                 else:
                     return self.present_a
@@ -136,7 +148,7 @@ class Vehicle:
             elif lanes[1]:
                 left_incentive, l_leader, l_follower, target_a_l = self.calculate_incentive(lanes[1])
                 if left_incentive > 0:
-                    self.implement_lane_change(lanes[0], lanes[1], l_leader, l_follower)
+                    self.implement_lane_change(lanes[0], lanes[1], l_leader)
                     return target_a_l
                 else:
                     return self.present_a
@@ -144,7 +156,7 @@ class Vehicle:
             elif lanes[2]:
                 right_incentive, r_leader, r_follower, target_a_r = self.calculate_incentive(lanes[2])
                 if right_incentive > 0.2:  # Add bias to right side
-                    self.implement_lane_change(lanes[0], lanes[2], r_leader, r_follower)
+                    self.implement_lane_change(lanes[0], lanes[2], r_leader)
                     return target_a_r
                 else:
                     return self.present_a
@@ -154,54 +166,25 @@ class Vehicle:
             # print("lc_refused")
             return self.present_a
 
-    def implement_lane_change(self, present_lane: Lane, target_lane: Lane, target_lead, target_follow):
+    def implement_lane_change(self, present_lane: Lane, target_lane: Lane, target_lead):
         """
-        修改目标lane链表：将ego_car插入并更新链表状态
+        将ego_car插入目标lane，前后车关系由lane维护
         :param present_lane: lane where vehicle is currently on
         :param target_lane: lane where vehicle wants to go
-        :param target_lead: lead vehicle of target_lane after moving into
-        :param target_follow: follow vehicle of target_lane after moving into
+        :param target_lead: lead vehicle of target_lane after moving into, None to become the head
         """
-        logging.info("IMPLEMENT LC: %s, %s TO %s, POS: %s" % (self.id, present_lane.lane_id, target_lane.lane_id, self.x))
         present_lane.remove_vehicle(self)
-        insert_loc = 0
-        if target_lead:
-            target_lead.follow = self
-            self.lead = target_lead
-            insert_loc = target_lead.location_in_lane + 1
-        if target_follow:
-            target_follow.lead = self
-            self.follow = target_follow
-        target_lane.vehicles.insert(insert_loc, self)
+        target_lane.insert_vehicle(self, target_lead)
         self.at_lane = target_lane.lane_index
         self.lc_unlock_t = self.t + self.lc_gap
 
-
     def search_adjacent_lane(self, target_lane: Lane):
         """
-        Use bisection search to identify lead and follow vehicle of adjacent lane
+        Identify lead and follow vehicle of adjacent lane, O(log n) search in the lane's VehicleChain
         :param target_lane: where vehicle wants to go
         :return: lead and follow vehicle of target_lane
         """
-        if target_lane.vehicles:
-            if target_lane.vehicles[0].x > self.x > target_lane.vehicles[-1].x:
-                lead_id = 0
-                follow_id = len(target_lane.vehicles) - 1
-                while follow_id - lead_id > 1:
-                    i = (lead_id + follow_id) // 2
-                    if target_lane.vehicles[i].x >= self.x:
-                        lead_id = i
-                    else:
-                        follow_id = i
-                return target_lane.vehicles[lead_id], target_lane.vehicles[follow_id]
-            elif target_lane.vehicles[0].x < self.x:
-                return None, target_lane.vehicles[0]
-            elif target_lane.vehicles[-1].x > self.x:
-                return target_lane.vehicles[-1], None
-            else:
-                return None, None
-        else:
-            return None, None
+        return target_lane.vehicles.search(self.x)
 
     def calculate_incentive(self, target_lane: Lane):
         # 假设target_vehicle是目标车道上当前车辆前方的车辆
@@ -258,15 +241,7 @@ class Vehicle:
 
     @property
     def location_in_lane(self):
-        loc = 0
-        check = self
-        while check.lead:
-            check = check.lead
-            loc += 1
-            # if loc>50:
-            #     print('possible chain list error: ',self.lead.id, self.id, self.follow.id)
-            #     break
-        return loc
+        return self.lane_block.chain.index(self)
 
     def stop(self):
         self.stopped = True
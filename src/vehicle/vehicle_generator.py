@@ -1,7 +1,6 @@
 import random
 
 from src.vehicle.vehicle import Vehicle
-from numpy.random import randint
 
 
 class VehicleGenerator:
@@ -25,6 +24,9 @@ class VehicleGenerator:
         # record num of vehicles generated
         self.num = 0
 
+        # random.Random of the generator, None samples from the global random module (see Simulation.set_seed)
+        self.rng = None
+
         # Calculate properties
         self.init_properties()
 
@@ -35,15 +37,38 @@ class VehicleGenerator:
             (1, {})
         ]
         self.last_added_time = 0
+        # shortest paths of vehicle configs given by 'origin' / 'destination': 'length' or 'free_flow'
+        self.route_weight = 'length'
 
     def init_properties(self):
         self.upcoming_vehicle = self.generate_vehicle()
 
+    def set_rng(self, rng):
+        """Sample from rng from now on, the upcoming vehicle is drawn again"""
+        self.rng = rng
+        self.num = 0
+        self.upcoming_vehicle = self.generate_vehicle()
+
+    def resolve_paths(self, simulation):
+        """
+        Give every vehicle config with 'origin' and 'destination' (and no 'path') its shortest path, and check
+        the explicit paths against the network
+        """
+        router = simulation.get_router(self.route_weight)
+        for _, veh_config in self.vehicles:
+            if veh_config.get('path'):
+                router.check_path(veh_config['path'])
+            elif 'destination' in veh_config:
+                veh_config['path'] = router.path(veh_config['origin'], veh_config['destination'])
+        # drawn before the paths were known
+        vehicle = self.upcoming_vehicle
+        if not vehicle.path and getattr(vehicle, 'destination', None) is not None:
+            vehicle.path = router.path(vehicle.origin, vehicle.destination)
+
     def generate_vehicle(self):
         """Returns a random vehicle from self.vehicles with random proportions"""
         total = sum(pair[0] for pair in self.vehicles)
-        random.seed(42)
-        r = randint(1, total + 1)
+        r = (self.rng or random).randint(1, total)
         for (weight, veh_config) in self.vehicles:
             veh_config.update({'vg_id': self.vg_id, 'vg_num': self.num, 'id': str(self.vg_id)+'_'+str(self.num)})
             r -= weight
@@ -0,0 +1,25 @@
+"""
+    python -m pytest tst/replication_test.py
+"""
+import pytest
+
+from src.replication import KPICollector
+from src.runner import load_scenario
+
+
+def test_segment_delay_matches_travel_time_stats():
+    # signalised approaches: vehicles leave them while a red signal still lowers their v_max
+    sim = load_scenario('examples.grid')
+    sim.set_seed(0)
+    collector = KPICollector(sim)
+    sim.event_log = collector
+    travel_times = sim.enable_travel_times()
+    sim.run(3600)
+
+    segments = collector.kpis(sim.t)['segments']
+    compared = 0
+    for sid, stats in travel_times.summary()['segments'].items():
+        if stats['delay']['count']:
+            assert segments[sid]['delay'] == pytest.approx(stats['delay']['mean'], abs=1e-9)
+            compared += 1
+    assert compared